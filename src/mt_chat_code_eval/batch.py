@@ -0,0 +1,298 @@
+# This module contains functions to run evaluations through
+# a provider Batch API (OpenAI Batch JSONL format) instead of
+# sending a synchronous request per conversation.
+
+import json
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Callable, Dict, Final, Hashable, List, Tuple, Union
+
+from mt_chat_code_eval.clients import get_client
+from mt_chat_code_eval.evaluation import build_conversation_prompt, evaluation_turns
+from mt_chat_code_eval.llm_abstract import LLM, ConversationSnapshot
+from mt_chat_code_eval.llm_fabric import is_openai_model
+from mt_chat_code_eval.steps import ModelTurn
+
+# OpenAI SDK is imported with the client, see clients.py
+if TYPE_CHECKING:
+    from openai import OpenAI as OpenAI_API
+
+logger = logging.getLogger(__name__)
+
+_completions_url: Final = "/v1/chat/completions"
+
+# Batch statuses after which the batch will not change anymore
+_final_statuses = {"completed", "failed", "expired", "cancelled"}
+
+
+def build_batch_requests(
+    model_name: str,
+    messages: Dict[str, List[Dict[str, str]]],
+    generation_params: Dict[str, object],
+) -> List[Dict[str, object]]:
+    # Extra body parameters are merged into the request body, as the SDK does
+    params = dict(generation_params)
+    extra_body: Dict = params.pop("extra_body", None) or {}  # type: ignore
+
+    return [
+        {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": _completions_url,
+            "body": {
+                "model": model_name,
+                "messages": request_messages,
+                **params,
+                **extra_body,
+            },
+        }
+        for custom_id, request_messages in messages.items()
+    ]
+
+
+def parse_batch_output(output: str) -> Dict[str, Union[str, None]]:
+    results: Dict[str, Union[str, None]] = {}
+
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+
+        record = json.loads(line)
+        response = record.get("response") or {}
+
+        if record.get("error") is None and response.get("status_code") == 200:
+            body = response["body"]
+            results[record["custom_id"]] = body["choices"][0]["message"]["content"]
+        else:
+            logger.error(
+                "Batch request %s failed: %s",
+                record["custom_id"],
+                record.get("error") or response,
+            )
+            results[record["custom_id"]] = None
+
+    return results
+
+
+# Base class for batch job clients
+class BatchClient(ABC):
+    @abstractmethod
+    def submit(self, requests: List[Dict[str, object]]) -> str:
+        pass
+
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        pass
+
+    @abstractmethod
+    def results(self, batch_id: str) -> Dict[str, Union[str, None]]:
+        pass
+
+
+class OpenAIBatchClient(BatchClient):
+    def __init__(self, model_name: str, client: Union["OpenAI_API", None] = None):
+        # Batch API of OpenAI runs only the models it serves,
+        # requests of other models would fail after the batch is uploaded
+        if not is_openai_model(model_name):
+            raise ValueError(
+                f"Model {model_name} is not served by OpenAI, "
+                "it can't be run through OpenAI Batch API"
+            )
+
+        self.client = client if client is not None else get_client("openai")
+
+    def submit(self, requests: List[Dict[str, object]]) -> str:
+        content = "\n".join(json.dumps(request) for request in requests)
+
+        input_file = self.client.files.create(
+            file=("batch.jsonl", content.encode("utf-8")), purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=_completions_url,
+            completion_window="24h",
+        )
+
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> Dict[str, Union[str, None]]:
+        batch = self.client.batches.retrieve(batch_id)
+
+        results: Dict[str, Union[str, None]] = {}
+        for file_id in [batch.output_file_id, batch.error_file_id]:
+            if file_id is not None:
+                results |= parse_batch_output(self.client.files.content(file_id).text)
+
+        return results
+
+
+# File based stand-in for the Batch API, so batch runs can be done offline.
+# Input and output files use the same JSONL format as OpenAI Batch API.
+# If responder is given, the batch is answered right on submit, otherwise
+# the output file is expected to be written by another process.
+class LocalBatchClient(BatchClient):
+    def __init__(
+        self,
+        directory: str,
+        responder: Union[Callable[[List[Dict[str, str]]], str], None] = None,
+    ):
+        self.directory = directory
+        self.responder = responder
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _path(self, batch_id: str, kind: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}.{kind}.jsonl")
+
+    def submit(self, requests: List[Dict[str, object]]) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+
+        with open(self._path(batch_id, "input"), "w", encoding="utf-8") as file:
+            for request in requests:
+                file.write(json.dumps(request) + "\n")
+
+        if self.responder is not None:
+            self._respond(batch_id, requests)
+
+        return batch_id
+
+    def _respond(self, batch_id: str, requests: List[Dict[str, object]]) -> None:
+        # Output is written to a temporary file first,
+        # so it appears for the status check only when it is complete
+        output_path = self._path(batch_id, "output")
+
+        with open(output_path + ".tmp", "w", encoding="utf-8") as file:
+            for request in requests:
+                body: Dict = request["body"]  # type: ignore
+                content = self.responder(body["messages"])  # type: ignore
+                record = {
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {"choices": [{"message": {"content": content}}]},
+                    },
+                    "error": None,
+                }
+                file.write(json.dumps(record) + "\n")
+
+        os.replace(output_path + ".tmp", output_path)
+
+    def status(self, batch_id: str) -> str:
+        if os.path.exists(self._path(batch_id, "output")):
+            return "completed"
+        return "in_progress"
+
+    def results(self, batch_id: str) -> Dict[str, Union[str, None]]:
+        with open(self._path(batch_id, "output"), "r", encoding="utf-8") as file:
+            return parse_batch_output(file.read())
+
+
+def run_batch(
+    client: BatchClient,
+    requests: List[Dict[str, object]],
+    poll_interval: float = 30.0,
+) -> Dict[str, Union[str, None]]:
+    batch_id = client.submit(requests)
+    print(f"Submitted batch {batch_id} with {len(requests)} requests")
+
+    status = client.status(batch_id)
+    while status not in _final_statuses:
+        time.sleep(poll_interval)
+        status = client.status(batch_id)
+
+    if status != "completed":
+        print(f"Batch {batch_id} finished with status {status}")
+
+    return client.results(batch_id)
+
+
+def llm_responder(llm: LLM) -> Callable[[List[Dict[str, str]]], str]:
+    # Answers batch requests with the model, e.g. for LocalBatchClient.
+    # Requests that continue an answered conversation, like the re-asks
+    # of missing sections, continue from the snapshot of its answer
+    snapshots: Dict[Tuple[str, ...], ConversationSnapshot] = {}
+
+    def _respond(messages: List[Dict[str, str]]) -> str:
+        contents = tuple(message["content"] for message in messages)
+
+        if len(contents) == 1:
+            answer = llm.start_conversation(contents[0])
+        elif contents[:-1] in snapshots:
+            llm.restore(snapshots[contents[:-1]])
+            answer = llm.continue_conversation(contents[-1])
+        else:
+            raise ValueError("Request continues a conversation that wasn't answered")
+
+        snapshots[contents + (answer,)] = llm.snapshot()
+        return answer
+
+    return _respond
+
+
+def evaluate_conversations_batch(
+    client: BatchClient,
+    model_name: str,
+    conversations: Dict[Hashable, List[str]],
+    generation_params: Dict[str, object],
+    retries: int = 1,
+    poll_interval: float = 30.0,
+) -> Dict[
+    Hashable,
+    Tuple[Union[str, None], Union[bool, None], Union[bool, None], Union[bool, None]],
+]:
+    # Batch custom ids must be strings, we map them back to the conversation keys
+    keys = {str(key): key for key in conversations}
+
+    # Evaluations take the same turns as in evaluate_prompt: incomplete ones
+    # ask only for the missing sections in the same evaluator conversation.
+    # Next turns of all evaluations are sent together in a new, smaller batch
+    steps = {
+        custom_id: evaluation_turns(
+            build_conversation_prompt(conversations[key]), retries
+        )
+        for custom_id, key in keys.items()
+    }
+    turns: Dict[str, ModelTurn] = {
+        custom_id: next(evaluation) for custom_id, evaluation in steps.items()
+    }
+    histories: Dict[str, List[Dict[str, str]]] = {}
+
+    evaluations = {}
+
+    while turns:
+        messages = {
+            custom_id: (histories[custom_id] if not turn.start else [])
+            + [{"role": "user", "content": turn.prompt}]
+            for custom_id, turn in turns.items()
+        }
+
+        responses = run_batch(
+            client,
+            build_batch_requests(model_name, messages, generation_params),
+            poll_interval,
+        )
+
+        next_turns = {}
+
+        for custom_id in turns:
+            # Failed requests are parsed as empty answers, so they are asked again
+            response = responses.get(custom_id) or ""
+            histories[custom_id] = messages[custom_id] + [
+                {"role": "assistant", "content": response}
+            ]
+
+            try:
+                next_turns[custom_id] = steps[custom_id].send(response)
+            except StopIteration as stop:
+                evaluations[keys[custom_id]] = stop.value
+
+        turns = next_turns
+
+    return evaluations
@@ -0,0 +1,115 @@
+# This module contains a persistent cache for LLM responses.
+# Responses are stored in SQLite and addressed by a hash of the model name,
+# its backend, the full list of messages and generation parameters,
+# so re-runs over already seen conversation turns don't query the API again.
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Union
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        path: str,
+        max_entries: Union[int, None] = None,
+        ttl: Union[float, None] = None,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        # One connection is shared by all worker threads, the lock serializes it
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT, created REAL, accessed REAL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+
+    @staticmethod
+    def make_key(
+        model_name: str,
+        messages: List[str],
+        params: Dict[str, object],
+        namespace: Union[str, None] = None,
+    ) -> str:
+        # Namespace tells apart backends that serve a model under the same name,
+        # keys without it stay the same as before it was added
+        fields = {"model_name": model_name, "messages": messages, "params": params}
+        if namespace is not None:
+            fields["namespace"] = namespace
+
+        key = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Union[str, None]:
+        now = time.time()
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and self.ttl is not None and row[1] < now - self.ttl:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+
+        return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        if self.ttl is not None:
+            self._connection.execute(
+                "DELETE FROM responses WHERE created < ?", (now - self.ttl,)
+            )
+
+        if self.max_entries is not None:
+            # Least recently used responses are dropped first
+            self._connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            (entries,) = self._connection.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()
+
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
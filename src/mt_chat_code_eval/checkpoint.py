@@ -0,0 +1,83 @@
+# This module contains a journal of completed rows, so a long
+# evaluation run can be checkpointed as it goes and resumed after a crash.
+
+import json
+import os
+import threading
+from typing import Dict, Hashable, Iterator, Set
+
+import pandas as pd
+
+
+def _to_json(value: object) -> object:
+    # Results contain numpy scalars (e.g. metrics computed by pandas)
+    if hasattr(value, "item"):
+        return value.item()
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value)} is not JSON serializable")
+
+
+class ResultJournal:
+    def __init__(self, path: str):
+        self.path = path
+
+        self._lock = threading.Lock()
+
+    def _records(self) -> Iterator[Dict]:
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                # The last line may be cut if the process was killed mid-write
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def completed_ids(self) -> Set[object]:
+        # Rows that failed are not considered completed, so they are retried
+        completed: Set[object] = set()
+
+        for record in self._records():
+            if "error" in record["result"]:
+                completed.discard(record["id"])
+            else:
+                completed.add(record["id"])
+
+        return completed
+
+    def append(
+        self, index: Hashable, question_id: object, result: Dict[str, object]
+    ) -> None:
+        line = json.dumps(
+            {"index": index, "id": question_id, "result": result},
+            default=_to_json,
+            ensure_ascii=False,
+        )
+
+        with self._lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    def has_errors(self) -> bool:
+        failed = {
+            record["index"]: "error" in record["result"] for record in self._records()
+        }
+        return any(failed.values())
+
+    def to_dataframe(self) -> pd.DataFrame:
+        # Rows can be journaled several times (e.g. a failed row that was
+        # retried on resume), the latest record of each row wins.
+        # All results of the run are loaded at once: the metrics, the result
+        # file and the result store are written from one frame, so results
+        # of a run have to fit in memory. Larger runs are split with --shard
+        results = {record["index"]: record["result"] for record in self._records()}
+
+        return pd.DataFrame.from_dict(results, orient="index").sort_index()
+
+    def clear(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
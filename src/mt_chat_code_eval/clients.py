@@ -0,0 +1,171 @@
+# This module contains the registry of API clients. Clients are created once
+# per provider and shared by all LLM instances of the process, so parallel
+# workers reuse one HTTP connection pool instead of opening their own,
+# and LLM instances keep only the conversation state.
+
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Tuple, Union
+
+# Provider SDKs are imported only when a client is created,
+# so runs that don't use a provider don't pay for its import
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI as AsyncOpenAI_API
+    from openai import OpenAI as OpenAI_API
+
+
+class ClientSettings:
+    def __init__(
+        self,
+        max_connections: Union[int, None] = 100,
+        max_keepalive_connections: Union[int, None] = 20,
+        keepalive_expiry: Union[float, None] = 5.0,
+        timeout: Union[float, None] = None,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        # Request timeout in seconds, None keeps the default of the provider SDK
+        self.timeout = timeout
+
+
+# Connection arguments of OpenAI compatible providers
+_openai_providers: Dict[str, Callable[[], Dict[str, object]]] = {
+    "openai": lambda: {
+        "organization": os.getenv("OPENAI_API_ORG"),
+        "project": os.getenv("OPENAI_API_PROJECT"),
+    },
+    "aimlapi": lambda: {
+        "api_key": os.getenv("AIMLAPI_KEY"),
+        "base_url": "https://api.aimlapi.com/v1",
+    },
+}
+
+# Models served by local OpenAI compatible servers (vLLM, llama.cpp server,
+# TGI), keyed by the model name used in the runs
+local_models: Dict[str, Dict[str, Any]] = {}
+
+_client_settings: Dict[str, ClientSettings] = {}
+
+_clients: Dict[Tuple[str, bool], Union["OpenAI_API", "AsyncOpenAI_API"]] = {}
+_gemini_configured = False
+_lock = threading.Lock()
+
+
+def set_client_settings(provider: str, settings: ClientSettings) -> None:
+    # Settings apply to the clients created after this call
+    with _lock:
+        _client_settings[provider] = settings
+        for key in [key for key in _clients if key[0].split(":")[0] == provider]:
+            del _clients[key]
+
+
+def get_client_settings(provider: str) -> ClientSettings:
+    # Settings of "local" provider apply to all local servers
+    return _client_settings.get(
+        provider, _client_settings.get(provider.split(":")[0], ClientSettings())
+    )
+
+
+def parse_client_settings(client_settings: List[str]) -> None:
+    # Settings are given as
+    # PROVIDER=MAX_CONNECTIONS[:MAX_KEEPALIVE_CONNECTIONS[:KEEPALIVE_EXPIRY[:TIMEOUT]]]
+    for setting in client_settings:
+        provider, values = setting.rsplit("=", 1)
+        parts = (values.split(":") + ["", "", "", ""])[:4]
+        defaults = ClientSettings()
+        set_client_settings(
+            provider,
+            ClientSettings(
+                int(parts[0]) if parts[0] else defaults.max_connections,
+                int(parts[1]) if parts[1] else defaults.max_keepalive_connections,
+                float(parts[2]) if parts[2] else defaults.keepalive_expiry,
+                float(parts[3]) if parts[3] else defaults.timeout,
+            ),
+        )
+
+
+def register_local_model(
+    model_name: str,
+    base_url: str,
+    served_model: Union[str, None] = None,
+    api_key: Union[str, None] = None,
+    extra_body: Union[Dict[str, Any], None] = None,
+) -> None:
+    # Models of one server share its client, local servers
+    # don't check the key, but the SDK requires one
+    provider = f"local:{base_url}"
+    _openai_providers[provider] = lambda: {
+        "api_key": api_key or "EMPTY",
+        "base_url": base_url,
+    }
+    local_models[model_name] = {
+        "provider": provider,
+        "served_model": served_model or model_name,
+        "extra_body": extra_body or {},
+    }
+
+
+def _create_openai_client(
+    provider: str, is_async: bool
+) -> Union["OpenAI_API", "AsyncOpenAI_API"]:
+    from openai import DEFAULT_CONNECTION_LIMITS
+    from openai import AsyncOpenAI as AsyncOpenAI_API
+    from openai import DefaultAsyncHttpxClient, DefaultHttpxClient
+    from openai import OpenAI as OpenAI_API
+
+    settings = get_client_settings(provider)
+
+    # Limits are built with the class of the SDK defaults, so the pool is set up
+    # through the HTTP library the SDK ships with, without importing it here
+    limits = type(DEFAULT_CONNECTION_LIMITS)(
+        max_connections=settings.max_connections,
+        max_keepalive_connections=settings.max_keepalive_connections,
+        keepalive_expiry=settings.keepalive_expiry,
+    )
+
+    client_params = _openai_providers[provider]()
+    if settings.timeout is not None:
+        client_params["timeout"] = settings.timeout
+
+    if is_async:
+        return AsyncOpenAI_API(
+            **client_params,  # type: ignore
+            http_client=DefaultAsyncHttpxClient(limits=limits),
+        )
+    return OpenAI_API(
+        **client_params,  # type: ignore
+        http_client=DefaultHttpxClient(limits=limits),
+    )
+
+
+def get_client(provider: str) -> "OpenAI_API":
+    if provider not in _openai_providers:
+        raise ValueError(f"Provider {provider} not found in the available providers")
+    with _lock:
+        if (provider, False) not in _clients:
+            _clients[(provider, False)] = _create_openai_client(provider, False)
+        return _clients[(provider, False)]  # type: ignore
+
+
+def get_async_client(provider: str) -> "AsyncOpenAI_API":
+    # Async client is bound to the event loop it is used in,
+    # runners use one event loop per process
+    if provider not in _openai_providers:
+        raise ValueError(f"Provider {provider} not found in the available providers")
+    with _lock:
+        if (provider, True) not in _clients:
+            _clients[(provider, True)] = _create_openai_client(provider, True)
+        return _clients[(provider, True)]  # type: ignore
+
+
+def configure_gemini() -> None:
+    # Gemini SDK keeps its client in a global configuration,
+    # it is configured once instead of every time a model is created
+    import google.generativeai as gemini
+
+    global _gemini_configured
+    with _lock:
+        if not _gemini_configured:
+            gemini.configure(api_key=os.environ["GEMINI_API_KEY"])
+            _gemini_configured = True
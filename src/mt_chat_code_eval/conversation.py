@@ -1,85 +1,305 @@
 # This module contains the functions to run a
 # conversation with a model and a LLM evaluator.
 
-from typing import List, Tuple
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    NamedTuple,
+    Sequence,
+    Tuple,
+    Union,
+)
 
-import pandas as pd
+import numpy as np
 
-from mt_chat_code_eval.evaluation import evaluate_conversation
-from mt_chat_code_eval.llm_abstract import LLM
+from mt_chat_code_eval.evaluation import (
+    EvaluationPromptBuilder,
+    evaluate_prompt,
+    evaluate_prompt_async,
+)
+from mt_chat_code_eval.evaluation_store import EvaluationRecord, EvaluationStore
+from mt_chat_code_eval.llm_abstract import LLM, AsyncLLM, ConversationSnapshot, _LLMBase
+from mt_chat_code_eval.policies import FullPolicy, StopPolicy, should_stop_conversation
+from mt_chat_code_eval.steps import (
+    ModelTurn,
+    run_steps,
+    run_steps_async,
+    take_turn,
+    take_turn_async,
+)
 
 
-def build_conversation(
-    prompt: str, model: LLM, evaluators: List[LLM], max_steps: int = 5
-) -> Tuple[List[str], bool, pd.DataFrame]:
-    model.start_conversation(prompt)
-
-    evaluations_df = pd.DataFrame(
-        columns=[
-            "model_name",
-            "step",
-            "followup",
-            "understanding",
-            "correctness",
-            "completeness",
-        ]
+def _followup_candidates(current_eval: List[EvaluationRecord]) -> List[str]:
+    # Follow-ups of the evaluators that found the answer incomplete
+    return [
+        r.followup
+        for r in current_eval
+        if not r.completeness and r.followup is not None and r.followup.strip() != ""
+    ]
+
+
+def _select_followup(
+    current_eval: List[EvaluationRecord], random_state: np.random.RandomState
+) -> Union[str, None]:
+    followups = _followup_candidates(current_eval)
+
+    if len(followups) > 0:
+        # Same draw as DataFrame.sample(1), so seeded runs stay reproducible
+        return followups[random_state.choice(len(followups), 1, replace=False)[0]]
+    else:
+        return None
+
+
+def _label_calls(model: _LLMBase, evaluators: Sequence[_LLMBase], step: int) -> None:
+    # Labels are attached to the telemetry records of the following calls
+    model.labels.update(role="model", step=step)
+    for evaluator in evaluators:
+        evaluator.labels.update(role="evaluator", step=step)
+
+
+# Wave of evaluators that are queried with the same evaluation prompt,
+# its result is the evaluations in the order of the wave
+class EvaluatorWave(NamedTuple):
+    evaluators: List[int]
+    prompt: str
+
+
+Evaluation = Tuple[
+    Union[str, None], Union[bool, None], Union[bool, None], Union[bool, None]
+]
+
+
+def _evaluation_waves(
+    evaluator_names: List[str],
+    policy: StopPolicy,
+    evaluations: EvaluationStore,
+    step: int,
+    evaluation_prompt: str,
+) -> Generator[EvaluatorWave, List[Evaluation], None]:
+    # Policy decides which evaluators are queried, wave after wave
+    queried: List[int] = []
+
+    while wave := policy.next_wave(
+        evaluator_names, queried, evaluations.step_view(step)
+    ):
+        step_evaluations = yield EvaluatorWave(wave, evaluation_prompt)
+
+        # Results come back in the order of evaluators,
+        # so the evaluations table stays deterministic
+        for k, evaluation in zip(wave, step_evaluations):
+            evaluations.add(evaluator_names[k], step, evaluation)
+
+        queried += wave
+
+
+def _query_wave(
+    executor: ThreadPoolExecutor,
+    evaluators: Sequence[LLM],
+    wave: EvaluatorWave,
+    evaluate: Callable[[LLM, str], Evaluation] = evaluate_prompt,
+) -> List[Evaluation]:
+    # Evaluators of one wave are independent from each other,
+    # so we query them at the same time and wait for the slowest one
+    return list(
+        executor.map(lambda k: evaluate(evaluators[k], wave.prompt), wave.evaluators)
     )
 
+
+# Model turns and evaluations of the conversations of one model on one
+# question. Conversations that share a transcript prefix (e.g. with other
+# evaluator panels or seeds) continue from the snapshots of its turns,
+# and evaluations of the same transcript by the same evaluator are reused
+class ConversationTree:
+    def __init__(self) -> None:
+        self._turns: Dict[Tuple[str, ...], ConversationSnapshot] = {}
+        self._evaluations: Dict[Tuple[str, str], Evaluation] = {}
+
+        self.reused_turns = 0
+        self.reused_evaluations = 0
+
+    def take_turn(self, model: LLM, turn: ModelTurn) -> str:
+        prefix = [] if turn.start else model.get_current_conversation()
+        key = tuple(prefix + [turn.prompt])
+
+        if key in self._turns:
+            model.restore(self._turns[key])
+            self.reused_turns += 1
+            return model.get_current_conversation()[-1]
+
+        answer = take_turn(model, turn)
+        self._turns[key] = model.snapshot()
+        return answer
+
+    def evaluate(self, evaluator: LLM, prompt: str) -> Evaluation:
+        key = (evaluator.model_name, prompt)
+
+        if key in self._evaluations:
+            self.reused_evaluations += 1
+            return self._evaluations[key]
+
+        evaluation = evaluate_prompt(evaluator, prompt)
+        self._evaluations[key] = evaluation
+        return evaluation
+
+
+async def _query_wave_async(
+    evaluators: Sequence[AsyncLLM], wave: EvaluatorWave
+) -> List[Evaluation]:
+    return list(
+        await asyncio.gather(
+            *[
+                evaluate_prompt_async(evaluators[k], wave.prompt)
+                for k in wave.evaluators
+            ]
+        )
+    )
+
+
+def _evaluate_step(
+    executor: ThreadPoolExecutor,
+    evaluators: Sequence[LLM],
+    policy: StopPolicy,
+    evaluations: EvaluationStore,
+    step: int,
+    evaluation_prompt: str,
+) -> None:
+    run_steps(
+        _evaluation_waves(
+            [evaluator.model_name for evaluator in evaluators],
+            policy,
+            evaluations,
+            step,
+            evaluation_prompt,
+        ),
+        lambda wave: _query_wave(executor, evaluators, wave),
+    )
+
+
+def _conversation_steps(
+    prompt: str,
+    model: _LLMBase,
+    evaluators: Sequence[_LLMBase],
+    max_steps: int,
+    seed: Union[int, None],
+    policy: Union[StopPolicy, None],
+    start: Union[ConversationSnapshot, None],
+) -> Generator[
+    Union[ModelTurn, EvaluatorWave], Any, Tuple[List[str], bool, EvaluationStore]
+]:
+    # Steps of the conversation, see steps.run_steps. Model turns
+    # and evaluator waves are made by the blocking or async driver
+    if policy is None:
+        policy = FullPolicy()
+
+    _label_calls(model, evaluators, 0)
+
+    # Model answer to the prompt can be taken from the snapshot made after
+    # start_conversation(prompt), e.g. to run several seeds or evaluators
+    if start is not None:
+        model.restore(start)
+    else:
+        yield ModelTurn(prompt, start=True)
+
+    evaluations = EvaluationStore()
+
+    random_state = np.random.RandomState(seed)
+
+    # Evaluation prompt grows with the conversation, so we render
+    # only the newest question and answer at every step
+    prompt_builder = EvaluationPromptBuilder()
+
+    evaluator_names = [evaluator.model_name for evaluator in evaluators]
+
     for i in range(max_steps):
-        for evaluator in evaluators:
-            followup, understanding, correctness, completeness = evaluate_conversation(
-                evaluator, model.get_current_conversation()
-            )
-
-            evaluations_df = pd.concat(
-                [
-                    evaluations_df,
-                    pd.DataFrame(
-                        [
-                            {
-                                "model_name": evaluator.model_name,
-                                "step": i,
-                                "followup": followup,
-                                "understanding": understanding,
-                                "correctness": correctness,
-                                "completeness": completeness,
-                            }
-                        ]
-                    ),
-                ]
-            )
-
-        current_eval = evaluations_df[evaluations_df["step"] == i]
-
-        # We are checking following conditions to stop the conversation:
-        # - All evaluators agree that the model understands the questions
-        # - All evaluators agree that the model provides correct answers
-        # - At least one evaluator agrees that the model provides full answers
-        should_stop = (
-            current_eval["understanding"].all(skipna=True)
-            & current_eval["correctness"].all(skipna=True)
-            & current_eval["completeness"].any(skipna=True)
+        evaluation_prompt = prompt_builder.build(model.get_current_conversation())
+
+        _label_calls(model, evaluators, i)
+
+        yield from _evaluation_waves(
+            evaluator_names, policy, evaluations, i, evaluation_prompt
         )
 
+        current_eval = evaluations.step_view(i)
+
+        should_stop = should_stop_conversation(current_eval)
+
         if should_stop:
             break
         else:
-            follow_up_df = current_eval[
-                ~current_eval["completeness"]
-                & ~current_eval["followup"].isna()
-                & ~current_eval["followup"].str.strip().eq("")
-            ]
+            followup = _select_followup(current_eval, random_state)
 
-            if len(follow_up_df) > 0:
-                model.continue_conversation(follow_up_df.sample(1).iloc[0]["followup"])
+            if followup is not None:
+                model.labels["step"] = i + 1
+                yield ModelTurn(followup)
             else:
                 # It should be a rare case when conversation is not complete
                 # but no follow-up questions are found
-                # We will consider in this case that the model failed the conversation
+                # We will consider in this case that the model failed
+                # the conversation
                 break
 
     # We will consider conversation successful if it was stopped
     # by evaluators and not because we reached the max steps
     is_successful = should_stop
 
-    return model.get_current_conversation(), is_successful, evaluations_df
+    return model.get_current_conversation(), is_successful, evaluations
+
+
+def build_conversation(
+    prompt: str,
+    model: LLM,
+    evaluators: List[LLM],
+    max_steps: int = 5,
+    seed: Union[int, None] = None,
+    policy: Union[StopPolicy, None] = None,
+    start: Union[ConversationSnapshot, None] = None,
+    tree: Union[ConversationTree, None] = None,
+) -> Tuple[List[str], bool, EvaluationStore]:
+    steps = _conversation_steps(
+        prompt, model, evaluators, max_steps, seed, policy, start
+    )
+
+    # Turns and evaluations that are already in the tree are not made again
+    turn: Callable[[LLM, ModelTurn], str] = take_turn
+    evaluate: Callable[[LLM, str], Evaluation] = evaluate_prompt
+    if tree is not None:
+        turn, evaluate = tree.take_turn, tree.evaluate
+
+    with ThreadPoolExecutor(max_workers=max(len(evaluators), 1)) as executor:
+        return run_steps(
+            steps,
+            lambda request: (
+                turn(model, request)
+                if isinstance(request, ModelTurn)
+                else _query_wave(executor, evaluators, request, evaluate)
+            ),
+        )
+
+
+async def build_conversation_async(
+    prompt: str,
+    model: AsyncLLM,
+    evaluators: List[AsyncLLM],
+    max_steps: int = 5,
+    seed: Union[int, None] = None,
+    policy: Union[StopPolicy, None] = None,
+    start: Union[ConversationSnapshot, None] = None,
+) -> Tuple[List[str], bool, EvaluationStore]:
+    # Same as build_conversation, but for the async model and evaluators
+    steps = _conversation_steps(
+        prompt, model, evaluators, max_steps, seed, policy, start
+    )
+
+    return await run_steps_async(
+        steps,
+        lambda request: (
+            take_turn_async(model, request)
+            if isinstance(request, ModelTurn)
+            else _query_wave_async(evaluators, request)
+        ),
+    )
@@ -2,27 +2,62 @@
 # to evaluate a conversation using the LLM evaluator.
 
 import re
-from typing import List, Tuple, Union
+from typing import Generator, List, Tuple, Union
 
-from mt_chat_code_eval.llm_abstract import LLM
-from mt_chat_code_eval.prompts import (
-    evaluation_end_prompt,
-    evaluation_qa_prompt,
-    evaluation_start_prompt,
+from mt_chat_code_eval import prompts
+from mt_chat_code_eval.llm_abstract import LLM, AsyncLLM
+from mt_chat_code_eval.steps import (
+    ModelTurn,
+    run_steps,
+    run_steps_async,
+    take_turn,
+    take_turn_async,
 )
 
 
-def _build_conversation_prompt(conversation: list) -> str:
-    qa_pairs = [(q, a) for q, a in zip(conversation[::2], conversation[1::2])]
+def _render_qa_pairs(conversation: List[str]) -> List[str]:
+    return [
+        prompts.evaluation_qa_prompt.format(question=q, answer=a)
+        for q, a in zip(conversation[::2], conversation[1::2])
+    ]
+
+
+def build_conversation_prompt(conversation: List[str]) -> str:
+    return "".join(
+        [prompts.evaluation_start_prompt]
+        + _render_qa_pairs(conversation)
+        + [prompts.evaluation_end_prompt]
+    )
+
 
-    prompt = evaluation_start_prompt
+# Builds evaluation prompts for a growing conversation. It keeps the rendered
+# prefix of already seen question/answer pairs, so each step renders only the
+# newest pair. This saves only the rendering on our side: every step still
+# sends the whole prompt as one new evaluator conversation, the same prompt
+# as build_conversation_prompt gives, so verdicts stay comparable with the
+# published ones. Prefix caching of the providers (e.g. OpenAI) applies to
+# these prompts as to any other, since their prefix doesn't change.
+class EvaluationPromptBuilder:
+    def __init__(self) -> None:
+        self._prefix = prompts.evaluation_start_prompt
+        self._conversation: List[str] = []
 
-    for q, a in qa_pairs:
-        prompt += evaluation_qa_prompt.format(question=q, answer=a)
+    def build(self, conversation: List[str]) -> str:
+        rendered = len(self._conversation)
 
-    prompt += evaluation_end_prompt
+        # Conversation has to be a continuation of the already rendered one,
+        # otherwise (e.g. it was restarted) we render it from the start
+        if conversation[:rendered] != self._conversation:
+            self._prefix = prompts.evaluation_start_prompt
+            rendered = 0
 
-    return prompt
+        # Only complete question/answer pairs are rendered into the prefix
+        rendered_until = len(conversation) - len(conversation) % 2
+
+        self._prefix += "".join(_render_qa_pairs(conversation[rendered:rendered_until]))
+        self._conversation = conversation[:rendered_until]
+
+        return self._prefix + prompts.evaluation_end_prompt
 
 
 def _concert_to_bool(string: str) -> Union[bool, None]:
@@ -35,50 +70,239 @@ def _concert_to_bool(string: str) -> Union[bool, None]:
 
 
 def _section_to_regex(section: str) -> str:
-    return section.replace(" ", "\\s*") + "((?:.|\\n)*)"
+    return section.replace(" ", "\\s*")
+
+
+_response_sections = [
+    "### Follow-up question",
+    "### Understanding",
+    "### Correctness",
+    "### Completeness",
+]
+
+# Headers of all sections are found in one scan of the response,
+# the index of the matched group is the index of the section.
+# Common "###" prefix is kept out of the groups, so the scan can look for it
+# as a literal and skip the rest of the text quickly.
+_headers_regex = re.compile(
+    "###\\s*(?:"
+    + "|".join(
+        f"({_section_to_regex(section.removeprefix('### '))})"
+        for section in _response_sections
+    )
+    + ")",
+    flags=re.IGNORECASE,
+)
+
+_Span = Tuple[int, int]
+
+
+def _find_headers(response: str) -> List[List[_Span]]:
+    headers: List[List[_Span]] = [[] for _ in _response_sections]
+    for match in _headers_regex.finditer(response):
+        headers[match.lastindex - 1].append(match.span())  # type: ignore
+    return headers
+
+
+def _select_headers(headers: List[List[_Span]]) -> Union[List[_Span], None]:
+    # Strict fast path: every header is present once and in the right order
+    if all(len(spans) == 1 for spans in headers):
+        selected = [spans[0] for spans in headers]
+        if all(a[1] <= b[0] for a, b in zip(selected, selected[1:])):
+            return selected
+
+    # Otherwise we select the same headers as the greedy regex used to:
+    # the first follow-up header and then the last completeness, correctness
+    # and understanding headers going from the end of the response
+    if not headers[0]:
+        return None
+
+    first = headers[0][0]
+    selected = [first]
+    limit = None
+
+    for spans in reversed(headers[1:]):
+        candidates = [
+            span
+            for span in spans
+            if span[0] >= first[1] and (limit is None or span[1] <= limit)
+        ]
+        if not candidates:
+            return None
+        selected.insert(1, candidates[-1])
+        limit = candidates[-1][0]
+
+    return selected
+
+
+def _parse_sections(response: str) -> List[Union[str, None]]:
+    # Returns the text of every section, None for the missing sections
+    headers = _find_headers(response)
+
+    selected = _select_headers(headers)
+
+    if selected is not None:
+        ends = [span[0] for span in selected[1:]] + [len(response)]
+        return [response[start:end] for (_, start), end in zip(selected, ends)]
+
+    # Tolerant fallback for the incomplete answer: each found section
+    # lasts until the next header of any section
+    starts = sorted(span[0] for spans in headers for span in spans)
+
+    sections: List[Union[str, None]] = []
+    for spans in headers:
+        if spans:
+            start = spans[0][1]
+            end = next((s for s in starts if s >= start), len(response))
+            sections.append(response[start:end])
+        else:
+            sections.append(None)
+
+    return sections
+
+
+def _is_parsable(response: str) -> bool:
+    # All sections are present and in order
+    return _select_headers(_find_headers(response)) is not None
+
+
+def parse_evaluation(
+    response: str,
+) -> Tuple[Union[str, None], Union[bool, None], Union[bool, None], Union[bool, None]]:
+    followup, understanding, correctness, completeness = [
+        section.strip() if section is not None else None
+        for section in _parse_sections(response)
+    ]
+
+    return (
+        followup,
+        _concert_to_bool(understanding) if understanding is not None else None,
+        _concert_to_bool(correctness) if correctness is not None else None,
+        _concert_to_bool(completeness) if completeness is not None else None,
+    )
+
+
+def _missing_sections(
+    followup: Union[str, None],
+    understanding: Union[bool, None],
+    correctness: Union[bool, None],
+    completeness: Union[bool, None],
+) -> List[str]:
+    # Sections that are absent or don't have a valid value.
+    # Follow-up question is required only if the answer can be incomplete.
+    missing = [
+        section
+        for section, value in zip(
+            _response_sections[1:], [understanding, correctness, completeness]
+        )
+        if value is None
+    ]
+
+    if followup is None and completeness is not True:
+        missing.insert(0, _response_sections[0])
+
+    return missing
+
+
+def is_incomplete_evaluation(
+    followup: Union[str, None],
+    understanding: Union[bool, None],
+    correctness: Union[bool, None],
+    completeness: Union[bool, None],
+) -> bool:
+    return (
+        len(_missing_sections(followup, understanding, correctness, completeness)) > 0
+    )
+
+
+def _merge_evaluations(
+    evaluation: Tuple[
+        Union[str, None], Union[bool, None], Union[bool, None], Union[bool, None]
+    ],
+    addition: Tuple[
+        Union[str, None], Union[bool, None], Union[bool, None], Union[bool, None]
+    ],
+) -> Tuple[Union[str, None], Union[bool, None], Union[bool, None], Union[bool, None]]:
+    # Values of the first evaluation are kept, only missing ones are added
+    followup, understanding, correctness, completeness = [
+        value if value is not None else added
+        for value, added in zip(evaluation, addition)
+    ]
+    return followup, understanding, correctness, completeness  # type: ignore
+
+
+def _build_missing_prompt(missing: List[str]) -> str:
+    return prompts.evaluation_missing_prompt.format(sections="\n".join(missing))
+
+
+def evaluation_turns(prompt: str, retries: int) -> Generator[
+    ModelTurn,
+    str,
+    Tuple[Union[str, None], Union[bool, None], Union[bool, None], Union[bool, None]],
+]:
+    # Turns of the evaluator conversation, they are driven by steps.run_steps
+    # or sent in batches by batch.evaluate_conversations_batch
+    response = yield ModelTurn(prompt, start=True)
+
+    evaluation = parse_evaluation(response)
+
+    # Sometimes the model may not provide all the required information
+    # We retry the evaluation in this case
+    for _ in range(retries):
+        missing = _missing_sections(*evaluation)
+
+        if len(missing) == 0:
+            break
+
+        if len(missing) == len(_response_sections):
+            # Nothing can be reused (e.g. the call failed), so we start again
+            evaluation = parse_evaluation((yield ModelTurn(prompt, start=True)))
+        else:
+            # Evaluator is asked only for the missing sections
+            # in the same conversation, which is much shorter than a new one
+            response = yield ModelTurn(_build_missing_prompt(missing))
+            evaluation = _merge_evaluations(evaluation, parse_evaluation(response))
+
+    return evaluation
+
+
+def evaluate_prompt(
+    llm_evaluator: LLM, prompt: str, retries: int = 1
+) -> Tuple[Union[str, None], Union[bool, None], Union[bool, None], Union[bool, None]]:
+    # Unparsable answers are not cached, otherwise the retry
+    # and the next runs would get the same answer from the cache
+    llm_evaluator.cache_validator = _is_parsable
+
+    return run_steps(
+        evaluation_turns(prompt, retries),
+        lambda turn: take_turn(llm_evaluator, turn),
+    )
 
 
 def evaluate_conversation(
     llm_evaluator: LLM, conversation: List[str], retries: int = 1
 ) -> Tuple[Union[str, None], Union[bool, None], Union[bool, None], Union[bool, None]]:
     # We gather all conversation history in one big prompt for evaluation
-    prompt = _build_conversation_prompt(conversation)
+    prompt = build_conversation_prompt(conversation)
 
-    response = llm_evaluator.start_conversation(prompt)
+    return evaluate_prompt(llm_evaluator, prompt, retries)
 
-    response_sections = [
-        "### Follow-up question",
-        "### Understanding",
-        "### Correctness",
-        "### Completeness",
-    ]
 
-    regex = "".join([_section_to_regex(section) for section in response_sections])
+async def evaluate_prompt_async(
+    llm_evaluator: AsyncLLM, prompt: str, retries: int = 1
+) -> Tuple[Union[str, None], Union[bool, None], Union[bool, None], Union[bool, None]]:
+    # Same as evaluate_prompt, but for the async evaluators
+    llm_evaluator.cache_validator = _is_parsable
 
-    response_regex = re.compile(regex, flags=re.IGNORECASE)
+    return await run_steps_async(
+        evaluation_turns(prompt, retries),
+        lambda turn: take_turn_async(llm_evaluator, turn),
+    )
 
-    response_match = response_regex.search(response)
 
-    if response_match:
-        followup = response_match.group(1).strip()
-        understanding = _concert_to_bool(response_match.group(2).strip())
-        correctness = _concert_to_bool(response_match.group(3).strip())
-        completeness = _concert_to_bool(response_match.group(4).strip())
-    else:
-        followup = None
-        understanding = None
-        correctness = None
-        completeness = None
-
-    if (
-        understanding is None
-        or correctness is None
-        or completeness is None
-        or (completeness is False and followup is None)
-    ):
-        if retries > 0:
-            # Sometimes the model may not provide all the required information
-            # We retry the evaluation in this case
-            return evaluate_conversation(llm_evaluator, conversation, retries - 1)
-
-    return followup, understanding, correctness, completeness
+async def evaluate_conversation_async(
+    llm_evaluator: AsyncLLM, conversation: List[str], retries: int = 1
+) -> Tuple[Union[str, None], Union[bool, None], Union[bool, None], Union[bool, None]]:
+    prompt = build_conversation_prompt(conversation)
+
+    return await evaluate_prompt_async(llm_evaluator, prompt, retries)
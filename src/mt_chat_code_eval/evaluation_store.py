@@ -0,0 +1,124 @@
+# This module contains a compact store of evaluation verdicts.
+# Verdicts are accumulated in plain column lists and a DataFrame is built
+# only when it is requested, so conversations don't pay for DataFrame
+# construction on every evaluator call.
+
+from typing import Dict, Hashable, List, Tuple, Union
+
+import pandas as pd
+
+_columns = [
+    "conversation_id",
+    "model_name",
+    "step",
+    "followup",
+    "understanding",
+    "correctness",
+    "completeness",
+]
+
+
+# One verdict of one evaluator at one step of a conversation
+class EvaluationRecord:
+    __slots__ = _columns
+
+    def __init__(
+        self,
+        conversation_id: Hashable,
+        model_name: str,
+        step: int,
+        followup: Union[str, None],
+        understanding: Union[bool, None],
+        correctness: Union[bool, None],
+        completeness: Union[bool, None],
+    ):
+        self.conversation_id = conversation_id
+        self.model_name = model_name
+        self.step = step
+        self.followup = followup
+        self.understanding = understanding
+        self.correctness = correctness
+        self.completeness = completeness
+
+
+class EvaluationStore:
+    def __init__(self, conversation_id: Hashable = None):
+        self.conversation_id = conversation_id
+
+        self._data: Dict[str, List] = {column: [] for column in _columns}
+
+        # Positions of the rows of each step, steps are added one after another
+        self._steps: Dict[Tuple[Hashable, int], List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._data["step"])
+
+    def add(
+        self,
+        model_name: str,
+        step: int,
+        evaluation: Tuple[
+            Union[str, None], Union[bool, None], Union[bool, None], Union[bool, None]
+        ],
+        conversation_id: Hashable = None,
+    ) -> None:
+        if conversation_id is None:
+            conversation_id = self.conversation_id
+
+        followup, understanding, correctness, completeness = evaluation
+
+        self._steps.setdefault((conversation_id, step), []).append(len(self))
+
+        self._data["conversation_id"].append(conversation_id)
+        self._data["model_name"].append(model_name)
+        self._data["step"].append(step)
+        self._data["followup"].append(followup)
+        self._data["understanding"].append(understanding)
+        self._data["correctness"].append(correctness)
+        self._data["completeness"].append(completeness)
+
+    def step_view(
+        self, step: int, conversation_id: Hashable = None
+    ) -> List[EvaluationRecord]:
+        if conversation_id is None:
+            conversation_id = self.conversation_id
+
+        return [
+            EvaluationRecord(*[self._data[column][position] for column in _columns])
+            for position in self._steps.get((conversation_id, step), [])
+        ]
+
+    def extend(self, other: "EvaluationStore", conversation_id: Hashable) -> None:
+        # Verdicts of many conversations can be gathered in one run-level store
+        for position in range(len(other)):
+            self.add(
+                other._data["model_name"][position],
+                other._data["step"][position],
+                (
+                    other._data["followup"][position],
+                    other._data["understanding"][position],
+                    other._data["correctness"][position],
+                    other._data["completeness"][position],
+                ),
+                conversation_id,
+            )
+
+    def to_records(self) -> List[Dict[str, object]]:
+        # Verdicts as a list of plain dicts, so they can be stored with results
+        return [
+            {column: self._data[column][position] for column in _columns[1:]}
+            for position in range(len(self))
+        ]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        columns = _columns if self._has_conversation_ids() else _columns[1:]
+
+        return pd.DataFrame(
+            {column: pd.Series(self._data[column], dtype=object) for column in columns}
+        ).astype({"step": int})
+
+    def _has_conversation_ids(self) -> bool:
+        return any(
+            conversation_id is not None
+            for conversation_id in self._data["conversation_id"]
+        )
@@ -0,0 +1,271 @@
+# This module contains exploration of follow-up questions. Instead of one
+# sampled follow-up per step, distinct follow-ups of the evaluators are
+# explored as branches of a conversation tree, so a question gets a success
+# rate over the branches instead of one high-variance outcome. The tree is
+# explored level by level, branches of a level run concurrently, and the
+# number of branches and planned calls are bounded by budgets.
+
+import copy
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+from typing import Dict, List, Tuple, Union
+
+from mt_chat_code_eval.conversation import (
+    _evaluate_step,
+    _followup_candidates,
+    _label_calls,
+)
+from mt_chat_code_eval.evaluation import EvaluationPromptBuilder
+from mt_chat_code_eval.evaluation_store import EvaluationRecord, EvaluationStore
+from mt_chat_code_eval.llm_abstract import LLM, ConversationSnapshot
+from mt_chat_code_eval.policies import FullPolicy, StopPolicy, should_stop_conversation
+
+
+class CallBudget:
+    def __init__(self, max_calls: Union[int, None] = None):
+        self.max_calls = max_calls
+        self.planned = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, calls: int) -> bool:
+        # Calls are counted as planned requests,
+        # retries and re-asks of missing sections are not counted
+        with self._lock:
+            if self.max_calls is not None and self.planned + calls > self.max_calls:
+                return False
+            self.planned += calls
+            return True
+
+
+# One branch of the conversation tree, it ends as a leaf when the evaluators
+# stop the conversation, there is no follow-up or a budget is exhausted
+class Branch:
+    __slots__ = ["snapshot", "evaluations", "followups", "weight", "prompt_builder"]
+
+    def __init__(
+        self,
+        snapshot: Union[ConversationSnapshot, None],
+        evaluations: EvaluationStore,
+        followups: List[str],
+        weight: float,
+        prompt_builder: EvaluationPromptBuilder,
+    ):
+        self.snapshot = snapshot
+        self.evaluations = evaluations
+        self.followups = followups
+        # Probability that a run with one sampled follow-up per step
+        # takes this branch, among the explored branches
+        self.weight = weight
+        self.prompt_builder = prompt_builder
+
+
+def _normalize_followup(followup: str) -> str:
+    return re.sub(r"\W+", " ", followup.casefold()).strip()
+
+
+def dedupe_followups(
+    followups: List[str], similarity: float = 0.9
+) -> List[Tuple[str, int]]:
+    # Near-identical follow-ups are grouped, the first one of the group
+    # represents it. Returns representatives with the sizes of their groups
+    groups: List[Tuple[str, str, int]] = []
+
+    for followup in followups:
+        normalized = _normalize_followup(followup)
+        for i, (representative, group_key, size) in enumerate(groups):
+            if SequenceMatcher(None, normalized, group_key).ratio() >= similarity:
+                groups[i] = (representative, group_key, size + 1)
+                break
+        else:
+            groups.append((followup, normalized, 1))
+
+    return [(representative, size) for representative, _, size in groups]
+
+
+def _copy_store(evaluations: EvaluationStore) -> EvaluationStore:
+    copied = EvaluationStore(evaluations.conversation_id)
+    copied.extend(evaluations, evaluations.conversation_id)
+    return copied
+
+
+def _run_step(
+    evaluator_executor: ThreadPoolExecutor,
+    prompt: str,
+    model: LLM,
+    evaluators: List[LLM],
+    policy: StopPolicy,
+    branch: Branch,
+    followup: Union[str, None],
+    step: int,
+) -> Tuple[Branch, List[EvaluationRecord]]:
+    # Every step runs on its own forks of the model and evaluators,
+    # since branches of a level run at the same time
+    model = model.fork(branch.snapshot) if branch.snapshot else model.fork()
+    evaluators = [evaluator.fork() for evaluator in evaluators]
+
+    _label_calls(model, evaluators, step)
+
+    if branch.snapshot is None:
+        model.start_conversation(prompt)
+    else:
+        model.continue_conversation(followup)  # type: ignore
+
+    evaluations = _copy_store(branch.evaluations)
+    prompt_builder = copy.deepcopy(branch.prompt_builder)
+
+    evaluation_prompt = prompt_builder.build(model.get_current_conversation())
+
+    _evaluate_step(
+        evaluator_executor, evaluators, policy, evaluations, step, evaluation_prompt
+    )
+
+    child = Branch(
+        model.snapshot(),
+        evaluations,
+        branch.followups + ([followup] if followup is not None else []),
+        branch.weight,
+        prompt_builder,
+    )
+
+    return child, evaluations.step_view(step)
+
+
+def _leaf(branch: Branch, complete: bool, truncated: bool = False) -> Dict[str, object]:
+    # Leaves are branches after a step, so they always have a snapshot
+    return {
+        "conversation": branch.snapshot.transcript,  # type: ignore
+        "complete": complete,
+        # Branch was cut by the budget before the evaluators stopped it
+        "truncated": truncated,
+        "followups": branch.followups,
+        "weight": branch.weight,
+        "evaluations": branch.evaluations.to_records(),
+    }
+
+
+def explore_conversation(
+    prompt: str,
+    model: LLM,
+    evaluators: List[LLM],
+    max_steps: int = 5,
+    max_branches: int = 8,
+    top_k: Union[int, None] = None,
+    max_calls: Union[int, None] = None,
+    similarity: float = 0.9,
+    concurrency: int = 4,
+    policy: Union[StopPolicy, None] = None,
+) -> Dict[str, object]:
+    if policy is None:
+        policy = FullPolicy()
+
+    budget = CallBudget(max_calls)
+    step_calls = 1 + len(evaluators)
+
+    leaves: List[Dict[str, object]] = []
+
+    # Tasks of the level: parent branch and the follow-up to continue it with
+    frontier: List[Tuple[Branch, Union[str, None]]] = []
+    if budget.reserve(step_calls):
+        root = Branch(None, EvaluationStore(), [], 1.0, EvaluationPromptBuilder())
+        frontier.append((root, None))
+
+    branches = len(frontier)
+
+    # Evaluators of a step are queried at the same time as in build_conversation,
+    # on their own pool, since the branch workers wait for them
+    with (
+        ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor,
+        ThreadPoolExecutor(
+            max_workers=max(concurrency * len(evaluators), 1)
+        ) as evaluator_executor,
+    ):
+        for step in range(max_steps):
+            if not frontier:
+                break
+
+            results = list(
+                executor.map(
+                    lambda task: _run_step(
+                        evaluator_executor,
+                        prompt,
+                        model,
+                        evaluators,
+                        policy,
+                        task[0],
+                        task[1],
+                        step,
+                    ),
+                    frontier,
+                )
+            )
+
+            frontier = []
+            for branch, current_eval in results:
+                if should_stop_conversation(current_eval):
+                    leaves.append(_leaf(branch, True))
+                    continue
+
+                # Same candidates the single-sample run draws from,
+                # duplicates make a follow-up more likely to be drawn
+                groups = dedupe_followups(
+                    _followup_candidates(current_eval), similarity
+                )
+                total = sum(size for _, size in groups)
+
+                if not groups or step == max_steps - 1:
+                    leaves.append(_leaf(branch, False))
+                    continue
+
+                # Children replace the branch, so every extra child
+                # takes one more branch from the budget
+                groups = groups[: max(1, max_branches - branches + 1)]
+                if top_k is not None:
+                    groups = groups[:top_k]
+
+                children = [
+                    (followup, size)
+                    for followup, size in groups
+                    if budget.reserve(step_calls)
+                ]
+
+                if not children:
+                    leaves.append(_leaf(branch, False, truncated=True))
+                    continue
+
+                branches += len(children) - 1
+
+                for followup, size in children:
+                    child = Branch(
+                        branch.snapshot,
+                        branch.evaluations,
+                        branch.followups,
+                        branch.weight * size / total,
+                        branch.prompt_builder,
+                    )
+                    frontier.append((child, followup))
+
+    # Outcome of the branches cut by the budget is unknown, so the rates
+    # are computed over the finished branches only. Weights are renormalized
+    # over the finished branches
+    finished = [leaf for leaf in leaves if not leaf["truncated"]]
+    weights = sum(leaf["weight"] for leaf in finished)  # type: ignore
+
+    return {
+        "branches": leaves,
+        "branches_count": len(leaves),
+        "truncated_count": len(leaves) - len(finished),
+        "success_rate": (
+            sum(bool(leaf["complete"]) for leaf in finished) / len(finished)
+            if finished
+            else None
+        ),
+        "weighted_success_rate": (
+            sum(leaf["weight"] for leaf in finished if leaf["complete"])  # type: ignore
+            / weights
+            if weights
+            else None
+        ),
+        "planned_calls": budget.planned,
+    }
@@ -1,50 +1,124 @@
 # This file contains implementation for OpenAI models
-import os
-from typing import Dict, List
+from typing import Any, Dict, List, Tuple, Union
 
 import google.generativeai as gemini
 
-from mt_chat_code_eval.llm_abstract import LLM
+from mt_chat_code_eval.clients import configure_gemini
+from mt_chat_code_eval.llm_abstract import (
+    AsyncChatLLM,
+    ChatLLM,
+    ConversationSnapshot,
+    Reply,
+    _ChatBase,
+)
+from mt_chat_code_eval.streaming import StreamMeter
 
 
-# Base class for LLM inference
-class Gemini(LLM):
+# Common part of blocking and async Gemini models
+class _GeminiChat(_ChatBase):
+    provider = "gemini"
 
     def __init__(self, model_name: str):
         super().__init__(model_name)
 
-        gemini.configure(api_key=os.environ["GEMINI_API_KEY"])
+        configure_gemini()
         self.model = gemini.GenerativeModel(self.model_name)
 
         self.conversation: List[Dict[str, str]] = []
-
-    def start_conversation(self, prompt: str) -> str:
         self.chat = self.model.start_chat()
-        self.conversation = []
 
-        answer = self.continue_conversation(prompt)
+    def _send_params(self) -> Dict[str, Any]:
+        return {
+            "generation_config": gemini.types.GenerationConfig(
+                **self.generation_params
+            ),
+            "stream": self.stream_budget is not None,
+        }
 
-        return answer
+    def _reply(
+        self, prompt: str, response: Any, meter: Union[StreamMeter, None]
+    ) -> Reply:
+        if meter is not None and meter.aborted:
+            # Usage is not reported for streams that were closed before the end
+            self._restart_chat((prompt, meter.text))
+            return meter.text, None, None
 
-    def continue_conversation(self, prompt: str) -> str:
-        # Gemini keeps track of the conversation history by itself
-        # we just need to send the next prompt and get the response
-        try:
-            response = self.chat.send_message(
-                prompt,
-                generation_config=gemini.types.GenerationConfig(
-                    temperature=0.3,
-                ),
-            )
-            answer = response.text
-        except Exception as e:
-            print(e)
-            answer = "I cannot answer to this prompt."
+        answer = meter.text if meter is not None else response.text
+
+        usage = response.usage_metadata
+        if usage is None:
+            return answer, None, None
+        return answer, usage.prompt_token_count, usage.candidates_token_count
+
+    def _reset_conversation(self) -> None:
+        super()._reset_conversation()
+        self.chat = self.model.start_chat()
 
+    def _add_turn(self, prompt: str, answer: str) -> None:
+        # Gemini keeps track of the conversation history by itself,
+        # we keep a copy of it for the snapshots and the cache
         self.conversation.append({"role": "user", "parts": prompt})
         self.conversation.append({"role": "model", "parts": answer})
 
-        return answer
+    def _add_cached_turn(self, prompt: str, answer: str) -> None:
+        # The chat session didn't see the cached turn,
+        # so we restart it with the updated history
+        self._add_turn(prompt, answer)
+        self._restart_chat()
+
+    def restore(self, snapshot: ConversationSnapshot) -> None:
+        super().restore(snapshot)
+        self._restart_chat()
+
+    def _restart_chat(self, turn: Tuple[str, ...] = ()) -> None:
+        # Chat session is started again from the conversation history,
+        # optionally with a turn that is not in the history yet
+        history = self.conversation + [
+            {"role": role, "parts": parts}
+            for role, parts in zip(["user", "model"], turn)
+        ]
+
+        self.chat = self.model.start_chat(history=history)  # type: ignore
 
     def get_current_conversation(self) -> List[str]:
         return [message["parts"] for message in self.conversation]
+
+
+# Base class for LLM inference
+class Gemini(_GeminiChat, ChatLLM):
+
+    def _send(self, prompt: str, meter: Union[StreamMeter, None]) -> Reply:
+        # Failed message is not added to the chat history, so it can be resent
+        try:
+            response = self.chat.send_message(prompt, **self._send_params())
+
+            if meter is not None:
+                for chunk in response:
+                    if not meter.add(chunk.text):
+                        break
+        except Exception:
+            if meter is not None:
+                # Broken stream leaves the chat session unusable
+                self._restart_chat()
+            raise
+
+        return self._reply(prompt, response, meter)
+
+
+# Async version of Gemini inference, it uses async send path of the chat session
+class AsyncGemini(_GeminiChat, AsyncChatLLM):
+
+    async def _send(self, prompt: str, meter: Union[StreamMeter, None]) -> Reply:
+        try:
+            response = await self.chat.send_message_async(prompt, **self._send_params())
+
+            if meter is not None:
+                async for chunk in response:
+                    if not meter.add(chunk.text):
+                        break
+        except Exception:
+            if meter is not None:
+                self._restart_chat()
+            raise
+
+        return self._reply(prompt, response, meter)
@@ -0,0 +1,102 @@
+# This module contains helpers to download datasets page by page:
+# query results are read in pages, HTML of every page is normalized
+# in a pool of worker processes and pages are written to parquet
+# as row groups, so memory does not grow with the size of the dataset.
+
+import os
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Deque, Iterator
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Base class for clients that run dataset queries
+class QueryClient(ABC):
+    @abstractmethod
+    def iter_pages(
+        self, name: str, query: str, page_size: int
+    ) -> Iterator[pd.DataFrame]:
+        pass
+
+
+class BigQueryClient(QueryClient):
+    def __init__(self, client: Any = None):
+        # Client is created on first use, so the module can be imported
+        # without credentials. This will use the credentials stored in the
+        # GOOGLE_APPLICATION_CREDENTIALS plus project name from the
+        # environment variable GOOGLE_PROJECT_NAME
+        self._client = client
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            from google.cloud import bigquery
+
+            self._client = bigquery.Client(os.getenv("GOOGLE_PROJECT_NAME"))
+        return self._client
+
+    def iter_pages(
+        self, name: str, query: str, page_size: int
+    ) -> Iterator[pd.DataFrame]:
+        query_job = self.client.query(query)
+        return query_job.result(page_size=page_size).to_dataframe_iterable()
+
+
+# Local stand-in for BigQuery, every query is answered with the rows
+# of the parquet file named after the query, e.g. evaluation.parquet
+class LocalQueryClient(QueryClient):
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+
+    def iter_pages(
+        self, name: str, query: str, page_size: int
+    ) -> Iterator[pd.DataFrame]:
+        source = pq.ParquetFile(os.path.join(self.data_dir, f"{name}.parquet"))
+        for batch in source.iter_batches(batch_size=page_size):
+            yield batch.to_pandas()
+
+
+def iter_processed(
+    pages: Iterator[pd.DataFrame],
+    process_page: Callable[[pd.DataFrame], pd.DataFrame],
+    processes: int = 1,
+) -> Iterator[pd.DataFrame]:
+    # Pages are processed in parallel and yielded in the original order.
+    # process_page should be picklable, e.g. a module level function
+    if processes <= 1:
+        yield from map(process_page, pages)
+        return
+
+    # Only a small window of pages is submitted at a time,
+    # so memory does not grow with the size of the dataset
+    pending: Deque[Future] = deque()
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for page in pages:
+            pending.append(executor.submit(process_page, page))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_pages(pages: Iterator[pd.DataFrame], path: str, schema: pa.Schema) -> int:
+    # Every page is written as a row group of the given schema, types are not
+    # inferred from the pages, since a column can be null in a whole page.
+    # Index is not written, so the file is read with the default index
+    rows = 0
+
+    # Empty query result is still written, so the next steps find the file
+    with pq.ParquetWriter(path, schema) as writer:
+        for page in pages:
+            writer.write_table(
+                pa.Table.from_pandas(page, schema=schema, preserve_index=False)
+            )
+            rows += len(page)
+
+    return rows
@@ -1,17 +1,205 @@
 # Description: Abstract class for LLM inference
+import asyncio
+import copy
+import logging
+import time
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Any, Callable, Dict, List, Tuple, Type, TypeVar, Union
 
+from mt_chat_code_eval.cache import ResponseCache
+from mt_chat_code_eval.rate_limit import (
+    backoff_delay,
+    estimate_tokens,
+    get_rate_limiters,
+    is_retryable,
+)
+from mt_chat_code_eval.streaming import StreamBudget, StreamMeter
+from mt_chat_code_eval.telemetry import CallRecord, CallTimer
+
+logger = logging.getLogger(__name__)
+
+# Answer that is returned when the model fails to respond to the prompt
+FALLBACK_ANSWER = "I cannot answer to this prompt."
+
+
+# State of a conversation after some step. It can be restored later,
+# so different follow-ups or evaluators start from the same model answers
+# instead of generating them again
+class ConversationSnapshot:
+    def __init__(
+        self,
+        model_name: str,
+        conversation: List[Any],
+        turn_metrics: List[Dict[str, object]],
+        transcript: List[str],
+    ):
+        self.model_name = model_name
+        self.conversation = copy.deepcopy(conversation)
+        self.turn_metrics = copy.deepcopy(turn_metrics)
+        # Texts of the turns, messages of the conversation are in the format
+        # of the provider, so the transcript is read without a model
+        self.transcript = list(transcript)
+
+
+LLMType = TypeVar("LLMType", bound="_LLMBase")
+
+
+# Common part of blocking and async LLM classes
+class _LLMBase(ABC):
+    # Provider that serves the model, its rate limits apply to the model
+    provider = ""
 
-# Base class for LLM inference
-class LLM(ABC):
     def __init__(self, model_name: str):
         self._model_name = model_name
 
+        self.generation_params: Dict[str, Any] = {"temperature": 0.3}
+
+        # Optional persistent cache of responses, set by llm_fabric.load_llm
+        self.cache: Union[ResponseCache, None] = None
+
+        # Backend that serves the model, if the model name alone doesn't identify
+        # it (e.g. a local server), answers of other backends are cached apart
+        self.cache_namespace: Union[str, None] = None
+
+        # Answers are cached only if they pass the validator, e.g. evaluators
+        # don't cache answers that can't be parsed, so they are asked again
+        self.cache_validator: Union[Callable[[str], bool], None] = None
+
+        # Functions that receive a CallRecord after every call to the model,
+        # e.g. Telemetry.record, set by llm_fabric.load_llm
+        self.call_hooks: List[Callable[[CallRecord], None]] = []
+
+        # Role of the instance in the run and current step of the conversation,
+        # they are attached to the call records
+        self.labels: Dict[str, Any] = {}
+
+        # Answers are streamed when the budget is set, streamed answers that
+        # are over the budget are cut, unlimited budget only measures them
+        self.stream_budget: Union[StreamBudget, None] = None
+
+        # Metrics of every answer in the current conversation
+        self.turn_metrics: List[Dict[str, object]] = []
+
+        # Messages of the current conversation in the format of the provider
+        self.conversation: List[Any] = []
+
     @property
     def model_name(self) -> str:
         return self._model_name
 
+    @abstractmethod
+    def get_current_conversation(self) -> List[str]:
+        pass
+
+    def snapshot(self) -> ConversationSnapshot:
+        return ConversationSnapshot(
+            self.model_name,
+            self.conversation,
+            self.turn_metrics,
+            self.get_current_conversation(),
+        )
+
+    def restore(self, snapshot: ConversationSnapshot) -> None:
+        # Conversation continues from the snapshot with the next prompt
+        if snapshot.model_name != self.model_name:
+            raise ValueError(
+                f"Snapshot of {snapshot.model_name} can't be restored "
+                f"to {self.model_name}"
+            )
+        self.conversation = copy.deepcopy(snapshot.conversation)
+        self.turn_metrics = copy.deepcopy(snapshot.turn_metrics)
+
+    def fork(
+        self: LLMType, snapshot: Union[ConversationSnapshot, None] = None
+    ) -> LLMType:
+        # New instance shares the client, cache and hooks with this one,
+        # but has its own conversation, which starts from the snapshot
+        # or from the current state of this instance
+        forked = copy.copy(self)
+        forked.generation_params = dict(self.generation_params)
+        forked.call_hooks = list(self.call_hooks)
+        forked.labels = dict(self.labels)
+        forked.restore(snapshot if snapshot is not None else self.snapshot())
+        return forked
+
+    def _get_cached_response(
+        self, prompt: str
+    ) -> Tuple[Union[str, None], Union[str, None]]:
+        # Returns cache key and cached answer for the next turn of the conversation
+        if self.cache is None:
+            return None, None
+
+        key = self.cache.make_key(
+            self.model_name,
+            self.get_current_conversation() + [prompt],
+            self.generation_params,
+            self.cache_namespace,
+        )
+
+        answer = self.cache.get(key)
+
+        # Invalid answers cached before the validator was set are missed,
+        # the new answer replaces them
+        if answer is not None and not self._is_cacheable(answer):
+            answer = None
+
+        if answer is not None:
+            self._record_call(CallTimer(), 0, 0, 0, cached=True)
+
+        return key, answer
+
+    def _is_cacheable(self, answer: str) -> bool:
+        return self.cache_validator is None or self.cache_validator(answer)
+
+    def _put_cached_response(self, key: Union[str, None], answer: str) -> None:
+        # We never cache failures, so they are retried on the next run,
+        # answers cut by the stream budget are not cached either,
+        # since the budget is not a part of the key
+        aborted = len(self.turn_metrics) > 0 and self.turn_metrics[-1]["aborted"]
+
+        if (
+            self.cache is not None
+            and key is not None
+            and answer != FALLBACK_ANSWER
+            and not aborted
+            and self._is_cacheable(answer)
+        ):
+            self.cache.put(key, answer)
+
+    def _record_call(
+        self,
+        timer: CallTimer,
+        prompt_tokens: int,
+        completion_tokens: int,
+        retries: int,
+        error: Union[Exception, None] = None,
+        cached: bool = False,
+        meter: Union[StreamMeter, None] = None,
+    ) -> None:
+        call = CallRecord(
+            model_name=self.model_name,
+            role=self.labels.get("role"),
+            step=self.labels.get("step"),
+            start_time=timer.start_time,
+            duration=timer.elapsed(),
+            response_time=timer.attempt_elapsed() if error is None else None,
+            time_to_first_token=meter.time_to_first_token if meter else None,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            retries=retries,
+            error=str(error) if error is not None else None,
+            cached=cached,
+            aborted=meter.aborted if meter else False,
+        )
+
+        self.turn_metrics.append(call.turn_metrics())
+
+        for hook in self.call_hooks:
+            hook(call)
+
+
+# Base class for LLM inference
+class LLM(_LLMBase):
     @abstractmethod
     def start_conversation(self, prompt: str) -> str:
         pass
@@ -20,6 +208,223 @@ class LLM(ABC):
     def continue_conversation(self, prompt: str) -> str:
         pass
 
+
+# Base class for async LLM inference, it mirrors the LLM interface
+# but allows to keep many conversations in flight in one event loop
+class AsyncLLM(_LLMBase):
     @abstractmethod
+    async def start_conversation(self, prompt: str) -> str:
+        pass
+
+    @abstractmethod
+    async def continue_conversation(self, prompt: str) -> str:
+        pass
+
+
+# Async model that runs the blocking calls of a model in worker threads,
+# e.g. for models that are registered without an async class. Attributes,
+# like the cache, hooks, labels and the conversation, are read and set on
+# the wrapped model. A conversation makes one call at a time, so the model
+# is not called by two threads at once
+class ThreadedLLM(AsyncLLM):
+    def __init__(self, llm: LLM):
+        object.__setattr__(self, "llm", llm)
+
+    def __getattr__(self, name: str) -> Any:
+        # Called only for the attributes that the wrapper doesn't have
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self.llm, name, value)
+
     def get_current_conversation(self) -> List[str]:
+        return self.llm.get_current_conversation()
+
+    def fork(
+        self: "ThreadedLLM", snapshot: Union[ConversationSnapshot, None] = None
+    ) -> "ThreadedLLM":
+        return ThreadedLLM(self.llm.fork(snapshot))
+
+    async def start_conversation(self, prompt: str) -> str:
+        return await asyncio.to_thread(self.llm.start_conversation, prompt)
+
+    async def continue_conversation(self, prompt: str) -> str:
+        return await asyncio.to_thread(self.llm.continue_conversation, prompt)
+
+
+# Answer of one attempt to call the model, with the prompt and completion
+# tokens reported by the provider, None when they are not reported
+Reply = Tuple[str, Union[int, None], Union[int, None]]
+
+
+# One call to the model over all its attempts: rate limiting, retries,
+# usage accounting and telemetry, shared by blocking and async chat models
+class _Call:
+    def __init__(self, llm: "_ChatBase", prompt: str, retries: int):
+        self.llm = llm
+        self.retries = retries
+
+        self.rate_limiters = get_rate_limiters(llm.provider, llm.model_name)
+        self.prompt_tokens = estimate_tokens(llm.get_current_conversation() + [prompt])
+
+        self.timer = CallTimer()
+        self.meter: Union[StreamMeter, None] = None
+        self.attempt = 0
+        self.error: Union[Exception, None] = None
+
+    def start_attempt(self, attempt: int) -> None:
+        self.attempt = attempt
+        self.timer.start_attempt()
+
+        stream_budget = self.llm.stream_budget
+        self.meter = StreamMeter(stream_budget) if stream_budget is not None else None
+
+    def retry_delay(self, error: Exception) -> Union[float, None]:
+        # Returns the delay before the next attempt, None if the call failed
+        self.error = error
+
+        if self.attempt < self.retries and is_retryable(
+            error, self.llm.transient_errors
+        ):
+            logger.warning(
+                "Call to %s failed, retrying: %s", self.llm.model_name, error
+            )
+            return backoff_delay(self.attempt, error)
+
+        logger.error("Call to %s failed", self.llm.model_name, exc_info=error)
+        return None
+
+    def succeeded(self, reply: Reply) -> str:
+        answer, prompt_tokens, completion_tokens = reply
+
+        # Usage is not reported for streams that were closed before the end
+        if prompt_tokens is None:
+            prompt_tokens = self.prompt_tokens
+        if completion_tokens is None:
+            completion_tokens = self.meter.tokens if self.meter is not None else 0
+
+        for rate_limiter in self.rate_limiters:
+            rate_limiter.charge(completion_tokens)
+
+        self.llm._record_call(
+            self.timer, prompt_tokens, completion_tokens, self.attempt, meter=self.meter
+        )
+
+        return answer
+
+    def failed(self) -> str:
+        self.llm._record_call(self.timer, 0, 0, self.attempt, self.error)
+        return FALLBACK_ANSWER
+
+
+# Common part of blocking and async chat models: conversation history, turns
+# and the calls to the model. Subclasses only send a prompt to the provider
+class _ChatBase(_LLMBase):
+    # Errors of the provider SDK that are retried,
+    # besides the errors with retryable status codes
+    transient_errors: Tuple[Type[Exception], ...] = ()
+
+    def _reset_conversation(self) -> None:
+        self.conversation = []
+        self.turn_metrics = []
+
+    @abstractmethod
+    def _add_turn(self, prompt: str, answer: str) -> None:
         pass
+
+    def _add_cached_turn(self, prompt: str, answer: str) -> None:
+        self._add_turn(prompt, answer)
+
+
+# Chat model that sends the prompts with a blocking call
+class ChatLLM(_ChatBase, LLM):
+    @abstractmethod
+    def _send(self, prompt: str, meter: Union[StreamMeter, None]) -> Reply:
+        pass
+
+    def start_conversation(self, prompt: str) -> str:
+        self._reset_conversation()
+        return self.continue_conversation(prompt)
+
+    def continue_conversation(self, prompt: str) -> str:
+        cache_key, answer = self._get_cached_response(prompt)
+
+        if answer is not None:
+            self._add_cached_turn(prompt, answer)
+            return answer
+
+        answer = self._call(prompt)
+        self._put_cached_response(cache_key, answer)
+        self._add_turn(prompt, answer)
+
+        return answer
+
+    def _call(self, prompt: str, retries: int = 5) -> str:
+        call = _Call(self, prompt, retries)
+
+        for attempt in range(retries + 1):
+            for rate_limiter in call.rate_limiters:
+                rate_limiter.acquire(call.prompt_tokens)
+
+            call.start_attempt(attempt)
+
+            try:
+                reply = self._send(prompt, call.meter)
+            except Exception as e:
+                delay = call.retry_delay(e)
+                if delay is None:
+                    break
+                time.sleep(delay)
+                continue
+
+            return call.succeeded(reply)
+
+        return call.failed()
+
+
+# Same as ChatLLM, but the prompts are sent with await
+class AsyncChatLLM(_ChatBase, AsyncLLM):
+    @abstractmethod
+    async def _send(self, prompt: str, meter: Union[StreamMeter, None]) -> Reply:
+        pass
+
+    async def start_conversation(self, prompt: str) -> str:
+        self._reset_conversation()
+        return await self.continue_conversation(prompt)
+
+    async def continue_conversation(self, prompt: str) -> str:
+        cache_key, answer = self._get_cached_response(prompt)
+
+        if answer is not None:
+            self._add_cached_turn(prompt, answer)
+            return answer
+
+        answer = await self._call(prompt)
+        self._put_cached_response(cache_key, answer)
+        self._add_turn(prompt, answer)
+
+        return answer
+
+    async def _call(self, prompt: str, retries: int = 5) -> str:
+        call = _Call(self, prompt, retries)
+
+        for attempt in range(retries + 1):
+            for rate_limiter in call.rate_limiters:
+                await rate_limiter.acquire_async(call.prompt_tokens)
+
+            call.start_attempt(attempt)
+
+            try:
+                reply = await self._send(prompt, call.meter)
+            except Exception as e:
+                delay = call.retry_delay(e)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+                continue
+
+            return call.succeeded(reply)
+
+        return call.failed()
@@ -1,31 +1,147 @@
-from mt_chat_code_eval.gemini import Gemini
-from mt_chat_code_eval.llm_abstract import LLM
-from mt_chat_code_eval.open_ai import AIMLAPI, OpenAI
-
-model_list = {
-    "gpt-4o": OpenAI,
-    "gpt-4o-2024-08-06": OpenAI,
-    "gpt-4o-mini": OpenAI,
-    "gpt-4-turbo": OpenAI,
-    "gpt-3.5-turbo": OpenAI,
-    "gemini-1.5-flash": Gemini,
-    "gemini-1.5-pro": Gemini,
-    "gemini-1.0-pro": Gemini,
-    "codellama/CodeLlama-7b-Instruct-hf": AIMLAPI,
-    "codellama/CodeLlama-13b-Instruct-hf": AIMLAPI,
-    "codellama/CodeLlama-34b-Instruct-hf": AIMLAPI,
-    "codellama/CodeLlama-70b-Instruct-hf": AIMLAPI,
-    "togethercomputer/CodeLlama-7b-Instruct": AIMLAPI,
-    "togethercomputer/CodeLlama-13b-Instruct": AIMLAPI,
-    "togethercomputer/CodeLlama-34b-Instruct": AIMLAPI,
-    "deepseek-ai/deepseek-coder-33b-instruct": AIMLAPI,
-    "WizardLM/WizardCoder-Python-34B-V1.0": AIMLAPI,
-    "meta-llama/Meta-Llama-3.1-70B-Instruct-Turbo": AIMLAPI,
-    "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo": AIMLAPI,
+import importlib
+import json
+from functools import lru_cache
+from typing import Dict, Type, Union
+
+from mt_chat_code_eval.cache import ResponseCache
+from mt_chat_code_eval.clients import local_models, register_local_model
+from mt_chat_code_eval.llm_abstract import LLM, AsyncLLM, ThreadedLLM
+from mt_chat_code_eval.telemetry import Telemetry
+
+# Model classes are given as "module:Class" entry points and are imported
+# only when a model is loaded, so provider SDKs are not imported
+# by the runs (and worker processes) that don't use them
+_openai = "mt_chat_code_eval.open_ai:OpenAI"
+_gemini = "mt_chat_code_eval.gemini:Gemini"
+_aimlapi = "mt_chat_code_eval.open_ai:AIMLAPI"
+_mock = "mt_chat_code_eval.mock:MockLLM"
+
+model_list: Dict[str, str] = {
+    "gpt-4o": _openai,
+    "gpt-4o-2024-08-06": _openai,
+    "gpt-4o-mini": _openai,
+    "gpt-4-turbo": _openai,
+    "gpt-3.5-turbo": _openai,
+    "gemini-1.5-flash": _gemini,
+    "gemini-1.5-pro": _gemini,
+    "gemini-1.0-pro": _gemini,
+    "codellama/CodeLlama-7b-Instruct-hf": _aimlapi,
+    "codellama/CodeLlama-13b-Instruct-hf": _aimlapi,
+    "codellama/CodeLlama-34b-Instruct-hf": _aimlapi,
+    "codellama/CodeLlama-70b-Instruct-hf": _aimlapi,
+    "togethercomputer/CodeLlama-7b-Instruct": _aimlapi,
+    "togethercomputer/CodeLlama-13b-Instruct": _aimlapi,
+    "togethercomputer/CodeLlama-34b-Instruct": _aimlapi,
+    "deepseek-ai/deepseek-coder-33b-instruct": _aimlapi,
+    "WizardLM/WizardCoder-Python-34B-V1.0": _aimlapi,
+    "meta-llama/Meta-Llama-3.1-70B-Instruct-Turbo": _aimlapi,
+    "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo": _aimlapi,
+    # Offline model for development and benchmarks, see mock.py for settings
+    "mock": _mock,
 }
 
+# Async counterparts of the model classes above
+async_model_list: Dict[str, str] = {
+    model_name: {
+        _openai: "mt_chat_code_eval.open_ai:AsyncOpenAI",
+        _gemini: "mt_chat_code_eval.gemini:AsyncGemini",
+        _aimlapi: "mt_chat_code_eval.open_ai:AsyncAIMLAPI",
+        _mock: "mt_chat_code_eval.mock:AsyncMockLLM",
+    }[entry_point]
+    for model_name, entry_point in model_list.items()
+}
+
+
+def register_model(
+    model_name: str, entry_point: str, async_entry_point: Union[str, None] = None
+) -> None:
+    # Models of other packages are registered with their entry points,
+    # e.g. register_model("my-model", "my_package.models:MyModel").
+    # Without an async entry point async runs call the blocking model
+    # in worker threads, see load_async_llm
+    model_list[model_name] = entry_point
+    if async_entry_point is not None:
+        async_model_list[model_name] = async_entry_point
+
+
+def load_local_models(path: str) -> None:
+    # Config maps model names to local servers, a model that is already in
+    # the list (e.g. one of AIMLAPI models) is served locally instead:
+    # {"codellama/CodeLlama-7b-Instruct-hf": {
+    #     "base_url": "http://localhost:8000/v1",
+    #     "served_model": "codellama/CodeLlama-7b-Instruct-hf",
+    #     "api_key": null, "extra_body": {"cache_prompt": true}}}
+    with open(path, "r", encoding="utf-8") as file:
+        config = json.load(file)
+
+    for model_name, server in config.items():
+        register_local_model(
+            model_name,
+            server["base_url"],
+            server.get("served_model"),
+            server.get("api_key"),
+            server.get("extra_body"),
+        )
+        register_model(
+            model_name,
+            "mt_chat_code_eval.open_ai:LocalOpenAI",
+            "mt_chat_code_eval.open_ai:AsyncLocalOpenAI",
+        )
+
+
+@lru_cache(maxsize=None)
+def _resolve(entry_point: str) -> Type:
+    module_name, _, class_name = entry_point.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
 
-def load_llm(model_name: str) -> LLM:
+def is_openai_model(model_name: str) -> bool:
+    # Models served by OpenAI itself, models served locally
+    # under the same names (see load_local_models) are not
+    return model_list.get(model_name) == _openai
+
+
+def model_provider(model_name: str) -> Union[str, None]:
+    # Provider that serves the model, e.g. for its rate limits,
+    # None if the name is not a model
+    if model_name in local_models:
+        return local_models[model_name]["provider"]
+    if model_name not in model_list:
+        return None
+    return _resolve(model_list[model_name]).provider
+
+
+def token_family(model_name: str) -> str:
+    # Tokenizer family of the model, see preprocessing.token_counters
     if model_name not in model_list:
         raise ValueError(f"Model {model_name} not found in the available models")
-    return model_list[model_name](model_name)  # type: ignore
+    return "openai" if model_list[model_name] == _openai else "generic"
+
+
+def load_llm(
+    model_name: str,
+    cache: Union[ResponseCache, None] = None,
+    telemetry: Union[Telemetry, None] = None,
+) -> LLM:
+    if model_name not in model_list:
+        raise ValueError(f"Model {model_name} not found in the available models")
+    llm = _resolve(model_list[model_name])(model_name)
+    llm.cache = cache
+    if telemetry is not None:
+        llm.call_hooks.append(telemetry.record)
+    return llm
+
+
+def load_async_llm(
+    model_name: str,
+    cache: Union[ResponseCache, None] = None,
+    telemetry: Union[Telemetry, None] = None,
+) -> AsyncLLM:
+    if model_name not in async_model_list:
+        # Blocking model is run in worker threads, it gets the cache and hooks
+        return ThreadedLLM(load_llm(model_name, cache, telemetry))
+    llm = _resolve(async_model_list[model_name])(model_name)
+    llm.cache = cache
+    if telemetry is not None:
+        llm.call_hooks.append(telemetry.record)
+    return llm
@@ -0,0 +1,116 @@
+# This module contains functions to compute conversation metrics
+# from the evaluators verdicts, both for one conversation
+# and vectorized for the whole result set at once.
+
+from typing import Dict, Union
+
+import pandas as pd
+
+_criteria_aggregations = {
+    "understanding": "all",
+    "correctness": "all",
+    "completeness": "any",
+}
+
+
+def _first_const_true(series: pd.Series, by_value: bool = False) -> Union[int, None]:
+    # Published results check the verdicts by identity with True,
+    # see get_batch_eval_metrics, by_value checks them by their value
+    values = [bool(value) for value in series] if by_value else series.to_numpy()
+    if values[-1] is True:
+        for i in range(-2, -len(values) - 1, -1):
+            if values[i] is False:
+                return series.index[i + 1]
+        return series.idxmin()
+    else:
+        return None
+
+
+def _steps_to_achieve(
+    eval_df: pd.DataFrame, criteria: str, achieved_steps: bool = False
+) -> int:
+    step_index = _first_const_true(eval_df[criteria], achieved_steps)
+    if step_index is None:
+        return eval_df["step"].max() + 1
+    else:
+        return eval_df.loc[step_index]["step"] + 1
+
+
+def get_eval_metrics(
+    eval_df: pd.DataFrame, achieved_steps: bool = False
+) -> Dict[str, int]:
+    eval_grouped = (
+        eval_df.groupby("step")
+        .agg(_criteria_aggregations)  # type: ignore
+        .reset_index()
+    )
+
+    return {
+        "steps_total": eval_grouped["step"].max() + 1,
+        **{
+            f"steps_to_{criteria}": _steps_to_achieve(
+                eval_grouped, criteria, achieved_steps
+            )
+            for criteria in _criteria_aggregations
+        },
+    }
+
+
+def get_batch_eval_metrics(
+    verdicts: pd.DataFrame, achieved_steps: bool = False
+) -> pd.DataFrame:
+    # Verdicts are expected in long format with one row per evaluator per step:
+    # conversation_id, step, model_name, understanding, correctness, completeness
+    # Result has the same metrics as get_eval_metrics, one row per conversation
+    steps = (
+        verdicts.groupby(["conversation_id", "step"], sort=True)
+        .agg(_criteria_aggregations)  # type: ignore
+        .reset_index()
+    )
+
+    conversations = steps.groupby("conversation_id", sort=True)["step"]
+
+    metrics = pd.DataFrame({"steps_total": conversations.max() + 1})
+
+    # get_eval_metrics checks the aggregated verdicts by identity with True,
+    # aggregated verdicts are numpy booleans, so the check never holds and
+    # steps_to_* of a conversation are always its steps_total.
+    # The same is kept by default, so results stay comparable with published ones
+    if not achieved_steps:
+        for criteria in _criteria_aggregations:
+            metrics[f"steps_to_{criteria}"] = metrics["steps_total"]
+        return metrics
+
+    first_step = conversations.min()
+    next_step = conversations.shift(-1)
+
+    for criteria in _criteria_aggregations:
+        achieved = steps[criteria].astype(bool)
+        by_conversation = steps["conversation_id"]
+
+        # Criteria is counted as achieved at the first step of the final run of
+        # steps where it holds, i.e. right after the last step where it didn't
+        after_last_failure = next_step.where(~achieved).groupby(by_conversation).max()
+        run_start = after_last_failure.reindex(metrics.index).fillna(first_step)
+
+        achieved_in_the_end = achieved.groupby(by_conversation).last()
+
+        metrics[f"steps_to_{criteria}"] = (
+            (run_start + 1)
+            .where(achieved_in_the_end, metrics["steps_total"])
+            .astype(int)
+        )
+
+    return metrics
+
+
+def verdicts_from_results(results: pd.DataFrame) -> pd.DataFrame:
+    # Evaluation results keep verdicts of every conversation in the
+    # "evaluations" column, we flatten them into one long table
+    evaluations = results["evaluations"].explode().dropna()
+
+    return (
+        pd.DataFrame(evaluations.tolist(), index=evaluations.index)
+        .rename_axis("conversation_id")
+        .reset_index()
+    )
@@ -0,0 +1,221 @@
+# This file contains implementation of a mock model that answers without any
+# API calls. It is deterministic for the given seed and can simulate latency,
+# malformed evaluator answers and failures, so the framework itself can be
+# run and benchmarked offline.
+import asyncio
+import hashlib
+import os
+import random
+import time
+from typing import Dict, List, Tuple, Union
+
+from mt_chat_code_eval import prompts
+from mt_chat_code_eval.llm_abstract import AsyncChatLLM, ChatLLM, Reply, _ChatBase
+from mt_chat_code_eval.rate_limit import estimate_tokens
+from mt_chat_code_eval.streaming import StreamMeter
+
+# Settings are shared by all mock instances, defaults can be set with
+# environment variables, so they also apply to worker processes
+mock_settings: Dict[str, object] = {
+    # Mean latency of one call in seconds
+    "latency": float(os.getenv("MOCK_LLM_LATENCY", "0")),
+    # Latency distribution: constant, uniform or exponential
+    "latency_distribution": os.getenv("MOCK_LLM_LATENCY_DISTRIBUTION", "constant"),
+    # Evaluators consider the answer complete after this number of turns
+    "complete_after": int(os.getenv("MOCK_LLM_COMPLETE_AFTER", "2")),
+    # Share of evaluator answers that miss required sections
+    "malformed_rate": float(os.getenv("MOCK_LLM_MALFORMED_RATE", "0")),
+    # Share of evaluator answers that find the answer incorrect
+    "incorrect_rate": float(os.getenv("MOCK_LLM_INCORRECT_RATE", "0")),
+    # Share of calls that fail with an error
+    "failure_rate": float(os.getenv("MOCK_LLM_FAILURE_RATE", "0")),
+    "seed": int(os.getenv("MOCK_LLM_SEED", "0")),
+}
+
+_answer_template = """Here is how you can do it:
+
+```python
+def solution():
+    # Solution for: {question}
+    return {turn}
+```
+
+This solves the problem described in the question."""
+
+_evaluation_template = """### Step-by-step analysis
+The intern answered {turns} question(s).
+
+### Follow-up question
+{followup}
+
+### Understanding
+yes
+
+### Correctness
+{correctness}
+
+### Completeness
+{completeness}
+"""
+
+
+# Evaluators ask one of these follow-up questions
+_followup_templates = [
+    "Can you explain step {turns} in details?",
+    "Could you explain step {turns} in more detail?",
+    "What happens with empty input after step {turns}?",
+]
+
+# Streamed answers are split into this number of chunks
+_stream_chunks = 10
+
+# Share of the latency before the first chunk of a streamed answer
+_first_chunk_share = 0.2
+
+
+class MockLLMError(Exception):
+    pass
+
+
+def _split_answer(answer: str) -> List[str]:
+    size = len(answer) // _stream_chunks + 1
+    return [answer[start:][:size] for start in range(0, len(answer), size)]
+
+
+def _random_for(model_name: str, prompt: str, attempt: int) -> random.Random:
+    # Same model, prompt, attempt and seed always produce the same answer
+    key = f"{mock_settings['seed']}:{model_name}:{attempt}:{prompt}"
+    return random.Random(hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+
+def _latency(rng: random.Random) -> float:
+    latency = float(mock_settings["latency"])  # type: ignore
+
+    if mock_settings["latency_distribution"] == "uniform":
+        return rng.uniform(0, 2 * latency)
+    if mock_settings["latency_distribution"] == "exponential":
+        return rng.expovariate(1 / latency) if latency > 0 else 0.0
+    return latency
+
+
+def _mock_answer(
+    model_name: str, conversation: List[str], prompt: str, attempt: int
+) -> str:
+    rng = _random_for(model_name, prompt, attempt)
+
+    if rng.random() < float(mock_settings["failure_rate"]):  # type: ignore
+        raise MockLLMError(f"Mock failure of {model_name}")
+
+    # Evaluator can be asked in the same conversation for the missing sections,
+    # then the evaluation prompt is the first one in the conversation
+    evaluated = conversation[0] if conversation else prompt
+
+    if not evaluated.startswith(prompts.evaluation_start_prompt):
+        turn = len(conversation) // 2 + 1
+        return _answer_template.format(question=prompt[:80].strip(), turn=turn)
+
+    # Every question/answer pair of the evaluated conversation has a header
+    turns = evaluated.count("--- Question ---")
+    complete = turns >= int(mock_settings["complete_after"])  # type: ignore
+
+    # Incorrect answer is never complete and always gets a follow-up
+    correct = rng.random() >= float(mock_settings["incorrect_rate"])  # type: ignore
+    complete = complete and correct
+
+    evaluation = _evaluation_template.format(
+        turns=turns,
+        followup=(
+            "" if complete else rng.choice(_followup_templates).format(turns=turns)
+        ),
+        correctness="yes" if correct else "no",
+        completeness="yes" if complete else "no",
+    )
+
+    # Malformed answer is cut before the last section, like a truncated one
+    if rng.random() < float(mock_settings["malformed_rate"]):  # type: ignore
+        return evaluation[: evaluation.index("### Completeness")]
+
+    return evaluation
+
+
+# Common part of blocking and async mock models. Failures of the mock go
+# through the same retries, backoff and fallback answer as the real models
+class _MockChat(_ChatBase):
+    provider = "mock"
+    transient_errors = (MockLLMError,)
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+
+        self.conversation: List[str] = []
+
+        self._last_prompt = ""
+        self._attempt = 0
+
+    def _next_attempt(self, prompt: str) -> Tuple[int, float]:
+        # Retries of the same prompt get different answers,
+        # like a real model would give with non-zero temperature.
+        # Returns the attempt and the latency before the answer
+        self._attempt = self._attempt + 1 if prompt == self._last_prompt else 0
+        self._last_prompt = prompt
+
+        latency = _latency(_random_for(self.model_name, prompt, self._attempt))
+        if self.stream_budget is not None:
+            latency *= _first_chunk_share
+
+        return self._attempt, latency
+
+    def _answer(self, prompt: str, attempt: int) -> str:
+        return _mock_answer(self.model_name, self.conversation, prompt, attempt)
+
+    @staticmethod
+    def _reply(answer: str) -> Reply:
+        return answer, None, estimate_tokens([answer])
+
+    def _add_turn(self, prompt: str, answer: str) -> None:
+        self.conversation += [prompt, answer]
+
+    def get_current_conversation(self) -> List[str]:
+        return list(self.conversation)
+
+
+def _chunk_latency(latency: float) -> float:
+    return latency * (1 / _first_chunk_share - 1) / _stream_chunks
+
+
+class MockLLM(_MockChat, ChatLLM):
+
+    def _send(self, prompt: str, meter: Union[StreamMeter, None]) -> Reply:
+        attempt, latency = self._next_attempt(prompt)
+
+        time.sleep(latency)
+
+        answer = self._answer(prompt, attempt)
+
+        if meter is not None:
+            for chunk in _split_answer(answer):
+                time.sleep(_chunk_latency(latency))
+                if not meter.add(chunk):
+                    break
+            answer = meter.text
+
+        return self._reply(answer)
+
+
+class AsyncMockLLM(_MockChat, AsyncChatLLM):
+
+    async def _send(self, prompt: str, meter: Union[StreamMeter, None]) -> Reply:
+        attempt, latency = self._next_attempt(prompt)
+
+        await asyncio.sleep(latency)
+
+        answer = self._answer(prompt, attempt)
+
+        if meter is not None:
+            for chunk in _split_answer(answer):
+                await asyncio.sleep(_chunk_latency(latency))
+                if not meter.add(chunk):
+                    break
+            answer = meter.text
+
+        return self._reply(answer)
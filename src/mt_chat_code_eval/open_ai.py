@@ -1,74 +1,177 @@
 # This file contains implementation for OpenAI models
-import os
-from typing import Dict, List
+from typing import Any, Dict, List, Union
 
+from openai import APIConnectionError
+from openai import AsyncOpenAI as AsyncOpenAI_API
 from openai import OpenAI as OpenAI_API
+from openai.types.chat import ChatCompletion
 
-from mt_chat_code_eval.llm_abstract import LLM
+from mt_chat_code_eval.clients import get_async_client, get_client, local_models
+from mt_chat_code_eval.llm_abstract import AsyncChatLLM, ChatLLM, Reply, _ChatBase
+from mt_chat_code_eval.streaming import StreamMeter
 
 
-# Base class for LLM inference
-class OpenAI_Base(LLM):
+# Common part of blocking and async models with OpenAI compatible API
+class _OpenAIChat(_ChatBase):
+    # Connection errors and timeouts of the API are retried,
+    # other errors without a status code are not
+    transient_errors = (APIConnectionError,)
 
-    def __init__(self, model_name: str, client: OpenAI_API):
+    def __init__(self, model_name: str, client: Any):
         super().__init__(model_name)
 
         self.client = client
 
+        # Name of the model in the API, it differs for models of local servers
+        self.api_model_name = model_name
+
         self.conversation: List[Dict[str, str]] = []
 
-    def _get_response(
-        self, conversation: List[Dict[str, str]], retries: int = 1
-    ) -> str:
+    def _request(self, prompt: str, stream: bool) -> Dict[str, Any]:
+        # Open AI cannot store history of the conversation,
+        # we need to query it with the full history each turn
+        request: Dict[str, Any] = {
+            "model": self.api_model_name,
+            "messages": self.conversation + [{"role": "user", "content": prompt}],
+            **self.generation_params,
+        }
+        if stream:
+            request.update(stream=True, stream_options={"include_usage": True})
+        return request
+
+    def _serve_locally(self, local_model: Dict[str, Any]) -> None:
+        # Local servers may serve the model under another name. Answers are
+        # cached per server, a model of the same name elsewhere is another model
+        self.provider = local_model["provider"]
+        self.api_model_name = local_model["served_model"]
+        self.cache_namespace = f"{self.provider}/{self.api_model_name}"
+        if local_model["extra_body"]:
+            self.generation_params["extra_body"] = local_model["extra_body"]
+
+    @staticmethod
+    def _reply(response: ChatCompletion) -> Reply:
+        answer = response.choices[0].message.content or ""
+        usage = response.usage
+        if usage is None:
+            return answer, None, None
+        return answer, usage.prompt_tokens, usage.completion_tokens
+
+    @staticmethod
+    def _add_chunk(chunk: Any, meter: StreamMeter, usage: List[Any]) -> bool:
+        # Returns False when the stream should be closed,
+        # usage comes in the last chunk of a complete stream
+        if chunk.usage is not None:
+            usage.append(chunk.usage)
+        return not chunk.choices or meter.add(chunk.choices[0].delta.content)
+
+    @staticmethod
+    def _stream_reply(meter: StreamMeter, usage: List[Any]) -> Reply:
+        if not usage:
+            return meter.text, None, None
+        return meter.text, usage[-1].prompt_tokens, usage[-1].completion_tokens
+
+    def _add_turn(self, prompt: str, answer: str) -> None:
+        self.conversation.append({"role": "user", "content": prompt})
+        self.conversation.append({"role": "assistant", "content": answer})
 
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model_name, messages=conversation, temperature=0.3
-            )
+    def get_current_conversation(self) -> List[str]:
+        return [message["content"] for message in self.conversation]
 
-            answer = response.choices[0].message.content
-        except Exception as e:
-            print(e)
-            if retries > 0:
-                return self._get_response(conversation, retries - 1)
-            else:
-                answer = "I cannot answer to this prompt."
 
-        return answer
+# Base class for LLM inference
+class OpenAI_Base(_OpenAIChat, ChatLLM):
+    client: OpenAI_API
 
-    def start_conversation(self, prompt: str) -> str:
-        self.conversation = []
-        return self.continue_conversation(prompt)
+    def _send(self, prompt: str, meter: Union[StreamMeter, None]) -> Reply:
+        if meter is None:
+            return self._reply(
+                self.client.chat.completions.create(**self._request(prompt, False))
+            )
 
-    def continue_conversation(self, prompt: str) -> str:
-        # Open AI cannot store history of the conversation,
-        # we need to query it with the full history each turn
-        self.conversation.append({"role": "user", "content": prompt})
+        usage: List[Any] = []
 
-        answer = self._get_response(self.conversation)
+        # Leaving the block closes the connection,
+        # so the answer over the budget is not generated further
+        with self.client.chat.completions.create(
+            **self._request(prompt, True)
+        ) as stream:
+            for chunk in stream:
+                if not self._add_chunk(chunk, meter, usage):
+                    break
 
-        self.conversation.append({"role": "assistant", "content": answer})
+        return self._stream_reply(meter, usage)
 
-        return answer
 
-    def get_current_conversation(self) -> List[str]:
-        return [message["content"] for message in self.conversation]
+class OpenAI(OpenAI_Base):
+    provider = "openai"
 
+    def __init__(self, model_name: str):
+        super().__init__(model_name, get_client(self.provider))
+
+
+class AIMLAPI(OpenAI_Base):
+    provider = "aimlapi"
 
-class OpenAI(OpenAI_Base):
     def __init__(self, model_name: str):
-        client = OpenAI_API(
-            organization=os.getenv("OPENAI_API_ORG"),
-            project=os.getenv("OPENAI_API_PROJECT"),
+        super().__init__(model_name, get_client(self.provider))
+
+
+# Base class for async LLM inference with OpenAI compatible API
+class AsyncOpenAI_Base(_OpenAIChat, AsyncChatLLM):
+    client: AsyncOpenAI_API
+
+    async def _send(self, prompt: str, meter: Union[StreamMeter, None]) -> Reply:
+        if meter is None:
+            return self._reply(
+                await self.client.chat.completions.create(
+                    **self._request(prompt, False)
+                )
+            )
+
+        usage: List[Any] = []
+
+        stream = await self.client.chat.completions.create(
+            **self._request(prompt, True)
         )
+        async with stream:
+            async for chunk in stream:
+                if not self._add_chunk(chunk, meter, usage):
+                    break
 
-        super().__init__(model_name, client)
+        return self._stream_reply(meter, usage)
 
 
-class AIMLAPI(OpenAI_Base):
+# Model served by a local OpenAI compatible server, see clients.local_models.
+# Every turn sends the whole conversation with an unchanged prefix, so servers
+# with prefix caching (vLLM, llama.cpp server) reuse the KV cache of the
+# previous turns, and concurrent conversations are batched by the server.
+class LocalOpenAI(OpenAI_Base):
     def __init__(self, model_name: str):
-        client = OpenAI_API(
-            api_key=os.getenv("AIMLAPI_KEY"), base_url="https://api.aimlapi.com/v1"
-        )
+        local_model = local_models[model_name]
+
+        super().__init__(model_name, get_client(local_model["provider"]))
+
+        self._serve_locally(local_model)
+
+
+class AsyncOpenAI(AsyncOpenAI_Base):
+    provider = "openai"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name, get_async_client(self.provider))
+
+
+class AsyncAIMLAPI(AsyncOpenAI_Base):
+    provider = "aimlapi"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name, get_async_client(self.provider))
+
+
+class AsyncLocalOpenAI(AsyncOpenAI_Base):
+    def __init__(self, model_name: str):
+        local_model = local_models[model_name]
+
+        super().__init__(model_name, get_async_client(local_model["provider"]))
 
-        super().__init__(model_name, client)
+        self._serve_locally(local_model)
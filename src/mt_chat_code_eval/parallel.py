@@ -0,0 +1,116 @@
+# This module contains helpers to evaluate dataset rows
+# concurrently over a bounded pool of worker threads or asyncio tasks.
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+import pandas as pd
+import tqdm
+
+logger = logging.getLogger(__name__)
+
+WorkerState = TypeVar("WorkerState")
+
+
+def iter_concurrently(
+    data: pd.DataFrame,
+    init_worker: Callable[[], WorkerState],
+    evaluate_row: Callable[[WorkerState, pd.Series], Dict[str, object]],
+    concurrency: int = 1,
+) -> Iterator[Tuple[Hashable, Dict[str, object]]]:
+    # LLM instances keep the conversation state inside, so they cannot be
+    # shared between threads. Every worker thread creates its own state once
+    # and reuses it for all rows it processes.
+    local = threading.local()
+
+    def _run(row: pd.Series) -> Dict[str, object]:
+        try:
+            # A failed init is tried again with the next row of the worker
+            if not hasattr(local, "state"):
+                local.state = init_worker()
+
+            return evaluate_row(local.state, row)
+        except Exception as e:
+            # A failed row should not kill the whole batch,
+            # we keep the error message in the results instead
+            logger.exception("Evaluation of row %s failed", row.name)
+            return {"error": str(e)}
+
+    concurrency = max(concurrency, 1)
+
+    # Only a small window of rows is submitted at a time,
+    # so memory does not grow with the size of the dataset
+    rows = data.iterrows()
+    pending: Dict[Future, Hashable] = {}
+
+    with (
+        ThreadPoolExecutor(max_workers=concurrency) as executor,
+        tqdm.tqdm(total=len(data)) as progress,
+    ):
+        while True:
+            for index, row in rows:
+                pending[executor.submit(_run, row)] = index
+                if len(pending) >= 2 * concurrency:
+                    break
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                progress.update(1)
+                yield pending.pop(future), future.result()
+
+
+async def iter_concurrently_async(
+    data: pd.DataFrame,
+    evaluate_row: Callable[[pd.Series], Awaitable[Dict[str, object]]],
+    concurrency: int = 1,
+) -> AsyncIterator[Tuple[Hashable, Dict[str, object]]]:
+    # All rows share one event loop, at most `concurrency`
+    # of them are in flight at the same time
+    async def _run(
+        index: Hashable, row: pd.Series
+    ) -> Tuple[Hashable, Dict[str, object]]:
+        try:
+            return index, await evaluate_row(row)
+        except Exception as e:
+            logger.exception("Evaluation of row %s failed", index)
+            return index, {"error": str(e)}
+
+    concurrency = max(concurrency, 1)
+
+    rows = data.iterrows()
+    pending: Set[asyncio.Task] = set()
+
+    with tqdm.tqdm(total=len(data)) as progress:
+        while True:
+            for index, row in rows:
+                pending.add(asyncio.ensure_future(_run(index, row)))
+                if len(pending) >= concurrency:
+                    break
+
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            for task in done:
+                progress.update(1)
+                yield task.result()
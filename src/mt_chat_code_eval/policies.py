@@ -0,0 +1,157 @@
+# This module contains policies that decide which evaluators are queried
+# at each step of a conversation. Evaluators of a step are queried in waves:
+# the policy gets the verdicts collected so far and returns the next wave,
+# so it can stop querying once the outcome of the step is known.
+
+from abc import ABC, abstractmethod
+from typing import Dict, List, Type, Union
+
+from mt_chat_code_eval.evaluation_store import EvaluationRecord
+
+
+# Stop condition of a conversation step, shared by the conversation loops
+# and the policies that end the evaluator waves once it is decided
+def should_stop_conversation(current_eval: List[EvaluationRecord]) -> bool:
+    # We are checking following conditions to stop the conversation:
+    # - All evaluators agree that the model understands the questions
+    # - All evaluators agree that the model provides correct answers
+    # - At least one evaluator agrees that the model provides full answers
+    # Verdicts that evaluators failed to provide are skipped
+    return (
+        all(r.understanding for r in current_eval if r.understanding is not None)
+        and all(r.correctness for r in current_eval if r.correctness is not None)
+        and any(r.completeness for r in current_eval if r.completeness is not None)
+    )
+
+
+def _has_followup(current_eval: List[EvaluationRecord]) -> bool:
+    # Same candidates as conversation._select_followup uses
+    return any(
+        not r.completeness and r.followup is not None and r.followup.strip() != ""
+        for r in current_eval
+    )
+
+
+def _stop_is_impossible(current_eval: List[EvaluationRecord]) -> bool:
+    # One failed criteria can't be outvoted by the other evaluators,
+    # but the conversation can continue only if there is a follow-up question
+    return _has_followup(current_eval) and any(
+        r.understanding is False or r.correctness is False for r in current_eval
+    )
+
+
+class StopPolicy(ABC):
+    name = ""
+
+    @abstractmethod
+    def next_wave(
+        self,
+        evaluators: List[str],
+        queried: List[int],
+        current_eval: List[EvaluationRecord],
+    ) -> List[int]:
+        # Returns positions of the evaluators to query next,
+        # empty list means that the step is evaluated
+        pass
+
+
+# Every evaluator is queried at every step
+class FullPolicy(StopPolicy):
+    name = "full"
+
+    def next_wave(
+        self,
+        evaluators: List[str],
+        queried: List[int],
+        current_eval: List[EvaluationRecord],
+    ) -> List[int]:
+        return list(range(len(evaluators))) if not queried else []
+
+
+# Evaluators are queried one wave after another until the step outcome
+# is decided. Stop needs the agreement of all evaluators, so only the decision
+# to continue the conversation can be made before all of them are queried.
+class ShortCircuitPolicy(StopPolicy):
+    name = "short_circuit"
+
+    def __init__(self, wave_size: int = 1):
+        self.wave_size = wave_size
+
+    def next_wave(
+        self,
+        evaluators: List[str],
+        queried: List[int],
+        current_eval: List[EvaluationRecord],
+    ) -> List[int]:
+        if _stop_is_impossible(current_eval):
+            return []
+
+        remaining = [i for i in range(len(evaluators)) if i not in queried]
+
+        return remaining[: self.wave_size]
+
+
+# Cheap screening evaluators are queried first. Expensive evaluators are
+# queried only if screeners disagree, miss some verdicts or would stop the
+# conversation, since the stop decision is final. Screeners are expected
+# in the beginning of the evaluators list, so the same model can be both.
+class ScreeningPolicy(StopPolicy):
+    name = "screening"
+
+    def __init__(self, screeners: List[str]):
+        self.screeners = screeners
+
+    def next_wave(
+        self,
+        evaluators: List[str],
+        queried: List[int],
+        current_eval: List[EvaluationRecord],
+    ) -> List[int]:
+        if evaluators[: len(self.screeners)] != self.screeners:
+            raise ValueError("Screeners should be the first evaluators")
+
+        screeners = list(range(len(self.screeners)))
+        judges = list(range(len(self.screeners), len(evaluators)))
+
+        if not queried:
+            return screeners if screeners else judges
+
+        if any(i in queried for i in judges):
+            return []
+
+        verdicts = {
+            (r.understanding, r.correctness, r.completeness) for r in current_eval
+        }
+        decided = (
+            len(verdicts) == 1
+            and None not in next(iter(verdicts))
+            and not should_stop_conversation(current_eval)
+            and _has_followup(current_eval)
+        )
+
+        return [] if decided else judges
+
+
+policy_list: Dict[str, Type[StopPolicy]] = {
+    "full": FullPolicy,
+    "short_circuit": ShortCircuitPolicy,
+    "screening": ScreeningPolicy,
+}
+
+
+def load_policy(name: str, screeners: Union[List[str], None] = None) -> StopPolicy:
+    if name not in policy_list:
+        raise ValueError(f"Stop policy {name} not found in the available policies")
+    if name == "screening":
+        if not screeners:
+            raise ValueError("Screening policy requires at least one screener")
+        return ScreeningPolicy(screeners)
+    return policy_list[name]()
+
+
+def evaluator_calls_saved(
+    evaluations: List[Dict[str, object]], evaluators_count: int
+) -> int:
+    # Calls that the full policy would make at the same steps
+    steps = {evaluation["step"] for evaluation in evaluations}
+    return evaluators_count * len(steps) - len(evaluations)
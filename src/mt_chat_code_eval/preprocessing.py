@@ -0,0 +1,166 @@
+# This module contains normalization of StackOverflow posts: HTML is split
+# into prose and code segments, so code blocks keep their boundaries in the
+# prompts, and token counts of every tokenizer family are computed once
+# at download time, so runners know the prompt size before any call.
+
+import importlib.util
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, Union
+
+import pandas as pd
+import pyarrow as pa
+
+from mt_chat_code_eval.rate_limit import estimate_tokens
+
+# lxml parser is several times faster than the builtin one,
+# but it is an optional dependency
+_html_parser = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+# Code blocks are cut out of the document and replaced with this marker
+_code_marker = "\x00{}\x00"
+_code_marker_regex = re.compile("\x00(\\d+)\x00")
+
+Segment = Dict[str, str]
+
+
+def html_to_segments(text: str) -> List[Segment]:
+    # HTML parser is needed only at download time
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(text, _html_parser)
+
+    # Only <pre> blocks are code segments, inline <code> stays in the prose
+    code_blocks: List[str] = []
+    for pre in soup.find_all("pre"):
+        pre.replace_with(_code_marker.format(len(code_blocks)))
+        code_blocks.append(pre.get_text())
+
+    segments: List[Segment] = []
+    parts = _code_marker_regex.split(soup.get_text())
+
+    # Split gives prose and code block numbers one after another
+    for i, part in enumerate(parts):
+        if i % 2 == 1:
+            segments.append({"type": "code", "content": code_blocks[int(part)]})
+        elif part.strip() != "":
+            segments.append({"type": "text", "content": part.strip()})
+
+    return segments
+
+
+def segments_to_text(segments: List[Segment]) -> str:
+    # Code blocks are fenced as markdown, which all models understand
+    return "\n\n".join(
+        (
+            f"```\n{segment['content'].strip(chr(10))}\n```"
+            if segment["type"] == "code"
+            else segment["content"]
+        )
+        for segment in segments
+    )
+
+
+def _openai_counter() -> Callable[[str], int]:
+    import tiktoken
+
+    encoding = tiktoken.get_encoding("o200k_base")
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+# Token counters of tokenizer families, models without a local tokenizer
+# (Gemini and open models) use the generic estimation. Tokenizers are
+# loaded on first use, since loading takes longer than most runs need
+token_counters: Dict[str, Callable[[], Callable[[str], int]]] = {
+    "openai": _openai_counter,
+    "generic": lambda: lambda text: estimate_tokens([text]),
+}
+
+# Optional packages the tokenizers need
+_tokenizer_packages = {"openai": "tiktoken"}
+
+
+def has_tokenizer(family: str) -> bool:
+    package = _tokenizer_packages.get(family)
+    return package is None or importlib.util.find_spec(package) is not None
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(family: str) -> Callable[[str], int]:
+    return token_counters[family]()
+
+
+def tokens_column(column: str, family: str) -> str:
+    return f"{column}_tokens_{family}"
+
+
+def normalize_page(page: pd.DataFrame, columns: Dict[str, str]) -> pd.DataFrame:
+    # Columns are given as {normalized column: column with HTML}. For every
+    # column we add its segments and token counts of every tokenizer family
+    # that is installed, estimates are stored only as the generic counts
+    normalized = {}
+    for column, source in columns.items():
+        segments = page[source].apply(html_to_segments)
+        normalized[f"{column}_segments"] = segments
+        normalized[column] = segments.apply(segments_to_text)
+        for family in filter(has_tokenizer, token_counters):
+            normalized[tokens_column(column, family)] = normalized[column].apply(
+                get_token_counter(family)
+            )
+
+    return page.assign(**normalized)
+
+
+def normalized_schema(schema: pa.Schema, columns: Dict[str, str]) -> pa.Schema:
+    # Schema of the pages of the given schema after normalize_page
+    segment = pa.struct([("type", pa.string()), ("content", pa.string())])
+    for column in columns:
+        schema = schema.append(pa.field(f"{column}_segments", pa.list_(segment)))
+        schema = schema.append(pa.field(column, pa.string()))
+        for family in filter(has_tokenizer, token_counters):
+            schema = schema.append(pa.field(tokens_column(column, family), pa.int64()))
+    return schema
+
+
+def _column_tokens(data: pd.DataFrame, column: str, family: str) -> pd.Series:
+    if tokens_column(column, family) in data:
+        return data[tokens_column(column, family)]
+    # Without the tokenizer of the family the generic estimate is used
+    if not has_tokenizer(family):
+        return _column_tokens(data, column, "generic")
+    # Data downloaded before the token counts were added is counted here
+    return data[column].apply(get_token_counter(family))
+
+
+def prompt_tokens(data: pd.DataFrame, columns: List[str], family: str) -> pd.Series:
+    return sum(
+        _column_tokens(data, column, family) for column in columns
+    )  # type: ignore
+
+
+def select_by_prompt_size(
+    data: pd.DataFrame,
+    columns: List[str],
+    family: str,
+    max_tokens: Union[int, None] = None,
+    order_by_cost: bool = False,
+) -> pd.DataFrame:
+    counted = all(tokens_column(column, family) in data for column in columns)
+    if not counted and not has_tokenizer(family):
+        print(f"No {family} tokenizer is installed, prompt sizes are estimated")
+
+    tokens = prompt_tokens(data, columns, family)
+
+    # Oversized items are skipped before anything is sent
+    if max_tokens is not None:
+        skipped = tokens > max_tokens
+        if skipped.any():
+            print(f"Skipping {skipped.sum()} items longer than {max_tokens} tokens")
+        data, tokens = data[~skipped], tokens[~skipped]
+
+    # Longest items go first, so the workers don't wait for
+    # a few long conversations in the end of the run
+    if order_by_cost:
+        data = data.loc[tokens.sort_values(ascending=False, kind="stable").index]
+
+    return data
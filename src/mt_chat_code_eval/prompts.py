@@ -1,15 +1,27 @@
+from functools import lru_cache
 from importlib import resources as impresources
 
 from mt_chat_code_eval import prompt_files
 
-start_file = impresources.files(prompt_files) / "evaluation.start.prompt"
-with start_file.open("r", encoding="utf-8") as file:
-    evaluation_start_prompt = file.read()
+# Prompts are read from the package files on first access of the attribute,
+# e.g. "prompts.evaluation_start_prompt". Importing the names with
+# "from mt_chat_code_eval.prompts import ..." reads the files at import time
+_prompt_files = {
+    "evaluation_start_prompt": "evaluation.start.prompt",
+    "evaluation_qa_prompt": "evaluation.qa.prompt",
+    "evaluation_end_prompt": "evaluation.end.prompt",
+    "evaluation_missing_prompt": "evaluation.missing.prompt",
+}
 
-qa_file = impresources.files(prompt_files) / "evaluation.qa.prompt"
-with qa_file.open("r", encoding="utf-8") as file:
-    evaluation_qa_prompt = file.read()
 
-end_file = impresources.files(prompt_files) / "evaluation.end.prompt"
-with end_file.open("r", encoding="utf-8") as file:
-    evaluation_end_prompt = file.read()
+@lru_cache(maxsize=None)
+def load_prompt(file_name: str) -> str:
+    prompt_file = impresources.files(prompt_files) / file_name
+    with prompt_file.open("r", encoding="utf-8") as file:
+        return file.read()
+
+
+def __getattr__(name: str) -> str:
+    if name not in _prompt_files:
+        raise AttributeError(f"module {__name__} has no attribute {name}")
+    return load_prompt(_prompt_files[name])
@@ -0,0 +1,173 @@
+# This module contains client side rate limiting for LLM calls.
+# Limiters are shared by all LLM instances of the process, so parallel
+# workers together stay under the provider limits. Limits apply per process:
+# every worker process (e.g. of run_sharded) has its own limiters.
+# It also contains exponential backoff with jitter that is used
+# to retry failed calls.
+
+import asyncio
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Tuple, Type, Union
+
+# Errors with these status codes can pass by themselves: request timeout,
+# conflict and rate limit, server errors (5xx) are retried as well
+_retryable_status_codes = {408, 409, 429}
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        # Takes the amount from the bucket right away and returns how long
+        # the caller has to wait until the bucket would have contained it
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+
+            self._tokens -= amount
+
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        requests_per_minute: Union[float, None] = None,
+        tokens_per_minute: Union[float, None] = None,
+    ):
+        self.requests = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def _reserve(self, tokens: int) -> float:
+        delay = 0.0
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(tokens))
+        return delay
+
+    def acquire(self, tokens: int) -> None:
+        time.sleep(self._reserve(tokens))
+
+    async def acquire_async(self, tokens: int) -> None:
+        await asyncio.sleep(self._reserve(tokens))
+
+    def charge(self, tokens: int) -> None:
+        # Completion tokens are known only after the call,
+        # they are taken from the bucket without waiting
+        if self.tokens is not None:
+            self.tokens.reserve(tokens)
+
+
+# Limiters of a model of a provider and of a whole provider (model name is None),
+# e.g. all AIMLAPI models share one account quota
+_rate_limiters: Dict[Tuple[str, Union[str, None]], RateLimiter] = {}
+
+
+def set_rate_limit(
+    provider: str,
+    model_name: Union[str, None] = None,
+    requests_per_minute: Union[float, None] = None,
+    tokens_per_minute: Union[float, None] = None,
+) -> None:
+    _rate_limiters[(provider, model_name)] = RateLimiter(
+        requests_per_minute, tokens_per_minute
+    )
+
+
+def get_rate_limiters(provider: str, model_name: str) -> List[RateLimiter]:
+    # Calls wait for the limits of the model and of its provider
+    limiters = [
+        _rate_limiters.get((provider, model_name)),
+        _rate_limiters.get((provider, None)),
+    ]
+    return [limiter for limiter in limiters if limiter is not None]
+
+
+def parse_rate_limits(
+    rate_limits: List[str], model_provider: Callable[[str], Union[str, None]]
+) -> None:
+    # Rate limits are given as NAME=REQUESTS_PER_MINUTE[:TOKENS_PER_MINUTE],
+    # NAME is a model or a provider (e.g. aimlapi) to limit all its models.
+    # model_provider returns the provider of a model, None for other names
+    for rate_limit in rate_limits:
+        name, limits = rate_limit.rsplit("=", 1)
+        requests_per_minute, _, tokens_per_minute = limits.partition(":")
+
+        provider = model_provider(name)
+        set_rate_limit(
+            provider if provider is not None else name,
+            name if provider is not None else None,
+            float(requests_per_minute) if requests_per_minute else None,
+            float(tokens_per_minute) if tokens_per_minute else None,
+        )
+
+
+def estimate_tokens(messages: List[str]) -> int:
+    # Rough estimation that is good enough for rate limiting,
+    # one token is about four characters of English text
+    return sum(len(message) for message in messages) // 4 + 1
+
+
+def is_retryable(
+    error: Exception, transient_errors: Tuple[Type[Exception], ...] = ()
+) -> bool:
+    # Only rate limits, timeouts, connection and server errors of the provider
+    # API are retried, other errors (e.g. bugs in our code) would fail again.
+    # Providers give the classes of their timeout and connection errors
+    if isinstance(error, (TimeoutError, ConnectionError) + transient_errors):
+        return True
+
+    status_code = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if not isinstance(status_code, int):
+        return False
+    return status_code in _retryable_status_codes or status_code >= 500
+
+
+def _retry_after(error: Exception) -> Union[float, None]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+
+    if not headers:
+        return None
+
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000.0
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+
+    return None
+
+
+def backoff_delay(
+    attempt: int,
+    error: Union[Exception, None] = None,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+) -> float:
+    # Server knows better when we can retry, so Retry-After header wins
+    if error is not None:
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, max_delay)
+
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
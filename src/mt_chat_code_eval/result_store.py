@@ -0,0 +1,264 @@
+# This module contains a partitioned store of evaluation and validation
+# results. Runs are written as a Hive-style dataset partitioned by model,
+# evaluators and date. Metric columns and transcripts (conversations,
+# verdicts, follow-ups) are written to separate files, so aggregates over
+# many runs read only the small metric files, filtered by the partitions.
+
+import os
+import re
+from typing import Dict, List, Tuple, Union
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from slugify import slugify
+
+# Columns with the texts of the conversations, they are stored apart
+# from the metrics and read only when they are asked for
+_transcript_columns = ["conversation", "evaluations", "turn_metrics", "branches"]
+_validation_transcript_columns = ["follow_up"]
+
+# Partitions of every kind of results, in the order of directories
+_partitions = {
+    "evaluation": ["model", "evaluators", "date"],
+    "validation": ["model", "date"],
+}
+
+# Columns that identify a row of a run, transcripts are joined on them
+_key_columns = ["run", "row"]
+
+_metric_columns = [
+    "complete",
+    "steps_total",
+    "steps_to_understanding",
+    "steps_to_correctness",
+    "steps_to_completeness",
+]
+
+# Parameters of evaluation runs that are stored as columns
+_run_parameter_columns = ["max_steps", "stop_policy"]
+
+Filters = List[Tuple[str, str, object]]
+
+
+def _partitioning(kind: str) -> ds.Partitioning:
+    return ds.partitioning(
+        pa.schema([(name, pa.string()) for name in _partitions[kind]]),
+        flavor="hive",
+    )
+
+
+def _partition_dir(root: str, kind: str, group: str, values: Dict[str, str]) -> str:
+    # Values are percent-encoded, model names contain slashes
+    return os.path.join(
+        root,
+        kind,
+        group,
+        *[f"{name}={quote(values[name], safe='')}" for name in _partitions[kind]],
+    )
+
+
+def write_results(
+    results: pd.DataFrame,
+    root: str,
+    kind: str,
+    partition_values: Dict[str, str],
+    run_name: str,
+) -> None:
+    # Run is written as one metrics file and one transcripts file, writing
+    # the same run again replaces them. Partition values are not stored
+    # in the files, they come from the directories
+    transcript_columns = [
+        column
+        for column in _transcript_columns + _validation_transcript_columns
+        if column in results
+    ]
+
+    keyed = results.assign(run=run_name, row=results.index).reset_index(drop=True)
+    keyed = keyed.drop(columns=list(partition_values), errors="ignore")
+
+    file_name = f"part-{slugify(run_name)}.parquet"
+
+    metrics_dir = _partition_dir(root, kind, "metrics", partition_values)
+    os.makedirs(metrics_dir, exist_ok=True)
+    pq.write_table(
+        pa.Table.from_pandas(
+            keyed.drop(columns=transcript_columns), preserve_index=False
+        ),
+        os.path.join(metrics_dir, file_name),
+        compression="zstd",
+    )
+
+    if transcript_columns:
+        transcripts_dir = _partition_dir(root, kind, "transcripts", partition_values)
+        os.makedirs(transcripts_dir, exist_ok=True)
+        # Turns repeat a lot between runs of the same questions,
+        # dictionary encoding and stronger compression pay off here
+        pq.write_table(
+            pa.Table.from_pandas(
+                keyed[_key_columns + transcript_columns], preserve_index=False
+            ),
+            os.path.join(transcripts_dir, file_name),
+            compression="zstd",
+            compression_level=9,
+            use_dictionary=True,
+        )
+
+
+def _dataset(root: str, kind: str, group: str) -> Union[ds.Dataset, None]:
+    path = os.path.join(root, kind, group)
+    if not os.path.exists(path):
+        return None
+    return ds.dataset(path, format="parquet", partitioning=_partitioning(kind))
+
+
+def _query_group(
+    root: str,
+    kind: str,
+    group: str,
+    columns: Union[List[str], None],
+    filters: Union[Filters, None],
+) -> pd.DataFrame:
+    dataset = _dataset(root, kind, group)
+    if dataset is None:
+        return pd.DataFrame(columns=columns)
+
+    # Filters on partitions skip whole directories, filters on other
+    # columns are checked against row group statistics before reading
+    table = dataset.to_table(
+        columns=columns,
+        filter=pq.filters_to_expression(filters) if filters else None,
+    )
+    return table.to_pandas()
+
+
+def query(
+    root: str,
+    kind: str = "evaluation",
+    columns: Union[List[str], None] = None,
+    filters: Union[Filters, None] = None,
+) -> pd.DataFrame:
+    # Filters are given as [(column, op, value)], e.g.
+    # [("model", "in", ["gpt-4o-mini"]), ("date", ">=", "2024-09-01")]
+    return _query_group(root, kind, "metrics", columns, filters)
+
+
+def query_transcripts(
+    root: str,
+    kind: str = "evaluation",
+    columns: Union[List[str], None] = None,
+    filters: Union[Filters, None] = None,
+) -> pd.DataFrame:
+    # Transcripts can be filtered by partitions, run and row only,
+    # metrics are joined on the key columns when needed
+    if columns is not None:
+        columns = _partitions[kind] + _key_columns + columns
+    return _query_group(root, kind, "transcripts", columns, filters)
+
+
+def leaderboard(root: str, filters: Union[Filters, None] = None) -> pd.DataFrame:
+    # Only the metric columns of the matching partitions are read
+    dataset = _dataset(root, "evaluation", "metrics")
+    dataset_columns = dataset.schema.names if dataset is not None else []
+
+    # Runs with other step limits or stop policies are not comparable,
+    # they are ranked as separate entries
+    group_columns = ["model", "evaluators"] + [
+        column for column in _run_parameter_columns if column in dataset_columns
+    ]
+    metric_columns = [column for column in _metric_columns if column in dataset_columns]
+
+    metrics = query(
+        root,
+        "evaluation",
+        columns=group_columns + ["run"] + metric_columns,
+        filters=filters,
+    )
+
+    # Runs migrated without a known stop policy are kept as a group of their own
+    board = metrics.groupby(group_columns, dropna=False).agg(
+        runs=("run", "nunique"),
+        conversations=("run", "size"),
+        **{column: (column, "mean") for column in metric_columns},
+    )
+    sort_column = "complete" if "complete" in board else "runs"
+
+    return board.sort_values(sort_column, ascending=False).reset_index()
+
+
+# Result files written before the store have the run parameters
+# only in the slugified file names
+_evaluation_name_regex = re.compile(
+    r"^(?P<model>.+?)-(?P<max_steps>\d+)-vs-(?P<evaluators>.+?)"
+    r"(?:-(?P<stop_policy>short-circuit|screening))?-"
+    r"(?P<date>\d{4}-\d{2}-\d{2})(?:-parquet|\.parquet)$"
+)
+_validation_name_regex = re.compile(
+    r"^(?P<model>.+?)(?:___|-)(?P<date>\d{4}-\d{2}-\d{2})(?:-parquet|\.parquet)$"
+)
+
+
+def _model_name(slug: str, model_names: List[str]) -> str:
+    # Original name is recovered from the list of known models
+    for model_name in model_names:
+        if slugify(model_name) == slug:
+            return model_name
+    return slug
+
+
+def parse_result_name(
+    file_name: str, kind: str, model_names: List[str]
+) -> Union[Dict[str, str], None]:
+    if kind == "validation":
+        match = _validation_name_regex.match(file_name)
+        if match is None:
+            return None
+        return {
+            "model": _model_name(slugify(match["model"]), model_names),
+            "date": match["date"],
+        }
+
+    # Exploration results have other columns, they are not migrated
+    match = _evaluation_name_regex.match(file_name)
+    if match is None or match["evaluators"].endswith("-explore"):
+        return None
+
+    evaluators = [
+        _model_name(evaluator, model_names)
+        for evaluator in match["evaluators"].split("-and-")
+    ]
+
+    return {
+        "model": _model_name(match["model"], model_names),
+        "evaluators": "___and___".join(evaluators),
+        "date": match["date"],
+        "max_steps": match["max_steps"],
+        "stop_policy": (match["stop_policy"] or "full").replace("-", "_"),
+    }
+
+
+def migrate_results(
+    results_dir: str, root: str, kind: str, model_names: List[str]
+) -> List[str]:
+    # Loose result files are written to the store, returns migrated files
+    migrated = []
+
+    for file_name in sorted(os.listdir(results_dir)):
+        params = parse_result_name(file_name, kind, model_names)
+        if params is None:
+            continue
+
+        results = pd.read_parquet(os.path.join(results_dir, file_name))
+        # Run parameters that are not partitions are kept as columns
+        if kind == "evaluation":
+            results = results.assign(
+                max_steps=int(params.pop("max_steps")),
+                stop_policy=results.get("stop_policy", params.pop("stop_policy")),
+            )
+
+        write_results(results, root, kind, params, file_name)
+        migrated.append(file_name)
+
+    return migrated
@@ -1,19 +1,25 @@
 import argparse
+import itertools
 import os
+from functools import partial
+from typing import Iterator
 
 import pandas as pd
-from bs4 import BeautifulSoup
+import pyarrow as pa
 from dotenv import load_dotenv
-from google.cloud import bigquery
+
+from mt_chat_code_eval.ingestion import (
+    BigQueryClient,
+    LocalQueryClient,
+    QueryClient,
+    iter_processed,
+    write_pages,
+)
+from mt_chat_code_eval.preprocessing import normalize_page, normalized_schema
 
 # Load local environment variables
 load_dotenv()
 
-# Create a BigQuery client
-# This will use the credentials stored in the GOOGLE_APPLICATION_CREDENTIALS
-# Plus project name from the environment variable GOOGLE_PROJECT_NAME
-big_query_client = bigquery.Client(os.getenv("GOOGLE_PROJECT_NAME"))
-
 # Query to get the data from the Stackoverflow dataset for evaluation
 # For the evaluation data, we will get the most recent questions that
 # do not have an accepted answer
@@ -31,6 +37,16 @@ ORDER BY creation_date DESC
 LIMIT {count}
 """
 
+# Columns of the evaluation data query
+eval_data_schema = pa.schema(
+    [
+        ("url", pa.string()),
+        ("id", pa.int64()),
+        ("body", pa.string()),
+        ("creation_date", pa.timestamp("us", tz="UTC")),
+    ]
+)
+
 # Query to get the data from the Stackoverflow dataset to validate automatic evaluators
 # For the validation data, we will get the most recent questions that have both accepted
 # answer and at least one non-accepted answer
@@ -80,6 +96,21 @@ ORDER BY creation_date DESC
 LIMIT {count}
 """
 
+# Columns of the validation data query, with the answer mark added to them
+validation_data_schema = pa.schema(
+    [
+        ("url", pa.string()),
+        ("id", pa.int64()),
+        ("body", pa.string()),
+        ("creation_date", pa.timestamp("us", tz="UTC")),
+        ("accepted_answer_id", pa.int64()),
+        ("answer_id", pa.int64()),
+        ("answer_body", pa.string()),
+        ("answer_score", pa.int64()),
+        ("is_accepted", pa.bool_()),
+    ]
+)
+
 # Query to get the positive examples for the validation data
 validation_pos_query = """
 ( ( answer_score > 3 ) AND ( accepted_answer_id = answer_id ) )
@@ -91,13 +122,15 @@ validation_neg_query = """
 """
 
 
-def get_data(query: str) -> pd.DataFrame:
-    query_job = big_query_client.query(query)
-    return query_job.result().to_dataframe()
+def get_data(
+    client: QueryClient, name: str, query: str, page_size: int = 10000
+) -> Iterator[pd.DataFrame]:
+    # Results are read page by page instead of one DataFrame
+    return client.iter_pages(name, query, page_size)
 
 
-def remove_html_tags(text: str) -> str:
-    return BeautifulSoup(text, "html.parser").get_text()
+def _mark_accepted(page: pd.DataFrame) -> pd.DataFrame:
+    return page.assign(is_accepted=page["accepted_answer_id"] == page["answer_id"])
 
 
 if __name__ == "__main__":
@@ -107,20 +140,37 @@ if __name__ == "__main__":
     parser.add_argument("--evaluation_count", type=int, default=200)
     parser.add_argument("--validation_count", type=int, default=200)
     parser.add_argument("--output_dir", type=str, default="data")
+    parser.add_argument("--page_size", type=int, default=10000)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--local_data_dir", type=str, default=None)
 
     args, _ = parser.parse_known_args()
 
+    # With --local_data_dir queries are answered from local parquet files
+    client: QueryClient = (
+        LocalQueryClient(args.local_data_dir)
+        if args.local_data_dir
+        else BigQueryClient()
+    )
+
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir)
 
     # Getting evaluation data
     eval_query = eval_data_query.format(count=args.evaluation_count)
-    eval_data = get_data(eval_query)
-    eval_data["question"] = eval_data["body"].apply(remove_html_tags)
-
-    eval_data = eval_data.reset_index(drop=True)
-
-    eval_data.to_parquet(os.path.join(args.output_dir, "evaluation_data.parquet"))
+    eval_pages = get_data(client, "evaluation", eval_query, args.page_size)
+
+    eval_columns = {"question": "body"}
+    eval_count = write_pages(
+        iter_processed(
+            eval_pages,
+            partial(normalize_page, columns=eval_columns),
+            args.processes,
+        ),
+        os.path.join(args.output_dir, "evaluation_data.parquet"),
+        normalized_schema(eval_data_schema, eval_columns),
+    )
+    print(f"Evaluation data: {eval_count} rows")
 
     # Getting validation data
 
@@ -132,18 +182,19 @@ if __name__ == "__main__":
         answer_condition=validation_neg_query, count=int(args.validation_count) // 2
     )
 
-    valid_pos_data = get_data(valid_pos_query)
-    valid_neg_data = get_data(valid_neg_query)
-
-    valid_data = pd.concat([valid_pos_data, valid_neg_data], ignore_index=True)
-
-    valid_data["is_accepted"] = (
-        valid_data["accepted_answer_id"] == valid_data["answer_id"]
+    valid_pages = itertools.chain(
+        get_data(client, "validation_pos", valid_pos_query, args.page_size),
+        get_data(client, "validation_neg", valid_neg_query, args.page_size),
     )
 
-    valid_data["question"] = valid_data["body"].apply(remove_html_tags)
-    valid_data["answer"] = valid_data["answer_body"].apply(remove_html_tags)
-
-    valid_data = valid_data.reset_index(drop=True)
-
-    valid_data.to_parquet(os.path.join(args.output_dir, "validation_data.parquet"))
+    valid_columns = {"question": "body", "answer": "answer_body"}
+    valid_count = write_pages(
+        iter_processed(
+            map(_mark_accepted, valid_pages),
+            partial(normalize_page, columns=valid_columns),
+            args.processes,
+        ),
+        os.path.join(args.output_dir, "validation_data.parquet"),
+        normalized_schema(validation_data_schema, valid_columns),
+    )
+    print(f"Validation data: {valid_count} rows")
@@ -1,73 +1,133 @@
 import argparse
+import asyncio
 import datetime
 import os
-from typing import Dict, List, Union
+import sys
+from typing import Dict, List, Tuple, Union
 
 import pandas as pd
-import tqdm
 from dotenv import load_dotenv
 from slugify import slugify
 
-from mt_chat_code_eval.conversation import build_conversation
-from mt_chat_code_eval.llm_abstract import LLM
-from mt_chat_code_eval.llm_fabric import load_llm
+from mt_chat_code_eval.cache import ResponseCache
+from mt_chat_code_eval.checkpoint import ResultJournal
+from mt_chat_code_eval.clients import parse_client_settings
+from mt_chat_code_eval.conversation import build_conversation, build_conversation_async
+from mt_chat_code_eval.evaluation_store import EvaluationStore
+from mt_chat_code_eval.llm_abstract import LLM, _LLMBase
+from mt_chat_code_eval.llm_fabric import (
+    load_async_llm,
+    load_llm,
+    load_local_models,
+    model_provider,
+    token_family,
+)
+from mt_chat_code_eval.metrics import get_batch_eval_metrics, verdicts_from_results
+from mt_chat_code_eval.parallel import iter_concurrently, iter_concurrently_async
+from mt_chat_code_eval.policies import (
+    FullPolicy,
+    StopPolicy,
+    evaluator_calls_saved,
+    load_policy,
+    policy_list,
+)
+from mt_chat_code_eval.preprocessing import select_by_prompt_size
+from mt_chat_code_eval.rate_limit import parse_rate_limits
+from mt_chat_code_eval.result_store import write_results
+from mt_chat_code_eval.sharding import (
+    merge_shards,
+    parse_shard,
+    select_shard,
+    shard_run_name,
+)
+from mt_chat_code_eval.streaming import StreamBudget
+from mt_chat_code_eval.telemetry import Telemetry, write_telemetry
 
 # Load local environment variables
 load_dotenv()
 
-tqdm.tqdm.pandas()
 
+def _row_result(
+    conversation: List[str],
+    is_successful: bool,
+    evaluations: EvaluationStore,
+    model: _LLMBase,
+    policy: StopPolicy,
+    evaluators_count: int,
+) -> Dict[str, object]:
+    records = evaluations.to_records()
 
-def _first_const_true(series: pd.Series) -> Union[int, None]:
-    if series.iloc[-1] is True:
-        for i in range(-2, -len(series) - 1, -1):
-            if series.iloc[i] is False:
-                return series.index[i + 1]
-        return series.idxmin()
-    else:
-        return None
-
-
-def _steps_to_achieve(eval_df: pd.DataFrame, criteria: str) -> int:
-    step_index = _first_const_true(eval_df[criteria])
-    if step_index is None:
-        return eval_df["step"].max() + 1
-    else:
-        return eval_df.loc[step_index]["step"] + 1
-
-
-def get_eval_metrics(eval_df: pd.DataFrame) -> Dict[str, int]:
-    eval_grouped = (
-        eval_df.groupby("step")
-        .agg(
-            {
-                "understanding": "all",
-                "correctness": "all",
-                "completeness": "any",
-            }
-        )
-        .reset_index()
-    )
-
+    # Metrics are computed for all conversations at once in the end of the run
     return {
-        "steps_total": eval_grouped["step"].max() + 1,
-        "steps_to_understanding": _steps_to_achieve(eval_grouped, "understanding"),
-        "steps_to_correctness": _steps_to_achieve(eval_grouped, "correctness"),
-        "steps_to_completeness": _steps_to_achieve(eval_grouped, "completeness"),
+        "conversation": conversation,
+        "complete": is_successful,
+        "evaluations": records,
+        # Response time, time to first token and speed of every model answer
+        "turn_metrics": list(model.turn_metrics),
+        # Policy changes which verdicts the metrics are computed from
+        "stop_policy": policy.name,
+        "evaluator_calls": len(records),
+        "evaluator_calls_saved": evaluator_calls_saved(records, evaluators_count),
     }
 
 
 def _evaluate_row(
-    model: LLM, evaluators: List[LLM], max_steps: int, row: pd.Series
+    model: LLM,
+    evaluators: List[LLM],
+    max_steps: int,
+    row: pd.Series,
+    seed: Union[int, None] = None,
+    policy: Union[StopPolicy, None] = None,
 ) -> Dict[str, object]:
+    if policy is None:
+        policy = FullPolicy()
+
     conversation, is_successful, evaluations = build_conversation(
-        row["question"], model=model, evaluators=evaluators, max_steps=max_steps
+        row["question"],
+        model=model,
+        evaluators=evaluators,
+        max_steps=max_steps,
+        seed=seed,
+        policy=policy,
+    )
+    return _row_result(
+        conversation, is_successful, evaluations, model, policy, len(evaluators)
+    )
+
+
+async def _evaluate_row_async(
+    model_name: str,
+    evaluator_names: List[str],
+    max_steps: int,
+    row: pd.Series,
+    seed: Union[int, None] = None,
+    cache: Union[ResponseCache, None] = None,
+    telemetry: Union[Telemetry, None] = None,
+    stream_budget: Union[StreamBudget, None] = None,
+    policy: Union[StopPolicy, None] = None,
+) -> Dict[str, object]:
+    if policy is None:
+        policy = FullPolicy()
+
+    # Async LLM instances are cheap and keep the conversation state inside,
+    # so every row gets its own model and evaluators
+    model = load_async_llm(model_name, cache, telemetry)
+    model.stream_budget = stream_budget
+    evaluators = [
+        load_async_llm(evaluator, cache, telemetry) for evaluator in evaluator_names
+    ]
+
+    conversation, is_successful, evaluations = await build_conversation_async(
+        row["question"],
+        model=model,
+        evaluators=evaluators,
+        max_steps=max_steps,
+        seed=seed,
+        policy=policy,
+    )
+    return _row_result(
+        conversation, is_successful, evaluations, model, policy, len(evaluators)
     )
-    result = {
-        "conversation": conversation,
-        "complete": is_successful,
-    } | get_eval_metrics(evaluations)
-    return result
 
 
 if __name__ == "__main__":
@@ -86,29 +146,224 @@ if __name__ == "__main__":
         "--evaluation_data", type=str, default="data/evaluation_data.parquet"
     )
     parser.add_argument("--output_dir", type=str, default="evaluation_results")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--use_async", action="store_true")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--cache_path", type=str, default=None)
+    parser.add_argument("--cache_max_entries", type=int, default=None)
+    parser.add_argument("--cache_ttl", type=float, default=None)
+    parser.add_argument("--rate_limits", type=str, nargs="*", default=[])
+    parser.add_argument("--client_settings", type=str, nargs="*", default=[])
+    parser.add_argument("--local_models", type=str, default=None)
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--telemetry_spans", action="store_true")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--max_answer_tokens", type=int, default=None)
+    parser.add_argument("--max_answer_seconds", type=float, default=None)
+    parser.add_argument("--shard", type=parse_shard, default=None)
+    parser.add_argument("--merge_shards", type=int, default=None)
+    parser.add_argument("--stop_policy", choices=list(policy_list), default="full")
+    parser.add_argument("--screeners", type=str, nargs="*", default=[])
+    parser.add_argument("--max_prompt_tokens", type=int, default=None)
+    parser.add_argument("--order_by_cost", action="store_true")
+    # Counts steps_to_* from the final run of steps where the criteria holds,
+    # published results have steps_to_* equal to steps_total, see metrics.py
+    parser.add_argument("--achieved_steps", action="store_true")
+    # Root of the partitioned result store, see result_store.py
+    parser.add_argument("--result_store", type=str, default=None)
 
     args, _ = parser.parse_known_args()
 
-    model = load_llm(args.model)
+    policy = load_policy(args.stop_policy, args.screeners)
 
-    evaluators = [load_llm(evaluator) for evaluator in args.evaluators]
+    # Screeners are queried as evaluators, the policy knows them by name
+    evaluator_names = args.screeners + args.evaluators
 
-    evaluation_data = pd.read_parquet(args.evaluation_data)
+    parse_client_settings(args.client_settings)
 
-    evaluation_results = evaluation_data.progress_apply(
-        lambda x: _evaluate_row(model, evaluators, args.max_steps, x),
-        axis=1,
-        result_type="expand",
+    # Models served by local servers are added to the models list
+    if args.local_models:
+        load_local_models(args.local_models)
+
+    # Limits are set after the local models, which are served by other providers
+    parse_rate_limits(args.rate_limits, model_provider)
+
+    # Responses cache is shared by all LLM instances of the run
+    cache = (
+        ResponseCache(args.cache_path, args.cache_max_entries, args.cache_ttl)
+        if args.cache_path
+        else None
     )
 
+    # Calls of all workers are collected for the run report
+    telemetry = Telemetry()
+
+    # Answers of the evaluated model are streamed to measure time to first token,
+    # evaluators answers are never cut, since they have to be parsed
+    stream_budget = (
+        StreamBudget(args.max_answer_tokens, args.max_answer_seconds)
+        if args.stream
+        else None
+    )
+
+    # Each worker gets its own model and evaluators,
+    # since LLM instances keep the conversation state inside
+    def _init_worker() -> Tuple[LLM, List[LLM]]:
+        model = load_llm(args.model, cache, telemetry)
+        model.stream_budget = stream_budget
+        evaluators = [
+            load_llm(evaluator, cache, telemetry) for evaluator in evaluator_names
+        ]
+        return model, evaluators
+
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir)
 
+    run_name = f"{args.model}___{args.max_steps}___vs___"
+    run_name += f"{'___and___'.join(evaluator_names)}"
+    if args.stop_policy != "full":
+        run_name += f"___{args.stop_policy}"
+
     date = datetime.date.today().isoformat()
 
-    result_name = f"{args.model}___{args.max_steps}___vs___"
-    result_name += f"{'___and___'.join(args.evaluators)}___{date}.parquet"
+    store_partition = {
+        "model": args.model,
+        "evaluators": "___and___".join(evaluator_names),
+        "date": date,
+    }
+
+    if args.merge_shards is not None:
+        # Results of all shards are merged into the usual result file
+        evaluation_results = merge_shards(
+            [
+                os.path.join(
+                    args.output_dir,
+                    slugify(
+                        f"{shard_run_name(run_name, (i, args.merge_shards))}.parquet"
+                    ),
+                )
+                for i in range(args.merge_shards)
+            ]
+        )
+        evaluation_results.to_parquet(
+            os.path.join(args.output_dir, slugify(f"{run_name}___{date}.parquet"))
+        )
+        if args.result_store:
+            write_results(
+                evaluation_results.assign(max_steps=args.max_steps),
+                args.result_store,
+                "evaluation",
+                store_partition,
+                f"{run_name}___{date}",
+            )
+        print(f"Merged {args.merge_shards} shards, {len(evaluation_results)} rows")
+        sys.exit()
+
+    # Every shard has its own journal and result file
+    if args.shard is not None:
+        run_name = shard_run_name(run_name, args.shard)
+
+    # Completed rows are journaled as soon as they finish,
+    # so a crashed run can be resumed with --resume flag
+    journal = ResultJournal(
+        os.path.join(args.output_dir, slugify(run_name) + ".journal.jsonl")
+    )
 
-    result_name = slugify(result_name)
+    evaluation_data = select_shard(pd.read_parquet(args.evaluation_data), args.shard)
+
+    if args.resume:
+        completed_ids = journal.completed_ids()
+        evaluation_data = evaluation_data[~evaluation_data["id"].isin(completed_ids)]
+        print(f"Resuming run, {len(completed_ids)} questions are already evaluated")
+    else:
+        journal.clear()
+
+    # Sizes of the questions are known from the data, so oversized questions
+    # are skipped and the longest ones can be started first. Prompts are
+    # counted only when one of these options is given
+    if args.max_prompt_tokens is not None or args.order_by_cost:
+        evaluation_data = select_by_prompt_size(
+            evaluation_data,
+            ["question"],
+            token_family(args.model),
+            args.max_prompt_tokens,
+            args.order_by_cost,
+        )
+
+    if args.use_async:
+        # With async backends one process keeps up to --concurrency
+        # conversations in flight without a thread per conversation
+        async def _run_async() -> None:
+            async for index, result in iter_concurrently_async(
+                evaluation_data,
+                lambda x: _evaluate_row_async(
+                    args.model,
+                    evaluator_names,
+                    args.max_steps,
+                    x,
+                    args.seed,
+                    cache,
+                    telemetry,
+                    stream_budget,
+                    policy,
+                ),
+                concurrency=args.concurrency,
+            ):
+                journal.append(index, evaluation_data.at[index, "id"], result)
+
+        asyncio.run(_run_async())
+    else:
+        for index, result in iter_concurrently(
+            evaluation_data,
+            _init_worker,
+            lambda llms, x: _evaluate_row(
+                llms[0], llms[1], args.max_steps, x, args.seed, policy
+            ),
+            concurrency=args.concurrency,
+        ):
+            journal.append(index, evaluation_data.at[index, "id"], result)
+
+    result_name = (
+        slugify(f"{run_name}___{date}.parquet")
+        if args.shard is None
+        else slugify(f"{run_name}.parquet")
+    )
+
+    evaluation_results = journal.to_dataframe()
+
+    if "evaluations" in evaluation_results:
+        evaluation_results = evaluation_results.join(
+            get_batch_eval_metrics(
+                verdicts_from_results(evaluation_results), args.achieved_steps
+            )
+        )
 
     evaluation_results.to_parquet(os.path.join(args.output_dir, result_name))
+
+    # Shards are written to the store when they are merged
+    if args.result_store and args.shard is None:
+        write_results(
+            evaluation_results.assign(max_steps=args.max_steps),
+            args.result_store,
+            "evaluation",
+            store_partition,
+            f"{run_name}___{date}",
+        )
+
+    write_telemetry(
+        telemetry, os.path.join(args.output_dir, result_name), args.telemetry_spans
+    )
+
+    # The journal is kept while there are failed rows to retry with --resume
+    if not journal.has_errors():
+        journal.clear()
+
+    if "evaluator_calls" in evaluation_results:
+        print(
+            f"Evaluator calls: {evaluation_results['evaluator_calls'].sum()}, "
+            f"saved by {policy.name} policy: "
+            f"{evaluation_results['evaluator_calls_saved'].sum()}"
+        )
+
+    if cache is not None:
+        print(f"Response cache: {cache.stats()}")
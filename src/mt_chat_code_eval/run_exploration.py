@@ -0,0 +1,146 @@
+import argparse
+import datetime
+import os
+from typing import Dict, List, Tuple
+
+import pandas as pd
+from dotenv import load_dotenv
+from slugify import slugify
+
+from mt_chat_code_eval.cache import ResponseCache
+from mt_chat_code_eval.clients import parse_client_settings
+from mt_chat_code_eval.exploration import explore_conversation
+from mt_chat_code_eval.llm_abstract import LLM
+from mt_chat_code_eval.llm_fabric import load_llm, load_local_models, model_provider
+from mt_chat_code_eval.parallel import iter_concurrently
+from mt_chat_code_eval.policies import load_policy, policy_list
+from mt_chat_code_eval.rate_limit import parse_rate_limits
+from mt_chat_code_eval.telemetry import Telemetry, write_telemetry
+
+# Load local environment variables
+load_dotenv()
+
+
+def _success_rate_distribution(success_rates: pd.Series) -> Dict[str, object]:
+    # Distribution of the per question success rates over the questions
+    success_rates = success_rates.dropna().astype(float)
+    histogram = pd.cut(success_rates, [0, 0.25, 0.5, 0.75, 1], include_lowest=True)
+    return {
+        "questions": len(success_rates),
+        "mean": round(float(success_rates.mean()), 3),
+        "quantiles": {
+            q: round(value, 3)
+            for q, value in success_rates.quantile([0.1, 0.5, 0.9]).items()
+        },
+        "histogram": {
+            f"{interval.right:g}": int(count)
+            for interval, count in histogram.value_counts(sort=False).items()
+        },
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--model", type=str, required=True)
+    parser.add_argument(
+        "--evaluators",
+        type=str,
+        nargs="+",
+        default=["gpt-4o-2024-08-06"],
+    )
+    parser.add_argument("--max_steps", type=int, default=5)
+    parser.add_argument(
+        "--evaluation_data", type=str, default="data/evaluation_data.parquet"
+    )
+    parser.add_argument("--output_dir", type=str, default="evaluation_results")
+    # Questions are explored in parallel, branches of every question as well
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--branch_concurrency", type=int, default=4)
+    parser.add_argument("--max_branches", type=int, default=8)
+    parser.add_argument("--top_k", type=int, default=None)
+    parser.add_argument("--max_calls", type=int, default=None)
+    parser.add_argument("--followup_similarity", type=float, default=0.9)
+    parser.add_argument("--stop_policy", choices=list(policy_list), default="full")
+    parser.add_argument("--screeners", type=str, nargs="*", default=[])
+    parser.add_argument("--cache_path", type=str, default=None)
+    parser.add_argument("--rate_limits", type=str, nargs="*", default=[])
+    parser.add_argument("--client_settings", type=str, nargs="*", default=[])
+    parser.add_argument("--local_models", type=str, default=None)
+    parser.add_argument("--telemetry_spans", action="store_true")
+
+    args, _ = parser.parse_known_args()
+
+    policy = load_policy(args.stop_policy, args.screeners)
+    evaluator_names = args.screeners + args.evaluators
+
+    parse_client_settings(args.client_settings)
+
+    if args.local_models:
+        load_local_models(args.local_models)
+
+    # Limits are set after the local models, which are served by other providers
+    parse_rate_limits(args.rate_limits, model_provider)
+
+    cache = ResponseCache(args.cache_path) if args.cache_path else None
+
+    telemetry = Telemetry()
+
+    # Branches fork these instances, so every worker needs only one set
+    def _init_worker() -> Tuple[LLM, List[LLM]]:
+        model = load_llm(args.model, cache, telemetry)
+        evaluators = [
+            load_llm(evaluator, cache, telemetry) for evaluator in evaluator_names
+        ]
+        return model, evaluators
+
+    evaluation_data = pd.read_parquet(args.evaluation_data)
+
+    results: Dict[object, Dict[str, object]] = {}
+    for index, result in iter_concurrently(
+        evaluation_data,
+        _init_worker,
+        lambda llms, x: explore_conversation(
+            x["question"],
+            llms[0],
+            llms[1],
+            max_steps=args.max_steps,
+            max_branches=args.max_branches,
+            top_k=args.top_k,
+            max_calls=args.max_calls,
+            similarity=args.followup_similarity,
+            concurrency=args.branch_concurrency,
+            policy=policy,
+        ),
+        concurrency=args.concurrency,
+    ):
+        results[index] = {"id": evaluation_data.at[index, "id"], **result}
+
+    exploration_results = pd.DataFrame.from_dict(results, orient="index").sort_index()
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    run_name = f"{args.model}___{args.max_steps}___vs___"
+    run_name += f"{'___and___'.join(evaluator_names)}___explore"
+
+    date = datetime.date.today().isoformat()
+
+    result_name = slugify(f"{run_name}___{date}.parquet")
+
+    exploration_results.to_parquet(os.path.join(args.output_dir, result_name))
+
+    write_telemetry(
+        telemetry, os.path.join(args.output_dir, result_name), args.telemetry_spans
+    )
+
+    # Histogram bins are given by their upper bounds
+    for column in ["success_rate", "weighted_success_rate"]:
+        if column in exploration_results:
+            distribution = _success_rate_distribution(exploration_results[column])
+            print(f"{column}: {distribution}")
+
+    # Branches cut by the budget are not counted in the success rates
+    if "truncated_count" in exploration_results:
+        print(f"Truncated branches: {exploration_results['truncated_count'].sum()}")
@@ -0,0 +1,60 @@
+import argparse
+import logging
+import os
+import sys
+
+import pandas as pd
+
+from mt_chat_code_eval.metrics import get_batch_eval_metrics, verdicts_from_results
+
+logger = logging.getLogger(__name__)
+
+_metric_columns = [
+    "steps_total",
+    "steps_to_understanding",
+    "steps_to_correctness",
+    "steps_to_completeness",
+]
+
+if __name__ == "__main__":
+
+    # Re-scores evaluation results from the evaluators verdicts stored with them,
+    # all conversations of a result file are scored in one vectorized pass.
+    # Re-scored files are written to the output folder, inputs are not changed
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("results", type=str, nargs="+")
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--achieved_steps", action="store_true")
+
+    args, _ = parser.parse_known_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    skipped = []
+
+    for results_path in args.results:
+        output_path = os.path.join(args.output_dir, os.path.basename(results_path))
+        if os.path.abspath(output_path) == os.path.abspath(results_path):
+            sys.exit(f"Output folder {args.output_dir} contains the input files")
+
+        results = pd.read_parquet(results_path)
+
+        # Results written before the verdicts were stored can't be re-scored
+        if "evaluations" not in results:
+            logger.warning("%s has no evaluators verdicts, skipping it", results_path)
+            skipped.append(results_path)
+            continue
+
+        results = results.drop(columns=_metric_columns, errors="ignore").join(
+            get_batch_eval_metrics(verdicts_from_results(results), args.achieved_steps)
+        )
+
+        results.to_parquet(output_path)
+
+        print(f"{output_path}: {results[_metric_columns].mean().to_dict()}")
+
+    print(f"Re-scored {len(args.results) - len(skipped)} files, skipped {len(skipped)}")
+
+    if skipped:
+        sys.exit(f"Files without evaluators verdicts: {', '.join(skipped)}")
@@ -0,0 +1,57 @@
+import argparse
+import json
+import sys
+
+import pandas as pd
+
+from mt_chat_code_eval.llm_fabric import model_list
+from mt_chat_code_eval.result_store import leaderboard, migrate_results, query
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("command", choices=["migrate", "leaderboard", "query"])
+    parser.add_argument("--result_store", type=str, default="result_store")
+    parser.add_argument("--kind", choices=["evaluation", "validation"], default=None)
+    # Loose result files to migrate
+    parser.add_argument("--evaluation_results", type=str, default="evaluation_results")
+    parser.add_argument("--validation_results", type=str, default="validation_results")
+    # Filters are given as a JSON list of [column, op, value]
+    parser.add_argument("--filters", type=str, default=None)
+    parser.add_argument("--columns", type=str, nargs="*", default=None)
+    parser.add_argument("--output", type=str, default=None)
+
+    args, _ = parser.parse_known_args()
+
+    filters = [tuple(f) for f in json.loads(args.filters)] if args.filters else None
+
+    if args.command == "migrate":
+        sources = {
+            "evaluation": args.evaluation_results,
+            "validation": args.validation_results,
+        }
+        for kind, results_dir in sources.items():
+            if args.kind is not None and kind != args.kind:
+                continue
+            migrated = migrate_results(
+                results_dir, args.result_store, kind, list(model_list)
+            )
+            print(f"Migrated {len(migrated)} {kind} result files")
+        sys.exit()
+
+    if args.command == "leaderboard":
+        results = leaderboard(args.result_store, filters)  # type: ignore
+    else:
+        results = query(
+            args.result_store,
+            args.kind or "evaluation",
+            args.columns,
+            filters,  # type: ignore
+        )
+
+    if args.output:
+        results.to_parquet(args.output)
+    else:
+        with pd.option_context("display.width", 200, "display.max_columns", None):
+            print(results)
@@ -0,0 +1,136 @@
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Union
+
+from mt_chat_code_eval.sharding import JobQueue, run_id, worker_name
+
+_runners = {
+    "evaluation": "mt_chat_code_eval.run_evaluation",
+    "validation": "mt_chat_code_eval.run_validation",
+}
+
+
+def _work(queue_path: str, name: str) -> None:
+    # Every worker thread has its own connection to the queue
+    # and runs one runner process at a time
+    queue = JobQueue(queue_path)
+
+    while (job := queue.claim(name)) is not None:
+        job_id, command = job
+        print(f"{name} runs job {job_id}: {' '.join(command)}")
+
+        returncode = subprocess.run([sys.executable] + command).returncode
+
+        queue.finish(job_id, returncode == 0)
+
+    queue.close()
+
+
+def _run_workers(queue_path: str, processes: int) -> None:
+    workers = [
+        threading.Thread(target=_work, args=(queue_path, f"{worker_name()}:{i}"))
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def _wait_for_queue(
+    queue: JobQueue,
+    run: str,
+    stale_timeout: Union[float, None],
+    poll_interval: float,
+) -> Dict[str, int]:
+    # Jobs may still run on other machines after the local workers are done,
+    # we wait for them or for the stale jobs that are given back to the queue
+    while True:
+        if stale_timeout is not None:
+            queue.requeue_stale(stale_timeout)
+
+        counts = queue.counts(run)
+        if counts.get("pending", 0) > 0 or counts.get("running", 0) == 0:
+            return counts
+
+        time.sleep(poll_interval)
+
+
+def _shard_commands(
+    module: str, models: List[str], shards: int, runner_args: List[str]
+) -> List[List[str]]:
+    return [
+        ["-m", module, "--model", model, "--shard", f"{i}/{shards}"] + runner_args
+        for model in models
+        for i in range(shards)
+    ]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--runner", choices=list(_runners), default="evaluation")
+    parser.add_argument("--models", type=str, nargs="+", default=[])
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--queue", type=str, default="shard_queue.sqlite")
+    parser.add_argument("--join", action="store_true")
+    parser.add_argument("--run_id", type=str, default=None)
+    parser.add_argument("--stale_timeout", type=float, default=None)
+    parser.add_argument("--poll_interval", type=float, default=10.0)
+
+    # Arguments that are not known here are passed to the runner,
+    # e.g. --evaluators, --max_steps or --output_dir
+    args, runner_args = parser.parse_known_args()
+
+    module = _runners[args.runner]
+
+    queue = JobQueue(args.queue)
+
+    commands = _shard_commands(module, args.models, args.shards, runner_args)
+
+    # Jobs done by a run with other arguments or inputs are not reused,
+    # --run_id names the run explicitly, e.g. to run it again from scratch
+    run = args.run_id if args.run_id is not None else run_id(commands)
+
+    # With --join this process only helps to run the jobs of an existing queue,
+    # e.g. on another machine with the same shared filesystem
+    if not args.join:
+        print(f"Run {run}")
+        queue.add(run, commands)
+
+    while True:
+        _run_workers(args.queue, args.processes)
+
+        if args.join:
+            sys.exit()
+
+        counts = _wait_for_queue(queue, run, args.stale_timeout, args.poll_interval)
+
+        if counts.get("pending", 0) == 0:
+            break
+
+    print(f"Jobs: {counts}")
+
+    failed = queue.failed(run)
+
+    # Shards of the model are merged only when all of them succeeded,
+    # failed jobs are retried by running the coordinator again
+    for model in args.models:
+        if any(command[command.index("--model") + 1] == model for command in failed):
+            print(f"Some shards of {model} failed, results are not merged")
+            continue
+
+        subprocess.run(
+            [sys.executable, "-m", module, "--model", model]
+            + ["--merge_shards", str(args.shards)]
+            + runner_args,
+            check=True,
+        )
+
+    queue.close()
@@ -0,0 +1,266 @@
+import argparse
+import datetime
+import os
+from typing import Callable, Dict, List, Tuple, Union
+
+import pandas as pd
+from dotenv import load_dotenv
+from slugify import slugify
+
+from mt_chat_code_eval.cache import ResponseCache
+from mt_chat_code_eval.clients import parse_client_settings
+from mt_chat_code_eval.conversation import ConversationTree, build_conversation
+from mt_chat_code_eval.llm_abstract import LLM
+from mt_chat_code_eval.llm_fabric import load_llm, load_local_models, model_provider
+from mt_chat_code_eval.metrics import get_batch_eval_metrics, verdicts_from_results
+from mt_chat_code_eval.parallel import iter_concurrently
+from mt_chat_code_eval.policies import (
+    StopPolicy,
+    evaluator_calls_saved,
+    load_policy,
+    policy_list,
+)
+from mt_chat_code_eval.rate_limit import parse_rate_limits
+from mt_chat_code_eval.result_store import write_results
+from mt_chat_code_eval.telemetry import Telemetry, write_telemetry
+
+# Load local environment variables
+load_dotenv()
+
+# LLM instances of one worker thread, keyed by the role in the sweep:
+# the evaluated model name or the evaluator name with its position in a panel,
+# so an instance is never used for two conversations at the same time
+WorkerLLMs = Dict[Tuple[str, ...], LLM]
+
+
+def _panel_name(panel: List[str]) -> str:
+    return "___and___".join(panel)
+
+
+def _evaluate_question(
+    llms: WorkerLLMs,
+    load: Callable[[str], LLM],
+    model_name: str,
+    panels: List[List[str]],
+    seeds: List[Union[int, None]],
+    max_steps: int,
+    policy: StopPolicy,
+    row: pd.Series,
+) -> Dict[str, object]:
+    def _llm(key: Tuple[str, ...]) -> LLM:
+        if key not in llms:
+            llms[key] = load(key[-1])
+        return llms[key]
+
+    model = _llm(("model", model_name))
+
+    # First answer of the model is generated once per question,
+    # every panel and seed continues the conversation from its snapshot
+    model.labels.update(role="model", step=0)
+    model.start_conversation(row["question"])
+    start = model.snapshot()
+
+    # Later turns of the same transcript prefix and evaluations of the same
+    # transcript are made once per question and taken from the tree
+    tree = ConversationTree()
+
+    results = []
+    for panel in panels:
+        evaluators = [
+            _llm(("evaluator", str(position), evaluator))
+            for position, evaluator in enumerate(panel)
+        ]
+
+        for seed in seeds:
+            conversation, is_successful, evaluations = build_conversation(
+                row["question"],
+                model=model,
+                evaluators=evaluators,
+                max_steps=max_steps,
+                seed=seed,
+                policy=policy,
+                start=start,
+                tree=tree,
+            )
+
+            records = evaluations.to_records()
+
+            results.append(
+                {
+                    "panel": _panel_name(panel),
+                    "seed": seed,
+                    "conversation": conversation,
+                    "complete": is_successful,
+                    "evaluations": records,
+                    "turn_metrics": list(model.turn_metrics),
+                    "stop_policy": policy.name,
+                    "evaluator_calls": len(records),
+                    "evaluator_calls_saved": evaluator_calls_saved(records, len(panel)),
+                }
+            )
+
+    return {
+        "panels": results,
+        "reused_turns": tree.reused_turns,
+        "reused_evaluations": tree.reused_evaluations,
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--models", type=str, nargs="+", required=True)
+    # Every panel is a comma separated list of evaluators
+    parser.add_argument("--panels", type=str, nargs="+", default=["gpt-4o-2024-08-06"])
+    parser.add_argument("--max_steps", type=int, default=5)
+    parser.add_argument(
+        "--evaluation_data", type=str, default="data/evaluation_data.parquet"
+    )
+    parser.add_argument("--output_dir", type=str, default="evaluation_results")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=None)
+    # Several seeds give different choices of follow-up questions
+    parser.add_argument("--seeds", type=int, nargs="*", default=[])
+    # Counts steps_to_* from the final run of steps where the criteria holds,
+    # published results have steps_to_* equal to steps_total, see metrics.py
+    parser.add_argument("--achieved_steps", action="store_true")
+    parser.add_argument("--cache_path", type=str, default=None)
+    parser.add_argument("--rate_limits", type=str, nargs="*", default=[])
+    parser.add_argument("--client_settings", type=str, nargs="*", default=[])
+    parser.add_argument("--local_models", type=str, default=None)
+    parser.add_argument("--telemetry_spans", action="store_true")
+    parser.add_argument("--stop_policy", choices=list(policy_list), default="full")
+    # Screeners are queried before the evaluators of every panel
+    parser.add_argument("--screeners", type=str, nargs="*", default=[])
+    # Root of the partitioned result store, see result_store.py
+    parser.add_argument("--result_store", type=str, default=None)
+
+    args, _ = parser.parse_known_args()
+
+    policy = load_policy(args.stop_policy, args.screeners)
+
+    parse_client_settings(args.client_settings)
+
+    # Models served by local servers are added to the models list
+    if args.local_models:
+        load_local_models(args.local_models)
+
+    # Limits are set after the local models, which are served by other providers
+    parse_rate_limits(args.rate_limits, model_provider)
+
+    # Screeners are queried as evaluators, the policy knows them by name
+    panels = [args.screeners + panel.split(",") for panel in args.panels]
+    seeds = args.seeds if args.seeds else [args.seed]
+
+    # Reuse within the sweep goes through the conversation trees of the
+    # questions, the response cache reuses answers of earlier runs
+    cache = ResponseCache(args.cache_path) if args.cache_path else None
+
+    telemetry = Telemetry()
+
+    evaluation_data = pd.read_parquet(args.evaluation_data)
+
+    # One job per model and question, all panels are evaluated inside the job
+    jobs = pd.concat(
+        [evaluation_data.assign(model=model) for model in args.models],
+        ignore_index=True,
+    )
+
+    results = []
+    reused_turns = 0
+    reused_evaluations = 0
+    for index, result in iter_concurrently(
+        jobs,
+        lambda: {},
+        lambda llms, x: _evaluate_question(
+            llms,
+            lambda name: load_llm(name, cache, telemetry),
+            x["model"],
+            panels,
+            seeds,
+            args.max_steps,
+            policy,
+            x,
+        ),
+        concurrency=args.concurrency,
+    ):
+        job = {"model": jobs.at[index, "model"], "id": jobs.at[index, "id"]}
+
+        if "error" in result:
+            results += [
+                {
+                    **job,
+                    "panel": _panel_name(panel),
+                    "seed": seed,
+                    "error": result["error"],
+                }
+                for panel in panels
+                for seed in seeds
+            ]
+        else:
+            results += [{**job, **panel} for panel in result["panels"]]  # type: ignore
+            reused_turns += result["reused_turns"]  # type: ignore
+            reused_evaluations += result["reused_evaluations"]  # type: ignore
+
+    # One table keyed by (model, panel, seed, id) for the whole sweep
+    sweep_results = (
+        pd.DataFrame(results)
+        .sort_values(["model", "panel", "seed", "id"], kind="stable")
+        .reset_index(drop=True)
+    )
+
+    if "evaluations" in sweep_results:
+        sweep_results = sweep_results.join(
+            get_batch_eval_metrics(
+                verdicts_from_results(sweep_results), args.achieved_steps
+            )
+        )
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    date = datetime.date.today().isoformat()
+
+    result_name = slugify(f"sweep___{'___'.join(args.models)}___{date}.parquet")
+
+    sweep_results.to_parquet(os.path.join(args.output_dir, result_name))
+
+    # Every model and panel is written to the store as a run of its own,
+    # the same way as run_evaluation writes it
+    if args.result_store:
+        for (model, panel), panel_results in sweep_results.groupby(
+            ["model", "panel"], sort=False
+        ):
+            run_name = f"{model}___{args.max_steps}___vs___{panel}"
+            if args.stop_policy != "full":
+                run_name += f"___{args.stop_policy}"
+
+            write_results(
+                panel_results.drop(columns=["panel"]).assign(max_steps=args.max_steps),
+                args.result_store,
+                "evaluation",
+                {"model": model, "evaluators": panel, "date": date},
+                f"sweep___{run_name}___{date}",
+            )
+
+    write_telemetry(
+        telemetry, os.path.join(args.output_dir, result_name), args.telemetry_spans
+    )
+
+    print(
+        f"First answers reused from snapshots: "
+        f"{len(jobs) * (len(panels) * len(seeds) - 1)}"
+    )
+    print(f"Model turns reused from the conversation trees: {reused_turns}")
+    print(f"Evaluations reused from the conversation trees: {reused_evaluations}")
+
+    if "evaluator_calls" in sweep_results:
+        print(
+            f"Evaluator calls: {sweep_results['evaluator_calls'].sum()}, "
+            f"saved by {policy.name} policy: "
+            f"{sweep_results['evaluator_calls_saved'].sum()}"
+        )
+
+    if cache is not None:
+        print(f"Response cache: {cache.stats()}")
@@ -1,16 +1,41 @@
 import argparse
 import datetime
 import os
-from typing import Dict, Union
+import sys
+from typing import Dict, Tuple, Union
 
 import pandas as pd
 import tqdm
 from dotenv import load_dotenv
 from slugify import slugify
 
+from mt_chat_code_eval.batch import (
+    BatchClient,
+    LocalBatchClient,
+    OpenAIBatchClient,
+    evaluate_conversations_batch,
+    llm_responder,
+)
+from mt_chat_code_eval.cache import ResponseCache
+from mt_chat_code_eval.clients import parse_client_settings
 from mt_chat_code_eval.evaluation import evaluate_conversation
 from mt_chat_code_eval.llm_abstract import LLM
-from mt_chat_code_eval.llm_fabric import load_llm
+from mt_chat_code_eval.llm_fabric import (
+    load_llm,
+    load_local_models,
+    model_provider,
+    token_family,
+)
+from mt_chat_code_eval.preprocessing import select_by_prompt_size
+from mt_chat_code_eval.rate_limit import parse_rate_limits
+from mt_chat_code_eval.result_store import write_results
+from mt_chat_code_eval.sharding import (
+    merge_shards,
+    parse_shard,
+    select_shard,
+    shard_run_name,
+)
+from mt_chat_code_eval.telemetry import Telemetry, write_telemetry
 
 # Load local environment variables
 load_dotenv()
@@ -18,10 +43,13 @@ load_dotenv()
 tqdm.tqdm.pandas()
 
 
-def _evaluate_row(model: LLM, row: pd.Series) -> Dict[str, Union[str, bool, int, None]]:
-    followup, understanding, correctness, completeness = evaluate_conversation(
-        model, [row["question"], row["answer"]]
-    )
+def _validation_result(
+    row: pd.Series,
+    evaluation: Tuple[
+        Union[str, None], Union[bool, None], Union[bool, None], Union[bool, None]
+    ],
+) -> Dict[str, Union[str, bool, int, None]]:
+    followup, understanding, correctness, completeness = evaluation
     return {
         "follow_up": followup,
         "understanding": understanding,
@@ -32,6 +60,11 @@ def _evaluate_row(model: LLM, row: pd.Series) -> Dict[str, Union[str, bool, int,
     }
 
 
+def _evaluate_row(model: LLM, row: pd.Series) -> Dict[str, Union[str, bool, int, None]]:
+    evaluation = evaluate_conversation(model, [row["question"], row["answer"]])
+    return _validation_result(row, evaluation)
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
@@ -41,23 +74,145 @@ if __name__ == "__main__":
         "--validation_data", type=str, default="data/validation_data.parquet"
     )
     parser.add_argument("--output_dir", type=str, default="validation_results")
+    parser.add_argument("--cache_path", type=str, default=None)
+    parser.add_argument("--cache_max_entries", type=int, default=None)
+    parser.add_argument("--cache_ttl", type=float, default=None)
+    parser.add_argument("--rate_limits", type=str, nargs="*", default=[])
+    parser.add_argument("--client_settings", type=str, nargs="*", default=[])
+    parser.add_argument("--local_models", type=str, default=None)
+    parser.add_argument("--batch", action="store_true")
+    parser.add_argument("--batch_dir", type=str, default=None)
+    parser.add_argument("--poll_interval", type=float, default=30.0)
+    parser.add_argument("--telemetry_spans", action="store_true")
+    parser.add_argument("--shard", type=parse_shard, default=None)
+    parser.add_argument("--merge_shards", type=int, default=None)
+    parser.add_argument("--max_prompt_tokens", type=int, default=None)
+    # Root of the partitioned result store, see result_store.py
+    parser.add_argument("--result_store", type=str, default=None)
 
     args, _ = parser.parse_known_args()
 
-    model = load_llm(args.model)
-
-    validation_data = pd.read_parquet(args.validation_data)
+    date = datetime.date.today().isoformat()
 
-    validation_results = validation_data.progress_apply(
-        lambda x: _evaluate_row(model, x), axis=1, result_type="expand"
+    if args.merge_shards is not None:
+        # Results of all shards are merged into the usual result file
+        validation_results = merge_shards(
+            [
+                os.path.join(
+                    args.output_dir,
+                    slugify(
+                        f"{shard_run_name(args.model, (i, args.merge_shards))}.parquet"
+                    ),
+                )
+                for i in range(args.merge_shards)
+            ]
+        )
+        validation_results.to_parquet(
+            os.path.join(args.output_dir, slugify(f"{args.model}___{date}.parquet"))
+        )
+        if args.result_store:
+            write_results(
+                validation_results,
+                args.result_store,
+                "validation",
+                {"model": args.model, "date": date},
+                f"{args.model}___{date}",
+            )
+        print(f"Merged {args.merge_shards} shards, {len(validation_results)} rows")
+        sys.exit()
+
+    parse_client_settings(args.client_settings)
+
+    # Models served by local servers are added to the models list
+    if args.local_models:
+        load_local_models(args.local_models)
+
+    # Limits are set after the local models, which are served by other providers
+    parse_rate_limits(args.rate_limits, model_provider)
+
+    # Responses cache is shared by all LLM instances of the run
+    cache = (
+        ResponseCache(args.cache_path, args.cache_max_entries, args.cache_ttl)
+        if args.cache_path
+        else None
     )
 
+    telemetry = Telemetry()
+
+    model = load_llm(args.model, cache, telemetry)
+    model.labels["role"] = "evaluator"
+
+    validation_data = select_shard(pd.read_parquet(args.validation_data), args.shard)
+
+    # Conversations that don't fit into the evaluator context are skipped
+    if args.max_prompt_tokens is not None:
+        validation_data = select_by_prompt_size(
+            validation_data,
+            ["question", "answer"],
+            token_family(args.model),
+            args.max_prompt_tokens,
+        )
+
+    if args.batch:
+        # All evaluation prompts are sent as one batch job. With --batch_dir
+        # the job is answered locally by the model, which allows offline runs.
+        batch_client: BatchClient = (
+            LocalBatchClient(
+                args.batch_dir,
+                llm_responder(model),
+            )
+            if args.batch_dir
+            else OpenAIBatchClient(args.model)
+        )
+
+        evaluations = evaluate_conversations_batch(
+            batch_client,
+            args.model,
+            {
+                index: [row["question"], row["answer"]]
+                for index, row in validation_data.iterrows()
+            },
+            model.generation_params,
+            poll_interval=args.poll_interval,
+        )
+
+        validation_results = pd.DataFrame(
+            [
+                _validation_result(row, evaluations[index])
+                for index, row in validation_data.iterrows()
+            ],
+            index=validation_data.index,
+        )
+    else:
+        validation_results = validation_data.progress_apply(
+            lambda x: _evaluate_row(model, x), axis=1, result_type="expand"
+        )
+
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir)
 
-    date = datetime.date.today().isoformat()
-
-    result_name = f"{args.model}___{date}.parquet"
+    if args.shard is None:
+        result_name = f"{args.model}___{date}.parquet"
+    else:
+        # Shard results don't have a date, see sharding.shard_run_name
+        result_name = f"{shard_run_name(args.model, args.shard)}.parquet"
     result_name = slugify(result_name)
 
     validation_results.to_parquet(os.path.join(args.output_dir, result_name))
+
+    # Shards are written to the store when they are merged
+    if args.result_store and args.shard is None:
+        write_results(
+            validation_results,
+            args.result_store,
+            "validation",
+            {"model": args.model, "date": date},
+            f"{args.model}___{date}",
+        )
+
+    write_telemetry(
+        telemetry, os.path.join(args.output_dir, result_name), args.telemetry_spans
+    )
+
+    if cache is not None:
+        print(f"Response cache: {cache.stats()}")
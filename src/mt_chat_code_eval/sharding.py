@@ -0,0 +1,159 @@
+# This module contains helpers to split a run into shards, a job queue that
+# worker processes on one or many machines pull shard jobs from, and
+# a deterministic merge of the shard results into one result file.
+
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import time
+from typing import Dict, List, Tuple, Union
+
+import pandas as pd
+
+Shard = Tuple[int, int]
+
+
+def parse_shard(value: str) -> Shard:
+    # Shard is given as "i/N", i is zero based
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard should be given as i/N, got {value}")
+
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index should be in [0, {count}), got {value}")
+
+    return index, count
+
+
+def select_shard(data: pd.DataFrame, shard: Union[Shard, None]) -> pd.DataFrame:
+    # Rows are assigned by position, so shards are balanced and don't depend on
+    # the index type; the original index is kept for the merge
+    if shard is None:
+        return data
+    index, count = shard
+    return data.iloc[index::count]
+
+
+def shard_run_name(run_name: str, shard: Shard) -> str:
+    # Shard results don't have a date in the name,
+    # so the merge finds them even if shards finished on different days
+    index, count = shard
+    return f"{run_name}___shard-{index}-of-{count}"
+
+
+def merge_shards(paths: List[str]) -> pd.DataFrame:
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"Shard results are missing: {missing}")
+
+    results = pd.concat([pd.read_parquet(path) for path in paths])
+
+    if results.index.has_duplicates:
+        raise ValueError("Shard results overlap, they were run with different data")
+
+    # Stable sort by the original index makes the merged file
+    # the same as the one written by the unsharded run
+    return results.sort_index(kind="stable")
+
+
+# Queue of shard jobs in SQLite. Every job is a runner command line of a run,
+# workers claim pending jobs in a transaction, so several processes and
+# machines can pull from one queue file without a running service.
+class JobQueue:
+    def __init__(self, path: str):
+        self.path = path
+
+        # Default rollback journal is used instead of WAL,
+        # since WAL doesn't work for a database on a network filesystem
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY, run TEXT, command TEXT, status TEXT, "
+            "worker TEXT, started REAL, finished REAL, attempts INTEGER, "
+            "UNIQUE (run, command))"
+        )
+
+    def add(self, run: str, commands: List[List[str]]) -> None:
+        # Adding the same job of the same run again is a no-op, unless it failed
+        # before, so a coordinator can be restarted to retry failed jobs.
+        # Jobs of other runs are new jobs, even with the same command line
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO jobs (run, command, status, attempts) "
+                "VALUES (?, ?, 'pending', 0) "
+                "ON CONFLICT (run, command) DO UPDATE SET status = 'pending' "
+                "WHERE status = 'failed'",
+                [(run, json.dumps(command)) for command in commands],
+            )
+
+    def claim(self, worker: str) -> Union[Tuple[int, List[str]], None]:
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._connection.execute(
+                "SELECT id, command FROM jobs WHERE status = 'pending' "
+                "ORDER BY id LIMIT 1"
+            ).fetchone()
+
+            if row is not None:
+                self._connection.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, started = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (worker, time.time(), row[0]),
+                )
+        finally:
+            self._connection.execute("COMMIT")
+
+        return (row[0], json.loads(row[1])) if row is not None else None
+
+    def finish(self, job_id: int, success: bool) -> None:
+        with self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, finished = ? WHERE id = ?",
+                ("done" if success else "failed", time.time(), job_id),
+            )
+
+    def requeue_stale(self, timeout: float) -> int:
+        # Jobs of workers that died (e.g. a machine went down) are given back
+        with self._connection:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET status = 'pending' "
+                "WHERE status = 'running' AND started < ?",
+                (time.time() - timeout,),
+            )
+        return cursor.rowcount
+
+    def counts(self, run: str) -> Dict[str, int]:
+        rows = self._connection.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE run = ? GROUP BY status",
+            (run,),
+        ).fetchall()
+        return {status: count for status, count in rows}
+
+    def failed(self, run: str) -> List[List[str]]:
+        rows = self._connection.execute(
+            "SELECT command FROM jobs WHERE run = ? AND status = 'failed' "
+            "ORDER BY id",
+            (run,),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def run_id(commands: List[List[str]]) -> str:
+    # Run is identified by the job command lines and the input files given in
+    # them, so a run with other arguments or changed data gets new jobs
+    digest = hashlib.sha256(json.dumps(commands).encode("utf-8"))
+    for path in sorted({arg for command in commands for arg in command}):
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
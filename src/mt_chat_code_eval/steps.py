@@ -0,0 +1,55 @@
+# This module contains drivers of the step loops of conversations and
+# evaluations. Loops are written once, as generators that yield the calls
+# they need (model turns, evaluator waves) and receive their results.
+# Drivers make the calls, blocking or with await, so the blocking and async
+# runs share the logic of the loops and differ only in the calls.
+
+from typing import Awaitable, Callable, Generator, NamedTuple, TypeVar
+
+from mt_chat_code_eval.llm_abstract import LLM, AsyncLLM
+
+Request = TypeVar("Request")
+Result = TypeVar("Result")
+Return = TypeVar("Return")
+
+
+# Next turn of the conversation with one model
+class ModelTurn(NamedTuple):
+    prompt: str
+    # Turn starts a new conversation instead of continuing the current one
+    start: bool = False
+
+
+def take_turn(llm: LLM, turn: ModelTurn) -> str:
+    if turn.start:
+        return llm.start_conversation(turn.prompt)
+    return llm.continue_conversation(turn.prompt)
+
+
+async def take_turn_async(llm: AsyncLLM, turn: ModelTurn) -> str:
+    if turn.start:
+        return await llm.start_conversation(turn.prompt)
+    return await llm.continue_conversation(turn.prompt)
+
+
+def run_steps(
+    steps: Generator[Request, Result, Return], call: Callable[[Request], Result]
+) -> Return:
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(call(request))
+    except StopIteration as stop:
+        return stop.value
+
+
+async def run_steps_async(
+    steps: Generator[Request, Result, Return],
+    call: Callable[[Request], Awaitable[Result]],
+) -> Return:
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(await call(request))
+    except StopIteration as stop:
+        return stop.value
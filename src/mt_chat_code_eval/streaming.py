@@ -0,0 +1,64 @@
+# This module contains helpers for streamed model answers.
+# StreamMeter consumes answer chunks as they arrive, measures time to the
+# first token and stops the stream once the answer is over its budget.
+
+import time
+from typing import List, Union
+
+
+# Limits of one streamed answer, None means no limit
+class StreamBudget:
+    def __init__(
+        self,
+        max_tokens: Union[int, None] = None,
+        max_seconds: Union[float, None] = None,
+    ):
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+
+
+class StreamMeter:
+    def __init__(self, budget: StreamBudget):
+        self.budget = budget
+
+        self.time_to_first_token: Union[float, None] = None
+        self.aborted = False
+
+        self._parts: List[str] = []
+        self._characters = 0
+        self._started = time.perf_counter()
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    @property
+    def tokens(self) -> int:
+        # Same estimation as rate_limit.estimate_tokens,
+        # providers report the real usage only for complete streams
+        return self._characters // 4 + 1
+
+    def add(self, chunk: Union[str, None]) -> bool:
+        # Returns False when the answer is over the budget and
+        # the stream should be closed
+        elapsed = time.perf_counter() - self._started
+
+        if chunk:
+            if self.time_to_first_token is None:
+                self.time_to_first_token = elapsed
+
+            self._parts.append(chunk)
+            self._characters += len(chunk)
+
+        # Budget is checked when chunks arrive,
+        # a stream that stalls completely is limited by the client timeout
+        over_tokens = (
+            self.budget.max_tokens is not None and self.tokens >= self.budget.max_tokens
+        )
+        over_time = (
+            self.budget.max_seconds is not None and elapsed >= self.budget.max_seconds
+        )
+
+        self.aborted = over_tokens or over_time
+
+        return not self.aborted
@@ -0,0 +1,202 @@
+# This file contains a small OpenAI compatible chat completions server that
+# answers like the mock model. It stands in for a local inference server
+# (vLLM, llama.cpp server, TGI) to test the local backend offline: it serves
+# concurrent requests, streams answers and reports prompt tokens that would
+# be taken from the prefix cache of a real server.
+import argparse
+import hashlib
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Set, Union
+
+from mt_chat_code_eval.mock import _mock_answer, _split_answer
+from mt_chat_code_eval.rate_limit import estimate_tokens
+
+
+class PrefixCache:
+    def __init__(self) -> None:
+        self._prefixes: Set[str] = set()
+        self._lock = threading.Lock()
+
+        self.stats = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+    def process(self, messages: List[Dict[str, str]]) -> int:
+        # Returns tokens of the longest message prefix that was processed before,
+        # and remembers all prefixes of the request
+        keys = []
+        digest = hashlib.sha256()
+        for message in messages:
+            digest.update(json.dumps(message, sort_keys=True).encode("utf-8"))
+            keys.append(digest.hexdigest())
+
+        with self._lock:
+            cached = 0
+            for i, key in enumerate(keys):
+                if key in self._prefixes:
+                    cached = i + 1
+            self._prefixes.update(keys)
+
+            cached_tokens = (
+                estimate_tokens([m["content"] for m in messages[:cached]])
+                if cached
+                else 0
+            )
+            self.stats["requests"] += 1
+            self.stats["prompt_tokens"] += estimate_tokens(
+                [m["content"] for m in messages]
+            )
+            self.stats["cached_tokens"] += cached_tokens
+
+        return cached_tokens
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Set by run_stub_server
+    models: List[str] = []
+    latency = 0.0
+    cache = PrefixCache()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, object]) -> None:
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(
+                200,
+                {
+                    "object": "list",
+                    "data": [{"id": model, "object": "model"} for model in self.models],
+                },
+            )
+        elif self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.cache.stats)  # type: ignore
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self) -> None:
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+
+        if self.models and request.get("model") not in self.models:
+            self._send_json(
+                404, {"error": {"message": f"Model {request.get('model')} not found"}}
+            )
+            return
+
+        messages = request["messages"]
+        contents = [message["content"] for message in messages]
+
+        cached_tokens = self.cache.process(messages)
+        answer = _mock_answer(request["model"], contents[:-1], contents[-1], 0)
+
+        # Latency of the whole answer, requests are served concurrently
+        time.sleep(self.latency)
+
+        prompt_tokens = estimate_tokens(contents)
+        completion_tokens = estimate_tokens([answer])
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        if not request.get("stream"):
+            self._send_json(
+                200,
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": answer},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def _chunk(
+            choices: List[Dict[str, object]],
+            chunk_usage: Union[Dict[str, object], None] = None,
+        ) -> None:
+            body = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": choices,
+                "usage": chunk_usage,
+            }
+            self.wfile.write(f"data: {json.dumps(body)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            for part in _split_answer(answer):
+                _chunk([{"index": 0, "delta": {"content": part}}])
+            _chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if (request.get("stream_options") or {}).get("include_usage"):
+                _chunk([], usage)
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client closed the stream, e.g. the answer was over the budget
+            pass
+
+
+def run_stub_server(
+    host: str, port: int, models: List[str], latency: float = 0.0
+) -> ThreadingHTTPServer:
+    StubHandler.models = models
+    StubHandler.latency = latency
+    StubHandler.cache = PrefixCache()
+
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    # Served model names, any model is served if not given
+    parser.add_argument("--models", type=str, nargs="*", default=[])
+    parser.add_argument("--latency", type=float, default=0.0)
+
+    args, _ = parser.parse_known_args()
+
+    server = run_stub_server(args.host, args.port, args.models, args.latency)
+
+    print(f"Serving on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    print(f"Stats: {StubHandler.cache.stats}")
@@ -0,0 +1,267 @@
+# This module contains instrumentation of LLM calls.
+# Every call made by an LLM instance is described by a CallRecord and passed
+# to the call hooks of the instance, Telemetry collects the records of a run
+# and rolls them up per model, role and step.
+
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Tuple, Union
+
+import pandas as pd
+
+# Prices in USD per million of prompt and completion tokens.
+# Prices change over time, so they are only an estimate,
+# models without a price get no cost in the report.
+model_prices: Dict[str, Tuple[float, float]] = {
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-2024-08-06": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-3.5-turbo": (0.5, 1.5),
+    "gemini-1.5-flash": (0.075, 0.3),
+    "gemini-1.5-pro": (1.25, 5.0),
+    "gemini-1.0-pro": (0.5, 1.5),
+    "mock": (0.0, 0.0),
+}
+
+_record_fields = [
+    "model_name",
+    "role",
+    "step",
+    "start_time",
+    "duration",
+    "response_time",
+    "time_to_first_token",
+    "prompt_tokens",
+    "completion_tokens",
+    "retries",
+    "error",
+    "cached",
+    "aborted",
+]
+
+
+# Description of one call to the model, including all its retries
+class CallRecord:
+    __slots__ = _record_fields
+
+    def __init__(
+        self,
+        model_name: str,
+        role: Union[str, None],
+        step: Union[int, None],
+        start_time: float,
+        duration: float,
+        response_time: Union[float, None],
+        time_to_first_token: Union[float, None],
+        prompt_tokens: int,
+        completion_tokens: int,
+        retries: int,
+        error: Union[str, None],
+        cached: bool,
+        aborted: bool,
+    ):
+        self.model_name = model_name
+        self.role = role
+        self.step = step
+        # Unix time when the call was started
+        self.start_time = start_time
+        # Wall time of the call, including retries and backoff
+        self.duration = duration
+        # Time of the last attempt, from the request to the full response
+        self.response_time = response_time
+        # Known only for streamed answers
+        self.time_to_first_token = time_to_first_token
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.retries = retries
+        self.error = error
+        self.cached = cached
+        # Streamed answer was stopped because it was over the budget
+        self.aborted = aborted
+
+    def to_dict(self) -> Dict[str, object]:
+        return {field: getattr(self, field) for field in _record_fields}
+
+    def cost(self) -> Union[float, None]:
+        if self.model_name not in model_prices:
+            return None
+        prompt_price, completion_price = model_prices[self.model_name]
+        return (
+            self.prompt_tokens * prompt_price
+            + self.completion_tokens * completion_price
+        ) / 1e6
+
+    def tokens_per_second(self) -> Union[float, None]:
+        # For streamed answers the generation speed is measured
+        # after the first token, so it doesn't include the queueing time
+        if self.response_time is None or self.completion_tokens == 0:
+            return None
+        generation_time = self.response_time - (self.time_to_first_token or 0.0)
+        return self.completion_tokens / generation_time if generation_time > 0 else None
+
+    def turn_metrics(self) -> Dict[str, object]:
+        # Metrics of one answer, as they are stored in the evaluation results
+        return {
+            "response_time": self.response_time,
+            "time_to_first_token": self.time_to_first_token,
+            "completion_tokens": self.completion_tokens,
+            "tokens_per_second": self.tokens_per_second(),
+            "aborted": self.aborted,
+            "cached": self.cached,
+        }
+
+
+# Measures wall time of a call and the time of its current attempt
+class CallTimer:
+    def __init__(self) -> None:
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self._attempt_started = self._started
+
+    def start_attempt(self) -> None:
+        self._attempt_started = time.perf_counter()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def attempt_elapsed(self) -> float:
+        return time.perf_counter() - self._attempt_started
+
+
+# Thread-safe collector of call records, its record method is used as a call hook
+class Telemetry:
+    def __init__(self) -> None:
+        self._records: List[CallRecord] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def record(self, call: CallRecord) -> None:
+        with self._lock:
+            self._records.append(call)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        with self._lock:
+            records = list(self._records)
+
+        calls = pd.DataFrame(
+            [call.to_dict() for call in records], columns=_record_fields
+        )
+        calls["cost"] = pd.Series([call.cost() for call in records], dtype=float)
+        calls["tokens_per_second"] = pd.Series(
+            [call.tokens_per_second() for call in records], dtype=float
+        )
+
+        return calls
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        calls = self.to_dataframe()
+
+        return {
+            "total": _rollup(calls),
+            "by_model": _rollup_by(calls, "model_name"),
+            "by_role": _rollup_by(calls, "role"),
+            "by_step": _rollup_by(calls, "step"),
+            "by_model_and_role": {
+                model_name: _rollup_by(model_calls, "role")
+                for model_name, model_calls in calls.groupby("model_name")
+            },
+        }
+
+    def write_report(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def write_spans(self, path: str) -> None:
+        # One span per call in the OpenTelemetry JSON shape,
+        # attribute names follow the GenAI semantic conventions
+        with self._lock:
+            records = list(self._records)
+
+        trace_id = uuid.uuid4().hex
+
+        with open(path, "w", encoding="utf-8") as file:
+            for call in records:
+                span = {
+                    "trace_id": trace_id,
+                    "span_id": os.urandom(8).hex(),
+                    "name": f"chat {call.model_name}",
+                    "start_time_unix_nano": int(call.start_time * 1e9),
+                    "end_time_unix_nano": int((call.start_time + call.duration) * 1e9),
+                    "attributes": {
+                        "gen_ai.request.model": call.model_name,
+                        "gen_ai.usage.input_tokens": call.prompt_tokens,
+                        "gen_ai.usage.output_tokens": call.completion_tokens,
+                        "mt_chat_code_eval.role": call.role,
+                        "mt_chat_code_eval.step": call.step,
+                        "mt_chat_code_eval.retries": call.retries,
+                        "mt_chat_code_eval.cached": call.cached,
+                        "mt_chat_code_eval.time_to_first_token": (
+                            call.time_to_first_token
+                        ),
+                        "mt_chat_code_eval.aborted": call.aborted,
+                    },
+                    "status": {
+                        "code": "ERROR" if call.error is not None else "OK",
+                        "message": call.error or "",
+                    },
+                }
+                file.write(json.dumps(span) + "\n")
+
+
+def _rollup(calls: pd.DataFrame) -> Dict[str, object]:
+    sent = calls[~calls["cached"].astype(bool)]
+    response_time = sent["response_time"].dropna()
+    time_to_first_token = sent["time_to_first_token"].dropna()
+
+    return {
+        "calls": len(calls),
+        "cached_calls": len(calls) - len(sent),
+        "errors": int(sent["error"].notna().sum()),
+        "retries": int(sent["retries"].sum()),
+        "prompt_tokens": int(sent["prompt_tokens"].sum()),
+        "completion_tokens": int(sent["completion_tokens"].sum()),
+        # Cost is None if any of the models has no known price
+        "cost": float(sent["cost"].sum()) if not sent["cost"].isna().any() else None,
+        "wall_time": float(sent["duration"].sum()),
+        "response_time_mean": _stat(response_time.mean()),
+        "response_time_p50": _stat(response_time.quantile(0.5)),
+        "response_time_p95": _stat(response_time.quantile(0.95)),
+        "time_to_first_token_p50": _stat(time_to_first_token.quantile(0.5)),
+        "time_to_first_token_p95": _stat(time_to_first_token.quantile(0.95)),
+        "tokens_per_second_mean": _stat(sent["tokens_per_second"].mean()),
+        "aborted": int(sent["aborted"].astype(bool).sum()),
+    }
+
+
+def _rollup_by(calls: pd.DataFrame, column: str) -> Dict[str, object]:
+    return {
+        str(key): _rollup(group)
+        for key, group in calls.groupby(calls[column].astype(str), sort=True)
+    }
+
+
+def _stat(value: float) -> Union[float, None]:
+    return None if pd.isna(value) else float(value)
+
+
+def write_telemetry(telemetry: Telemetry, result_path: str, spans: bool) -> None:
+    # Report is written next to the result file
+    # and a short summary is printed for the run log
+    telemetry.write_report(result_path + ".telemetry.json")
+
+    if spans:
+        telemetry.write_spans(result_path + ".spans.jsonl")
+
+    total = telemetry.summary()["total"]
+    print(
+        f"LLM calls: {total['calls']} ({total['cached_calls']} cached), "
+        f"errors: {total['errors']}, retries: {total['retries']}, "
+        f"tokens: {total['prompt_tokens']} + {total['completion_tokens']}, "
+        f"cost: {total['cost']}"
+    )
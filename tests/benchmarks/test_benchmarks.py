@@ -0,0 +1,137 @@
+import asyncio
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from mt_chat_code_eval.conversation import build_conversation, build_conversation_async
+from mt_chat_code_eval.evaluation import (
+    EvaluationPromptBuilder,
+    build_conversation_prompt,
+    parse_evaluation,
+)
+from mt_chat_code_eval.llm_abstract import LLM
+from mt_chat_code_eval.llm_fabric import load_async_llm, load_llm
+from mt_chat_code_eval.metrics import get_batch_eval_metrics
+from mt_chat_code_eval.mock import mock_settings
+from mt_chat_code_eval.parallel import iter_concurrently, iter_concurrently_async
+
+# Benchmarks measure the framework itself with the offline mock model,
+# so regressions in overhead and concurrency can be caught before real runs
+pytest.importorskip("pytest_benchmark")
+
+_max_steps = 5
+
+
+def _synthetic_conversation(steps: int) -> List[str]:
+    question = "How do I merge two dictionaries in Python? " * 40
+    answer = "You can use the `|` operator:\n```python\na | b\n```\n" * 60
+    return [question, answer] * steps
+
+
+def _synthetic_evaluation() -> str:
+    code = "```python\n" + "for i in range(10):\n    print(i)\n" * 200 + "```\n"
+    return (
+        "### Step-by-step analysis\n"
+        + code
+        + "### Follow-up question\nCan you explain it?\n"
+        + "### Understanding\nyes\n### Correctness\nno\n### Completeness\nno\n"
+    )
+
+
+def test_prompt_building_full(benchmark):
+    conversation = _synthetic_conversation(_max_steps)
+
+    def _full() -> None:
+        for step in range(1, _max_steps + 1):
+            build_conversation_prompt(conversation[: 2 * step])
+
+    benchmark(_full)
+
+
+def test_prompt_building_incremental(benchmark):
+    conversation = _synthetic_conversation(_max_steps)
+
+    def _incremental() -> None:
+        builder = EvaluationPromptBuilder()
+        for step in range(1, _max_steps + 1):
+            builder.build(conversation[: 2 * step])
+
+    benchmark(_incremental)
+
+
+def test_response_parsing(benchmark):
+    benchmark(parse_evaluation, _synthetic_evaluation())
+
+
+def test_metrics(benchmark):
+    rng = np.random.default_rng(0)
+
+    verdicts = pd.DataFrame(
+        [
+            {
+                "conversation_id": conversation_id,
+                "step": step,
+                "model_name": evaluator,
+                "understanding": bool(rng.random() < 0.8),
+                "correctness": bool(rng.random() < 0.7),
+                "completeness": bool(rng.random() < 0.5),
+            }
+            for conversation_id in range(10000)
+            for step in range(int(rng.integers(1, 6)))
+            for evaluator in ["a", "b"]
+        ]
+    )
+
+    benchmark(get_batch_eval_metrics, verdicts, True)
+
+
+@pytest.mark.parametrize("use_async", [False, True], ids=["threads", "async"])
+def test_end_to_end(benchmark, use_async):
+    # Rows per second and row latency percentiles are reported in extra info
+    questions, evaluators, concurrency = 50, 3, 16
+
+    mock_settings["latency"] = 0.01
+    mock_settings["complete_after"] = _max_steps
+
+    data = pd.DataFrame({"question": [f"Question {i}" for i in range(questions)]})
+    row_latencies: List[float] = []
+
+    def _init_worker() -> Tuple[LLM, List[LLM]]:
+        return load_llm("mock"), [load_llm("mock") for _ in range(evaluators)]
+
+    def _evaluate_row(llms: Tuple[LLM, List[LLM]], row: pd.Series) -> Dict:
+        start = time.perf_counter()
+        build_conversation(row["question"], llms[0], llms[1], _max_steps)
+        row_latencies.append(time.perf_counter() - start)
+        return {}
+
+    async def _evaluate_row_async(row: pd.Series) -> Dict:
+        start = time.perf_counter()
+        await build_conversation_async(
+            row["question"],
+            load_async_llm("mock"),
+            [load_async_llm("mock") for _ in range(evaluators)],
+            _max_steps,
+        )
+        row_latencies.append(time.perf_counter() - start)
+        return {}
+
+    async def _run_async() -> None:
+        async for _ in iter_concurrently_async(data, _evaluate_row_async, concurrency):
+            pass
+
+    def _run() -> None:
+        if use_async:
+            asyncio.run(_run_async())
+        else:
+            for _ in iter_concurrently(data, _init_worker, _evaluate_row, concurrency):
+                pass
+
+    benchmark.pedantic(_run, rounds=3)
+
+    benchmark.extra_info["rows_per_s"] = questions / benchmark.stats["min"]
+    benchmark.extra_info["row_p50_s"] = float(np.percentile(row_latencies, 50))
+    benchmark.extra_info["row_p95_s"] = float(np.percentile(row_latencies, 95))
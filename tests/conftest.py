@@ -0,0 +1,55 @@
+import threading
+from typing import Iterator, List
+
+import pytest
+
+from mt_chat_code_eval import llm_abstract
+from mt_chat_code_eval.mock import MockLLM, mock_settings
+from mt_chat_code_eval.stub_server import run_stub_server
+
+
+@pytest.fixture(autouse=True)
+def mock_defaults(monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    # Tests change the shared mock settings, they are restored after each test.
+    # Retries don't wait, so failing calls don't slow down the suite
+    settings = dict(mock_settings)
+    mock_settings.update(
+        latency=0.0,
+        latency_distribution="constant",
+        complete_after=2,
+        malformed_rate=0.0,
+        incorrect_rate=0.0,
+        failure_rate=0.0,
+        seed=0,
+    )
+    monkeypatch.setattr(llm_abstract, "backoff_delay", lambda *args: 0.0)
+    yield
+    mock_settings.clear()
+    mock_settings.update(settings)
+
+
+# Mock model that gives the scripted answers one after another
+class ScriptedLLM(MockLLM):
+    def __init__(self, model_name: str, answers: List[str]):
+        super().__init__(model_name)
+
+        self.answers = list(answers)
+        self.prompts: List[str] = []
+
+    def _answer(self, prompt: str, attempt: int) -> str:
+        self.prompts.append(prompt)
+        return self.answers.pop(0)
+
+
+@pytest.fixture
+def stub_server() -> Iterator[str]:
+    # Local OpenAI compatible server on a free port, yields its base url
+    server = run_stub_server("127.0.0.1", 0, ["stub-model"])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    host, port = server.server_address[:2]
+    yield f"http://{host}:{port}/v1"
+
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+from mt_chat_code_eval import prompts
+from mt_chat_code_eval.batch import (
+    LocalBatchClient,
+    OpenAIBatchClient,
+    build_batch_requests,
+    evaluate_conversations_batch,
+    llm_responder,
+    parse_batch_output,
+)
+from mt_chat_code_eval.llm_fabric import load_llm
+from mt_chat_code_eval.mock import mock_settings
+
+
+def test_build_batch_requests_merges_extra_body():
+    requests = build_batch_requests(
+        "model",
+        {"0": [{"role": "user", "content": "Prompt"}]},
+        {"temperature": 0.3, "extra_body": {"top_k": 5}},
+    )
+
+    assert requests[0]["custom_id"] == "0"
+    assert requests[0]["body"] == {
+        "model": "model",
+        "messages": [{"role": "user", "content": "Prompt"}],
+        "temperature": 0.3,
+        "top_k": 5,
+    }
+
+
+def test_parse_batch_output_keeps_failed_requests():
+    output = "\n".join(
+        [
+            json.dumps(
+                {
+                    "custom_id": "0",
+                    "response": {
+                        "status_code": 200,
+                        "body": {"choices": [{"message": {"content": "Answer"}}]},
+                    },
+                    "error": None,
+                }
+            ),
+            json.dumps({"custom_id": "1", "response": None, "error": {"code": "x"}}),
+            "",
+        ]
+    )
+
+    assert parse_batch_output(output) == {"0": "Answer", "1": None}
+
+
+def test_openai_batch_client_rejects_other_models():
+    with pytest.raises(ValueError):
+        OpenAIBatchClient("mock", client=object())  # type: ignore
+
+
+def test_local_batch_evaluations_match_the_mock(tmp_path):
+    model = load_llm("mock")
+    client = LocalBatchClient(str(tmp_path), llm_responder(model))
+    conversations = {i: [f"Question {i}", f"Answer {i}"] for i in range(5)}
+
+    evaluations = evaluate_conversations_batch(
+        client, "mock", conversations, model.generation_params, poll_interval=0
+    )
+
+    assert list(evaluations) == list(conversations)
+    for evaluation in evaluations.values():
+        assert evaluation[1:] == (True, True, False)
+        assert evaluation[0]
+
+
+def test_local_batch_retries_incomplete_evaluations(tmp_path):
+    mock_settings["malformed_rate"] = 0.5
+
+    model = load_llm("mock")
+    requests = []
+    respond = llm_responder(model)
+
+    def _respond(messages):
+        requests.append(messages)
+        return respond(messages)
+
+    conversations = {i: [f"Question {i}", f"Answer {i}"] for i in range(10)}
+
+    evaluations = evaluate_conversations_batch(
+        LocalBatchClient(str(tmp_path), _respond),
+        "mock",
+        conversations,
+        model.generation_params,
+        poll_interval=0,
+    )
+
+    # Only incomplete evaluations are asked again, in a second batch
+    assert len(conversations) < len(requests) < 2 * len(conversations)
+    assert len(list(tmp_path.glob("*.output.jsonl"))) == 2
+    assert len(evaluations) == len(conversations)
+
+    # Missing sections are asked in the evaluator conversation, as in
+    # evaluate_prompt, instead of sending the whole prompt again
+    first_batch = len(conversations)
+    for messages in requests[first_batch:]:
+        assert len(messages) == 3
+        assert messages[:1] in requests[:first_batch]
+        assert messages[1]["role"] == "assistant"
+        assert messages[-1]["content"].startswith(
+            prompts.evaluation_missing_prompt.split("{")[0]
+        )
@@ -0,0 +1,79 @@
+from mt_chat_code_eval.cache import ResponseCache
+from mt_chat_code_eval.llm_fabric import load_llm
+
+
+def test_key_depends_on_model_messages_and_params():
+    key = ResponseCache.make_key("a", ["Q"], {"temperature": 0.3})
+
+    assert key == ResponseCache.make_key("a", ["Q"], {"temperature": 0.3})
+    assert key != ResponseCache.make_key("b", ["Q"], {"temperature": 0.3})
+    assert key != ResponseCache.make_key("a", ["Q", "A"], {"temperature": 0.3})
+    assert key != ResponseCache.make_key("a", ["Q"], {"temperature": 0.0})
+    assert key != ResponseCache.make_key("a", ["Q"], {"temperature": 0.3}, "local")
+
+
+def test_max_entries_drops_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    cache.close()
+
+
+def test_expired_responses_are_missed(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl=-1)
+
+    cache.put("a", "1")
+
+    assert cache.get("a") is None
+    cache.close()
+
+
+def test_conversation_turns_are_cached(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+
+    first = load_llm("mock", cache)
+    answers = [first.start_conversation("Q1"), first.continue_conversation("Q2")]
+
+    second = load_llm("mock", cache)
+    cached = [second.start_conversation("Q1"), second.continue_conversation("Q2")]
+
+    assert cached == answers
+    assert second.get_current_conversation() == first.get_current_conversation()
+    assert cache.stats() == {"hits": 2, "misses": 2, "entries": 2}
+
+    # Other history is another key
+    second.start_conversation("Q2")
+    assert cache.stats()["misses"] == 3
+    cache.close()
+
+
+def test_invalid_answers_are_not_cached(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+
+    llm = load_llm("mock", cache)
+    llm.cache_validator = lambda answer: False
+    llm.start_conversation("Q1")
+
+    assert cache.stats()["entries"] == 0
+    cache.close()
+
+
+def test_backends_of_the_same_model_are_cached_apart(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+
+    hosted = load_llm("mock", cache)
+    hosted.start_conversation("Q1")
+
+    local = load_llm("mock", cache)
+    local.cache_namespace = "local:http://localhost:8000/v1/mock"
+    local.start_conversation("Q1")
+
+    assert cache.stats() == {"hits": 0, "misses": 2, "entries": 2}
+    cache.close()
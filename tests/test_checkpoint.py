@@ -0,0 +1,40 @@
+from mt_chat_code_eval.checkpoint import ResultJournal
+
+
+def test_completed_rows_are_skipped_on_resume(tmp_path):
+    journal = ResultJournal(str(tmp_path / "run.journal.jsonl"))
+
+    journal.append(0, "q0", {"steps_total": 2})
+    journal.append(1, "q1", {"error": "failed"})
+
+    assert journal.completed_ids() == {"q0"}
+    assert journal.has_errors()
+
+    # Resumed run retries the failed row, the latest record wins
+    resumed = ResultJournal(journal.path)
+    resumed.append(1, "q1", {"steps_total": 3})
+
+    assert resumed.completed_ids() == {"q0", "q1"}
+    assert not resumed.has_errors()
+    assert resumed.to_dataframe()["steps_total"].tolist() == [2, 3]
+
+
+def test_cut_last_line_is_ignored(tmp_path):
+    journal = ResultJournal(str(tmp_path / "run.journal.jsonl"))
+    journal.append(0, "q0", {"steps_total": 2})
+
+    # Process was killed in the middle of the write
+    with open(journal.path, "a", encoding="utf-8") as file:
+        file.write('{"index": 1, "id": "q1", "res')
+
+    assert journal.completed_ids() == {"q0"}
+    assert len(journal.to_dataframe()) == 1
+
+
+def test_clear(tmp_path):
+    journal = ResultJournal(str(tmp_path / "run.journal.jsonl"))
+    journal.append(0, "q0", {"steps_total": 2})
+
+    journal.clear()
+
+    assert journal.completed_ids() == set()
@@ -0,0 +1,94 @@
+from conftest import ScriptedLLM
+
+from mt_chat_code_eval import prompts
+from mt_chat_code_eval.evaluation import (
+    EvaluationPromptBuilder,
+    build_conversation_prompt,
+    evaluate_conversation,
+    is_incomplete_evaluation,
+    parse_evaluation,
+)
+
+_complete = """### Step-by-step analysis
+Looks fine.
+
+### Follow-up question
+Can you add tests?
+
+### Understanding
+yes
+
+### Correctness
+yes
+
+### Completeness
+no
+"""
+
+_truncated = _complete[: _complete.index("### Completeness")]
+
+_missing_completeness = """### Completeness
+yes
+"""
+
+
+def test_parse_evaluation():
+    assert parse_evaluation(_complete) == ("Can you add tests?", True, True, False)
+
+
+def test_parse_evaluation_with_missing_sections():
+    evaluation = parse_evaluation(_truncated)
+
+    assert evaluation == ("Can you add tests?", True, True, None)
+    assert is_incomplete_evaluation(*evaluation)
+
+
+def test_parse_evaluation_ignores_headers_in_code():
+    # Headers quoted in the analysis are not taken for the sections
+    response = _complete.replace(
+        "Looks fine.", "```\n### Understanding\nno\n```\nLooks fine."
+    )
+
+    assert parse_evaluation(response) == ("Can you add tests?", True, True, False)
+
+
+def test_parse_unparsable_evaluation():
+    evaluation = parse_evaluation("I cannot answer to this prompt.")
+
+    assert evaluation == (None, None, None, None)
+    assert is_incomplete_evaluation(*evaluation)
+
+
+def test_missing_sections_are_asked_in_the_same_conversation():
+    evaluator = ScriptedLLM("mock", [_truncated, _missing_completeness])
+
+    evaluation = evaluate_conversation(evaluator, ["Question", "Answer"])
+
+    assert evaluation == ("Can you add tests?", True, True, True)
+    assert evaluator.prompts[1] == prompts.evaluation_missing_prompt.format(
+        sections="### Completeness"
+    )
+    # Re-ask continues the evaluator conversation instead of starting a new one
+    assert len(evaluator.get_current_conversation()) == 4
+
+
+def test_unparsable_evaluation_is_asked_again():
+    evaluator = ScriptedLLM("mock", ["Sorry", _complete])
+
+    evaluation = evaluate_conversation(evaluator, ["Question", "Answer"])
+
+    assert evaluation == ("Can you add tests?", True, True, False)
+    assert evaluator.prompts[0] == evaluator.prompts[1]
+    assert len(evaluator.get_current_conversation()) == 2
+
+
+def test_prompt_builder_matches_full_prompt():
+    conversation = ["Q1", "A1", "Q2", "A2", "Q3", "A3"]
+    builder = EvaluationPromptBuilder()
+
+    for step in range(1, 4):
+        prompt = builder.build(conversation[: 2 * step])
+        assert prompt == build_conversation_prompt(conversation[: 2 * step])
+
+    # Restarted conversation is rendered from the start
+    assert builder.build(["Q", "A"]) == build_conversation_prompt(["Q", "A"])
@@ -0,0 +1,54 @@
+from mt_chat_code_eval.exploration import dedupe_followups, explore_conversation
+from mt_chat_code_eval.mock import MockLLM, mock_settings
+
+
+def _explore(max_calls=None):
+    # Mocks of other names ask other follow-ups, so the conversation branches
+    mock_settings["incorrect_rate"] = 0.3
+    mock_settings["complete_after"] = 3
+
+    return explore_conversation(
+        "Question",
+        MockLLM("mock"),
+        [MockLLM("a"), MockLLM("b"), MockLLM("c")],
+        max_calls=max_calls,
+    )
+
+
+def test_dedupe_followups():
+    groups = dedupe_followups(
+        ["Can you explain step 1?", "can you explain step 1", "What about tests?"]
+    )
+
+    assert groups == [("Can you explain step 1?", 2), ("What about tests?", 1)]
+
+
+def test_exploration_success_rates():
+    result = _explore()
+
+    leaves = result["branches"]
+    assert result["branches_count"] == len(leaves) > 1
+    assert result["truncated_count"] == 0
+    assert 0 < result["success_rate"] < 1
+    assert result["success_rate"] == sum(leaf["complete"] for leaf in leaves) / len(
+        leaves
+    )
+    # Transcripts of the leaves are the conversations of their branches
+    for leaf in leaves:
+        assert len(leaf["conversation"]) == 2 * (len(leaf["followups"]) + 1)
+
+
+def test_truncated_branches_are_not_counted():
+    result = _explore(max_calls=20)
+
+    leaves = result["branches"]
+    finished = [leaf for leaf in leaves if not leaf["truncated"]]
+
+    assert result["truncated_count"] == len(leaves) - len(finished) > 0
+    assert result["success_rate"] == sum(leaf["complete"] for leaf in finished) / len(
+        finished
+    )
+    assert result["weighted_success_rate"] == 1.0
+
+    # Nothing is known when every branch was cut
+    assert _explore(max_calls=16)["success_rate"] is None
@@ -0,0 +1,80 @@
+from functools import partial
+
+import pandas as pd
+
+from mt_chat_code_eval.ingestion import LocalQueryClient, iter_processed, write_pages
+from mt_chat_code_eval.preprocessing import normalize_page, normalized_schema
+from mt_chat_code_eval.run_data_download import (
+    eval_data_schema,
+    get_data,
+    validation_data_schema,
+)
+
+
+def _raw_data(rows: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "url": [f"https://stackoverflow.com/questions/{i}" for i in range(rows)],
+            "id": range(rows),
+            "body": [
+                f"<p>Question {i}</p><pre><code>x = {i}</code></pre>"
+                for i in range(rows)
+            ],
+            "creation_date": pd.Timestamp("2024-01-01", tz="UTC"),
+        }
+    )
+
+
+def test_local_data_is_read_in_pages(tmp_path):
+    _raw_data(25).to_parquet(tmp_path / "evaluation.parquet")
+
+    pages = list(get_data(LocalQueryClient(str(tmp_path)), "evaluation", "", 10))
+
+    assert [len(page) for page in pages] == [10, 10, 5]
+
+
+def test_pages_are_normalized_and_written_in_order(tmp_path):
+    _raw_data(25).to_parquet(tmp_path / "evaluation.parquet")
+    path = str(tmp_path / "evaluation_data.parquet")
+
+    rows = write_pages(
+        iter_processed(
+            get_data(LocalQueryClient(str(tmp_path)), "evaluation", "", 4),
+            partial(normalize_page, columns={"question": "body"}),
+            processes=2,
+        ),
+        path,
+        normalized_schema(eval_data_schema, {"question": "body"}),
+    )
+
+    data = pd.read_parquet(path)
+    assert rows == len(data) == 25
+    assert data["id"].tolist() == list(range(25))
+    assert data["question"].str.contains("x = ").all()
+    assert "question_segments" in data
+
+
+def test_empty_result_is_written(tmp_path):
+    path = str(tmp_path / "empty.parquet")
+
+    assert write_pages(iter([]), path, eval_data_schema) == 0
+    assert pd.read_parquet(path).empty
+    assert list(pd.read_parquet(path)) == eval_data_schema.names
+
+
+def test_column_that_is_null_in_a_page_keeps_its_type(tmp_path):
+    path = str(tmp_path / "validation_data.parquet")
+    pages = [
+        _raw_data(2).assign(answer_body=None, answer_score=None),
+        _raw_data(2).assign(answer_body="<p>Answer</p>", answer_score=5),
+    ]
+    pages = [
+        page.assign(accepted_answer_id=1, answer_id=1, is_accepted=True)
+        for page in pages
+    ]
+
+    assert write_pages(iter(pages), path, validation_data_schema) == 4
+
+    data = pd.read_parquet(path)
+    assert data["answer_body"].isna().tolist() == [True, True, False, False]
+    assert data["answer_score"].tolist()[2:] == [5, 5]
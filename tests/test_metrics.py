@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from mt_chat_code_eval.metrics import (
+    get_batch_eval_metrics,
+    get_eval_metrics,
+    verdicts_from_results,
+)
+
+
+def _random_verdicts(conversations: int, with_missing: bool) -> pd.DataFrame:
+    rng = np.random.default_rng(1)
+    values = [True, False, None] if with_missing else [True, False]
+
+    return pd.DataFrame(
+        [
+            {
+                "conversation_id": conversation_id,
+                "step": step,
+                "model_name": evaluator,
+                **{
+                    criteria: values[int(rng.integers(0, len(values)))]
+                    for criteria in ["understanding", "correctness", "completeness"]
+                },
+            }
+            for conversation_id in range(conversations)
+            for step in range(int(rng.integers(1, 6)))
+            for evaluator in ["a", "b"]
+        ]
+    )
+
+
+@pytest.mark.parametrize("with_missing", [False, True])
+@pytest.mark.parametrize("achieved_steps", [False, True])
+def test_batch_metrics_match_per_conversation_metrics(with_missing, achieved_steps):
+    verdicts = _random_verdicts(200, with_missing)
+
+    batch = get_batch_eval_metrics(verdicts, achieved_steps)
+
+    for conversation_id, eval_df in verdicts.groupby("conversation_id"):
+        metrics = get_eval_metrics(
+            eval_df.drop(columns="conversation_id"), achieved_steps
+        )
+        assert {name: int(value) for name, value in metrics.items()} == {
+            name: int(value) for name, value in batch.loc[conversation_id].items()
+        }
+
+
+def test_achieved_steps():
+    verdicts = pd.DataFrame(
+        {
+            "conversation_id": [0, 0, 0],
+            "step": [0, 1, 2],
+            "model_name": ["a", "a", "a"],
+            "understanding": [True, True, True],
+            "correctness": [False, True, True],
+            "completeness": [False, False, True],
+        }
+    )
+
+    metrics = get_batch_eval_metrics(verdicts, True).loc[0]
+
+    assert metrics["steps_total"] == 3
+    assert metrics["steps_to_understanding"] == 1
+    assert metrics["steps_to_correctness"] == 2
+    assert metrics["steps_to_completeness"] == 3
+
+    # Published metrics never count the criteria as achieved before the end
+    published = get_batch_eval_metrics(verdicts).loc[0]
+    assert (published == 3).all()
+
+
+def test_verdicts_from_results():
+    results = pd.DataFrame(
+        {
+            "evaluations": [
+                [{"step": 0, "model_name": "a", "understanding": True}],
+                [],
+            ]
+        },
+        index=[10, 11],
+    )
+
+    verdicts = verdicts_from_results(results)
+
+    assert verdicts["conversation_id"].tolist() == [10]
+    assert verdicts["understanding"].tolist() == [True]
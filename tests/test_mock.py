@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from mt_chat_code_eval.conversation import (
+    ConversationTree,
+    build_conversation,
+    build_conversation_async,
+)
+from mt_chat_code_eval.llm_abstract import FALLBACK_ANSWER, ThreadedLLM
+from mt_chat_code_eval.llm_fabric import load_async_llm, load_llm, model_list
+from mt_chat_code_eval.mock import mock_settings
+from mt_chat_code_eval.policies import ShortCircuitPolicy
+from mt_chat_code_eval.telemetry import CallRecord
+
+
+def _records(llm) -> list:
+    records: list = []
+    llm.call_hooks.append(records.append)
+    return records
+
+
+def test_failures_are_retried():
+    mock_settings["failure_rate"] = 0.5
+    llm = load_llm("mock")
+    records = _records(llm)
+
+    answers = [llm.start_conversation(f"Question {i}") for i in range(20)]
+
+    assert FALLBACK_ANSWER not in answers
+    assert any(record.retries > 0 for record in records)
+
+
+def test_persistent_failure_gives_the_fallback_answer():
+    mock_settings["failure_rate"] = 1.0
+    llm = load_async_llm("mock")
+    records = _records(llm)
+
+    assert asyncio.run(llm.start_conversation("Question")) == FALLBACK_ANSWER
+    record: CallRecord = records[0]
+    assert record.retries == 5
+    assert record.error is not None
+
+
+@pytest.mark.parametrize("policy", [None, ShortCircuitPolicy()])
+def test_async_conversation_matches_blocking(policy):
+    mock_settings["incorrect_rate"] = 0.3
+    mock_settings["malformed_rate"] = 0.2
+
+    for question in [f"Question {i}" for i in range(10)]:
+        expected = build_conversation(
+            question,
+            load_llm("mock"),
+            [load_llm("mock"), load_llm("mock")],
+            seed=1,
+            policy=policy,
+        )
+        result = asyncio.run(
+            build_conversation_async(
+                question,
+                load_async_llm("mock"),
+                [load_async_llm("mock"), load_async_llm("mock")],
+                seed=1,
+                policy=policy,
+            )
+        )
+
+        assert result[:2] == expected[:2]
+        assert result[2].to_records() == expected[2].to_records()
+
+
+def test_model_without_async_class_runs_in_threads(monkeypatch):
+    # Model registered without an async entry point, e.g. by register_model
+    monkeypatch.setitem(model_list, "threaded-mock", "mt_chat_code_eval.mock:MockLLM")
+    mock_settings["incorrect_rate"] = 0.3
+
+    model = load_async_llm("threaded-mock")
+    records = _records(model)
+
+    expected = build_conversation(
+        "Question", load_llm("threaded-mock"), [load_llm("mock")], seed=1
+    )
+    result = asyncio.run(
+        build_conversation_async("Question", model, [load_async_llm("mock")], seed=1)
+    )
+
+    assert isinstance(model, ThreadedLLM)
+    assert result[:2] == expected[:2]
+    assert len(records) == len(model.turn_metrics) > 0
+
+
+def test_conversation_tree_reuses_shared_prefixes():
+    mock_settings["incorrect_rate"] = 0.3
+
+    expected = [
+        build_conversation("Question", load_llm("mock"), [load_llm("mock")], seed=seed)
+        for seed in [1, 2, 1]
+    ]
+
+    model = load_llm("mock")
+    records = _records(model)
+    tree = ConversationTree()
+    results = [
+        build_conversation("Question", model, [load_llm("mock")], seed=seed, tree=tree)
+        for seed in [1, 2, 1]
+    ]
+
+    for result, expected_result in zip(results, expected):
+        assert result[:2] == expected_result[:2]
+        assert result[2].to_records() == expected_result[2].to_records()
+
+    # Turns are either made once or taken from the tree, the repeated
+    # conversation is taken from it entirely
+    turns = [len(result[0]) // 2 for result in results]
+    assert len(records) + tree.reused_turns == sum(turns)
+    assert tree.reused_turns >= turns[2]
+    assert tree.reused_evaluations > 0
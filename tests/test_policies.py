@@ -0,0 +1,99 @@
+import pytest
+
+from mt_chat_code_eval.conversation import build_conversation
+from mt_chat_code_eval.evaluation_store import EvaluationRecord
+from mt_chat_code_eval.mock import MockLLM, mock_settings
+from mt_chat_code_eval.policies import (
+    FullPolicy,
+    ScreeningPolicy,
+    ShortCircuitPolicy,
+    evaluator_calls_saved,
+    load_policy,
+    should_stop_conversation,
+)
+
+
+def _record(understanding, correctness, completeness, followup="Why?"):
+    return EvaluationRecord(
+        0, "mock", 0, followup, understanding, correctness, completeness
+    )
+
+
+def test_should_stop_skips_missing_verdicts():
+    assert should_stop_conversation(
+        [_record(True, True, True), _record(None, True, False)]
+    )
+    assert not should_stop_conversation(
+        [_record(True, False, True), _record(True, True, True)]
+    )
+    assert not should_stop_conversation([_record(True, True, False)])
+
+
+def test_full_policy_queries_everyone_once():
+    policy = FullPolicy()
+
+    assert policy.next_wave(["a", "b"], [], []) == [0, 1]
+    assert policy.next_wave(["a", "b"], [0, 1], [_record(True, True, True)]) == []
+
+
+def test_short_circuit_stops_after_a_failed_criteria():
+    policy = ShortCircuitPolicy()
+
+    assert policy.next_wave(["a", "b", "c"], [], []) == [0]
+    assert policy.next_wave(["a", "b", "c"], [0], [_record(True, True, False)]) == [1]
+    assert policy.next_wave(["a", "b", "c"], [0], [_record(True, False, False)]) == []
+    # Without a follow-up the conversation can't continue anyway
+    assert policy.next_wave(
+        ["a", "b", "c"], [0], [_record(True, False, False, followup=None)]
+    ) == [1]
+
+
+def test_screening_asks_judges_only_if_screeners_would_stop_or_disagree():
+    policy = ScreeningPolicy(["a"])
+
+    assert policy.next_wave(["a", "b"], [], []) == [0]
+    assert policy.next_wave(["a", "b"], [0], [_record(True, False, False)]) == []
+    assert policy.next_wave(["a", "b"], [0], [_record(True, True, True)]) == [1]
+    assert policy.next_wave(["a", "b"], [0, 1], [_record(True, True, True)]) == []
+
+    with pytest.raises(ValueError):
+        policy.next_wave(["b", "a"], [], [])
+
+
+def test_load_policy():
+    assert isinstance(load_policy("short_circuit"), ShortCircuitPolicy)
+
+    with pytest.raises(ValueError):
+        load_policy("screening")
+    with pytest.raises(ValueError):
+        load_policy("unknown")
+
+
+@pytest.mark.parametrize("policy_name", ["short_circuit", "screening"])
+def test_policies_keep_the_outcome_of_the_full_policy(policy_name):
+    # Evaluators of the same mock agree on every verdict and follow-up,
+    # so a policy that queries fewer of them builds the same conversations
+    mock_settings["incorrect_rate"] = 0.3
+    evaluators = ["mock", "mock", "mock"]
+    saved = 0
+
+    for question in [f"Question {i}" for i in range(20)]:
+        full = build_conversation(
+            question,
+            MockLLM("mock"),
+            [MockLLM(name) for name in evaluators],
+            max_steps=5,
+            policy=FullPolicy(),
+        )
+        cheap = build_conversation(
+            question,
+            MockLLM("mock"),
+            [MockLLM(name) for name in evaluators],
+            max_steps=5,
+            policy=load_policy(policy_name, ["mock"]),
+        )
+
+        assert cheap[:2] == full[:2]
+        saved += evaluator_calls_saved(cheap[2].to_records(), len(evaluators))
+
+    assert saved > 0
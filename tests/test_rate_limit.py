@@ -0,0 +1,42 @@
+import pytest
+
+from mt_chat_code_eval import rate_limit
+from mt_chat_code_eval.clients import local_models, register_local_model
+from mt_chat_code_eval.llm_fabric import load_llm, model_provider
+from mt_chat_code_eval.rate_limit import get_rate_limiters, parse_rate_limits
+
+
+@pytest.fixture(autouse=True)
+def rate_limiters(monkeypatch):
+    monkeypatch.setattr(rate_limit, "_rate_limiters", {})
+
+
+def test_limits_of_models_and_providers():
+    parse_rate_limits(["mock=60:1000", "aimlapi=30"], model_provider)
+
+    assert len(get_rate_limiters("mock", "mock")) == 1
+    assert get_rate_limiters("mock", "other") == []
+    assert len(get_rate_limiters("aimlapi", "codellama/CodeLlama-7b-Instruct-hf")) == 1
+    assert get_rate_limiters("openai", "gpt-4o") == []
+
+
+def test_model_and_provider_limits_both_apply():
+    parse_rate_limits(["mock=60", "mock=120"], lambda name: None)
+    parse_rate_limits(["mock=60"], model_provider)
+
+    limiters = get_rate_limiters("mock", "mock")
+    assert len(limiters) == 2
+
+    llm = load_llm("mock")
+    llm.start_conversation("Question")
+    assert all(
+        limiter.requests._tokens < limiter.requests.capacity for limiter in limiters
+    )
+
+
+def test_local_model_is_limited_by_its_server():
+    register_local_model("local-limited", "http://localhost:1/v1")
+
+    assert model_provider("local-limited") == "local:http://localhost:1/v1"
+    assert model_provider("unknown-model") is None
+    local_models.pop("local-limited")
@@ -0,0 +1,54 @@
+import pandas as pd
+
+from mt_chat_code_eval.result_store import leaderboard, query, write_results
+
+
+def _results(complete, max_steps, stop_policy):
+    return pd.DataFrame(
+        {
+            "complete": complete,
+            "steps_total": [2] * len(complete),
+            "max_steps": max_steps,
+            "stop_policy": stop_policy,
+            "conversation": [["Q", "A"]] * len(complete),
+        }
+    )
+
+
+def test_runs_are_written_apart_from_transcripts(tmp_path):
+    partition = {"model": "a/b", "evaluators": "c", "date": "2024-09-01"}
+    write_results(
+        _results([True, False], 5, "full"),
+        str(tmp_path),
+        "evaluation",
+        partition,
+        "run",
+    )
+
+    metrics = query(str(tmp_path), columns=["model", "complete"])
+
+    assert metrics["model"].tolist() == ["a/b", "a/b"]
+    assert "conversation" not in query(str(tmp_path))
+
+
+def test_leaderboard_ranks_run_parameters_apart(tmp_path):
+    partition = {"model": "a", "evaluators": "c", "date": "2024-09-01"}
+    root = str(tmp_path)
+
+    write_results(_results([True, True], 5, "full"), root, "evaluation", partition, "1")
+    write_results(
+        _results([False, True], 3, "full"), root, "evaluation", partition, "2"
+    )
+    write_results(
+        _results([False, False], 5, "short_circuit"), root, "evaluation", partition, "3"
+    )
+    write_results(_results([True, False], 5, None), root, "evaluation", partition, "4")
+
+    board = leaderboard(root)
+
+    assert len(board) == 4
+    assert board["complete"].tolist() == [1.0, 0.5, 0.5, 0.0]
+    assert board.loc[0, ["max_steps", "stop_policy"]].tolist() == [5, "full"]
+
+    filtered = leaderboard(root, [("max_steps", "=", 5), ("stop_policy", "=", "full")])
+    assert len(filtered) == 1
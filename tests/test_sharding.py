@@ -0,0 +1,89 @@
+import pandas as pd
+import pytest
+
+from mt_chat_code_eval.sharding import (
+    JobQueue,
+    merge_shards,
+    parse_shard,
+    run_id,
+    select_shard,
+    shard_run_name,
+)
+
+
+def test_parse_shard():
+    assert parse_shard("1/4") == (1, 4)
+
+    for value in ["4/4", "-1/4", "1", "a/b", "0/0"]:
+        with pytest.raises(ValueError):
+            parse_shard(value)
+
+
+def test_merged_shards_are_the_unsharded_results(tmp_path):
+    data = pd.DataFrame({"value": range(10)}, index=[f"q{i}" for i in range(10)])
+
+    paths = []
+    for index in range(3):
+        path = str(tmp_path / f"{shard_run_name('run', (index, 3))}.parquet")
+        select_shard(data, (index, 3)).to_parquet(path)
+        paths.append(path)
+
+    pd.testing.assert_frame_equal(merge_shards(paths), data.sort_index())
+    assert select_shard(data, None) is data
+
+
+def test_merge_checks_the_shards(tmp_path):
+    data = pd.DataFrame({"value": range(4)})
+    path = str(tmp_path / "shard.parquet")
+    data.to_parquet(path)
+
+    with pytest.raises(ValueError):
+        merge_shards([path, path])
+    with pytest.raises(FileNotFoundError):
+        merge_shards([path, str(tmp_path / "missing.parquet")])
+
+
+def test_job_queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "queue.sqlite"))
+    commands = [["-m", "runner", "--shard", f"{i}/2"] for i in range(2)]
+
+    queue.add("run", commands)
+    queue.add("run", commands)
+
+    first = queue.claim("worker-1")
+    second = queue.claim("worker-2")
+    assert first is not None and second is not None
+    assert [first[1], second[1]] == commands
+    assert queue.claim("worker-3") is None
+
+    queue.finish(first[0], True)
+    queue.finish(second[0], False)
+    assert queue.counts("run") == {"done": 1, "failed": 1}
+    assert queue.failed("run") == [commands[1]]
+
+    # Coordinator restart gives the failed job back, the done one stays done
+    queue.add("run", commands)
+    assert queue.counts("run") == {"done": 1, "pending": 1}
+    queue.close()
+
+
+def test_stale_jobs_are_requeued(tmp_path):
+    queue = JobQueue(str(tmp_path / "queue.sqlite"))
+    queue.add("run", [["-m", "runner"]])
+    queue.claim("worker-1")
+
+    assert queue.requeue_stale(timeout=60) == 0
+    assert queue.requeue_stale(timeout=-1) == 1
+    assert queue.claim("worker-2") is not None
+    queue.close()
+
+
+def test_run_id_depends_on_the_input_files(tmp_path):
+    data = tmp_path / "data.parquet"
+    data.write_bytes(b"1")
+    commands = [["-m", "runner", str(data)]]
+
+    before = run_id(commands)
+    data.write_bytes(b"12")
+
+    assert run_id(commands) != before
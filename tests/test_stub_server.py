@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from mt_chat_code_eval.clients import local_models, register_local_model
+from mt_chat_code_eval.conversation import build_conversation, build_conversation_async
+from mt_chat_code_eval.llm_fabric import (
+    async_model_list,
+    load_async_llm,
+    load_llm,
+    model_list,
+    register_model,
+)
+from mt_chat_code_eval.mock import MockLLM
+from mt_chat_code_eval.streaming import StreamBudget
+from mt_chat_code_eval.stub_server import StubHandler
+
+
+@pytest.fixture
+def local_model(stub_server):
+    register_local_model("local-model", stub_server, served_model="stub-model")
+    register_model(
+        "local-model",
+        "mt_chat_code_eval.open_ai:LocalOpenAI",
+        "mt_chat_code_eval.open_ai:AsyncLocalOpenAI",
+    )
+    yield "local-model"
+    for models in [model_list, async_model_list, local_models]:
+        models.pop("local-model")
+
+
+def test_local_model_answers_like_the_mock(local_model):
+    llm = load_llm(local_model)
+    mock = MockLLM("stub-model")
+
+    assert llm.start_conversation("Question") == mock.start_conversation("Question")
+    assert llm.continue_conversation("More") == mock.continue_conversation("More")
+    assert llm.get_current_conversation() == mock.get_current_conversation()
+
+
+def test_local_models_are_cached_per_server(local_model, stub_server):
+    llm = load_llm(local_model)
+
+    assert llm.api_model_name == "stub-model"
+    assert llm.cache_namespace == f"local:{stub_server}/stub-model"
+
+
+def test_local_model_conversation(local_model):
+    conversation, is_successful, evaluations = build_conversation(
+        "Question", load_llm(local_model), [load_llm(local_model)], max_steps=3
+    )
+
+    assert is_successful
+    assert len(conversation) == 4
+    assert len(evaluations) == 2
+    # Next turns share the prefix of the conversation with the previous ones
+    assert StubHandler.cache.stats["cached_tokens"] > 0
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_async_local_model_matches_blocking(local_model, stream):
+    model = load_llm(local_model)
+    async_model = load_async_llm(local_model)
+    if stream:
+        model.stream_budget = StreamBudget()
+        async_model.stream_budget = StreamBudget()
+
+    expected = build_conversation("Question", model, [load_llm(local_model)])
+    result = asyncio.run(
+        build_conversation_async("Question", async_model, [load_async_llm(local_model)])
+    )
+
+    assert result[:2] == expected[:2]
+    assert result[2].to_records() == expected[2].to_records()
+    if stream:
+        assert "time_to_first_token" in model.turn_metrics[-1]